@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ============================================================================
+# batch_client.py  -  stereo / 多相機：一個 request 送 M 張，一次拿回各相機的角點
+#
+# EuRoC 的 cam0 / cam1 一張一張送要兩個 RTT、兩次回應；REQ_BATCH (見 protocol.py)
+# 把同一時刻的 M 張放進一個 request，server 在板子上連續跑完才回一次：
+#   send_batch(sock, fid, [img0, img1], cams=[0, 1])
+#   for cam, pts, truncated in recv_batch(sock, fid): ...
+# CLI 比較三種送法的每組延遲 (client 端量，送出 -> 收完)：
+#   single   只送一張 (下限：一張 frame)
+#   serial   cam0、cam1 各送一個 request，依序等回應
+#   batch    REQ_BATCH 一次送完
+#   python3 batch_client.py --host 192.168.2.99 --cams MH01/mav0/cam0/data,MH01/mav0/cam1/data
+#   python3 batch_client.py --local emu --frames 50          # 沒有板子：loopback 起 server.py
+# ============================================================================
+import time
+import socket
+import argparse
+from types import SimpleNamespace
+import numpy as np
+from protocol import (MAGIC, VERSION, REQ_V2, RESP_V2, BATCH_V2, CAM_V2, SECT_V2, MAX_BATCH,
+                      REQ_BATCH, RESP_TRUNCATED, RESP_BATCH)
+from board_pool import recv_exact_into
+
+def send_batch(sock, fid, frames, cams=None, flags=0, ext=b""):
+    # frames：同尺寸的 (H, W) uint8；cams：各張的 cam_id (預設 0..M-1)；ext：REQ_SELECT 的 SEL_V2
+    M = len(frames)
+    if not 1 <= M <= MAX_BATCH: raise ValueError(f"batch of {M} frames (1..{MAX_BATCH})")
+    H, W = frames[0].shape
+    if any(f.shape != (H, W) for f in frames): raise ValueError("frames in a batch must have the same size")
+    sock.sendall(REQ_V2.pack(MAGIC, VERSION, flags | REQ_BATCH, fid, H, W) + ext + BATCH_V2.pack(M, 0))
+    for cam, img in zip(cams if cams is not None else range(M), frames):
+        sock.sendall(CAM_V2.pack(cam, 0))
+        sock.sendall(np.ascontiguousarray(img, dtype=np.uint8))
+
+def recv_batch(sock, fid):
+    # -> [(cam_id, pts (N, 4) '<u2', truncated)]，依 request 的順序
+    hdr = bytearray(RESP_V2.size)
+    recv_exact_into(sock, memoryview(hdr))
+    magic, ver, flags, rid, M = RESP_V2.unpack(hdr)
+    if magic != MAGIC or rid != fid or not flags & RESP_BATCH:
+        raise ConnectionError(f"unexpected response (flags={flags:#x}, frame_id={rid}, want {fid})")
+    sect = bytearray(SECT_V2.size)
+    out = []
+    for _ in range(M):
+        recv_exact_into(sock, memoryview(sect))
+        cam, sflags, N = SECT_V2.unpack(sect)
+        pts = np.empty((N, 4), dtype="<u2")
+        if N: recv_exact_into(sock, memoryview(pts).cast("B"))
+        out.append((cam, pts, bool(sflags & RESP_TRUNCATED)))
+    return out
+
+def send_frame(sock, fid, img):
+    H, W = img.shape
+    sock.sendall(REQ_V2.pack(MAGIC, VERSION, 0, fid, H, W))
+    sock.sendall(np.ascontiguousarray(img, dtype=np.uint8))
+
+def recv_frame(sock, fid):
+    hdr = bytearray(RESP_V2.size)
+    recv_exact_into(sock, memoryview(hdr))
+    magic, ver, flags, rid, N = RESP_V2.unpack(hdr)
+    if magic != MAGIC or rid != fid:
+        raise ConnectionError(f"unexpected response (frame_id={rid}, want {fid})")
+    pts = np.empty((N, 4), dtype="<u2")
+    if N: recv_exact_into(sock, memoryview(pts).cast("B"))
+    return pts
+
+def main():
+    from loadgen import DEFAULT_PORT, SERVER_PY, synthetic_frames, dataset_frames, start_local_server
+    ap = argparse.ArgumentParser(description="Multi-camera batches (REQ_BATCH) vs one request per camera")
+    ap.add_argument("--host", default="192.168.2.99")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--cams", default=None, metavar="DIR0,DIR1[,...]",
+                    help="One image directory / frame cache per camera (same frame count and order); "
+                         "default: synthetic stereo pair")
+    ap.add_argument("--size", default="752x480", help="WxH (frames are resized if needed)")
+    ap.add_argument("--frames", type=int, default=100)
+    ap.add_argument("--local", choices=["cpu", "emu"], default=None,
+                    help="start a software server on loopback instead of --host")
+    args = ap.parse_args()
+    W, H = map(int, args.size.lower().split("x"))
+    if args.cams:
+        cams = [dataset_frames(d, W, H, args.frames) for d in args.cams.split(",")]
+    else:
+        left = synthetic_frames(W, H)
+        cams = [left, [np.roll(f, -8, axis=1) for f in left]]      # 右相機：水平視差 8 px
+    M = len(cams)
+    n = min(len(c) for c in cams)
+
+    proc = None
+    try:
+        host, port = args.host, args.port
+        if args.local:
+            sa = SimpleNamespace(server_py=SERVER_PY, local_server=args.local, server_depth=1, connections=1,
+                                 server_arg=[], server_log=None)
+            proc, port = start_local_server(sa)
+            host = "127.0.0.1"
+        sock = socket.create_connection((host, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        lat = dict(single=[], serial=[], batch=[])
+        mismatch = 0
+        fid = 0
+        for i in range(args.frames):
+            frames = [c[i % n] for c in cams]
+            # single 送最後一台：emu 的 line buffer 會帶到下一張，這樣 serial 與 batch
+            # 每一張的前一張都相同，結果才能逐點比對
+            t0 = time.perf_counter()
+            send_frame(sock, fid, frames[-1]); recv_frame(sock, fid); fid += 1
+            t1 = time.perf_counter()
+            ref = []
+            for img in frames:
+                send_frame(sock, fid, img); ref.append(recv_frame(sock, fid)); fid += 1
+            t2 = time.perf_counter()
+            send_batch(sock, fid, frames)
+            got = recv_batch(sock, fid); fid += 1
+            t3 = time.perf_counter()
+            if i == 0: continue             # 第一組含 server 端第一次配置 buffer
+            lat['single'].append(t1 - t0); lat['serial'].append(t2 - t1); lat['batch'].append(t3 - t2)
+            if [cam for cam, _, _ in got] != list(range(M)) or \
+               not all(np.array_equal(p, r) for (_, p, _), r in zip(got, ref)):
+                mismatch += 1
+        sock.close()
+        print(f"[Batch] {args.frames - 1} sets of {M} x {W}x{H}, "
+              f"{args.frames - 1 - mismatch}/{args.frames - 1} batches identical to per-camera requests")
+        for k, v in lat.items():
+            v = np.array(v) * 1e3
+            print(f"[Batch] {k:<7} p50 {np.percentile(v, 50):7.2f} ms  p95 {np.percentile(v, 95):7.2f} ms  "
+                  f"max {v.max():7.2f} ms")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try: proc.wait(10)
+            except Exception: proc.kill()
+
+if __name__ == "__main__":
+    main()
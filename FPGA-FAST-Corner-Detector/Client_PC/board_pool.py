@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ============================================================================
+# board_pool.py  -  多塊板子 (多個 server) 分攤 frame 的 client 連線池
+#
+# 一塊 PYNQ 的 throughput 有上限，多塊板子時由 BoardPool 對每個 host:port 保持
+# 一條 protocol v2 的長連線：
+#   - submit(img) 把 frame 排進 backlog；dispatcher thread 每次挑在路上張數最少
+#     的板子送出，每塊最多 inflight 張 (server 依序回應，所以每塊一個 FIFO)
+#   - 每塊板子一個 receiver thread 收回應；get() 依 submit 的順序交回結果
+#   - 板子斷線、送收失敗或超過 timeout 沒回應時移出連線池，它還在路上的 frame
+#     放回 backlog 最前面，由其他板子重做；全部板子都掉了 get() 才丟出錯誤
+# submit 的影像在 get() 拿到結果前不能改 (重送時還要用)。
+#
+#   python3 board_pool.py --boards 192.168.2.99:9092,192.168.2.100:9092 --source /path/to/images
+#   python3 board_pool.py --local cpu --local-boards 3 --frames 300 [--fail-after 1.0]
+# --local 在 loopback 起幾個 server.py (軟體 backend)，沒有板子也能測分流與
+# 斷線重分配；--fail-after 會在跑到一半時關掉第一個 server。
+# ============================================================================
+import time
+import socket
+import argparse
+import threading
+import collections
+from types import SimpleNamespace
+import numpy as np
+from protocol import MAGIC, VERSION, REQ_V2, RESP_V2, POINT_BYTES, RESP_TRUNCATED
+
+def recv_exact_into(sock, mv):
+    got = 0; n = len(mv)
+    while got < n:
+        k = sock.recv_into(mv[got:], n - got)
+        if k == 0: raise ConnectionError("EOF")
+        got += k
+
+class Board:
+    def __init__(self, host, port, timeout):
+        self.host, self.port = host, port
+        self.name = f"{host}:{port}"
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.inflight = collections.deque()     # 已送出的 frame (依送出順序)
+        self.alive = True
+        self.fid = 0                            # 這條連線上的 frame id
+        self.served = 0
+        self.busy_s = 0.0                       # 送出 -> 收完 的時間總和
+        self.t_last = 0.0                       # 上一次派給它的時間
+        self.error = None
+
+class BoardPool:
+    """endpoints: [(host, port), ...]。連不上的板子直接略過 (至少要有一塊)。"""
+    def __init__(self, endpoints, inflight=2, timeout=5.0, max_pending=0):
+        self.limit = max(1, inflight)
+        self.cv = threading.Condition()
+        self.backlog = collections.deque()      # [seq, img, flags, ext, t_sent]
+        self.done = {}                          # seq -> (pts, truncated, board name)
+        self.next_seq = 0                       # 下一個 submit 的編號
+        self.next_out = 0                       # 下一個 get 要交回的編號
+        self.closed = False
+        self.boards = []
+        for host, port in endpoints:
+            try:
+                self.boards.append(Board(host, port, timeout))
+            except OSError as e:
+                print(f"[Pool] {host}:{port} unreachable: {e}")
+        if not self.boards:
+            raise ConnectionError("no board reachable")
+        self.max_pending = max_pending or 2 * self.limit * len(self.boards)
+        self.threads = [threading.Thread(target=self._dispatch, daemon=True)]
+        self.threads += [threading.Thread(target=self._receive, args=(b,), daemon=True) for b in self.boards]
+        for th in self.threads: th.start()
+
+    def alive(self):
+        return [b for b in self.boards if b.alive]
+
+    # ---------- caller 端 ----------
+    def submit(self, img, flags=0, ext=b""):
+        # -> seq；未交回的張數達到 max_pending 時擋住 (backpressure)
+        with self.cv:
+            while self.next_seq - self.next_out >= self.max_pending and self.alive() and not self.closed:
+                self.cv.wait()
+            if not self.alive(): raise ConnectionError("all boards failed")
+            seq = self.next_seq; self.next_seq += 1
+            self.backlog.append([seq, img, flags, ext, 0.0])
+            self.cv.notify_all()
+            return seq
+
+    def get(self, timeout=None):
+        # 依 submit 順序 -> (seq, pts, truncated, board name)；pts 是 (N, 4) '<u2'
+        with self.cv:
+            ok = self.cv.wait_for(lambda: self.next_out in self.done or not self.alive(), timeout)
+            if self.next_out not in self.done:
+                if not ok: raise TimeoutError(f"frame {self.next_out} not done")
+                raise ConnectionError("all boards failed")
+            seq = self.next_out; self.next_out += 1
+            res = self.done.pop(seq)
+            self.cv.notify_all()
+            return (seq,) + res
+
+    def close(self):
+        with self.cv:
+            self.closed = True
+            self.cv.notify_all()
+        for b in self.boards:
+            try: b.sock.close()
+            except OSError: pass
+
+    def summary(self):
+        return ", ".join(f"{b.name} {b.served} frames"
+                         + (f" {b.busy_s * 1000.0 / b.served:.1f} ms" if b.served else "")
+                         + ("" if b.alive else f" (removed: {b.error})") for b in self.boards)
+
+    # ---------- thread ----------
+    def _dispatch(self):
+        while True:
+            with self.cv:
+                while not self.closed:
+                    ready = [b for b in self.boards if b.alive and len(b.inflight) < self.limit]
+                    if self.backlog and ready: break
+                    self.cv.wait()
+                if self.closed: return
+                # 在路上最少的優先；同樣多時輪流 (最久沒派到的)
+                b = min(ready, key=lambda b: (len(b.inflight), b.t_last))
+                item = self.backlog.popleft()
+                fid = b.fid; b.fid = (b.fid + 1) & 0xFFFFFFFF
+                item[4] = b.t_last = time.perf_counter()
+                b.inflight.append((fid, item))
+                self.cv.notify_all()
+            seq, img, flags, ext, _ = item
+            H, W = img.shape
+            try:
+                b.sock.sendall(REQ_V2.pack(MAGIC, VERSION, flags, fid, H, W) + ext)
+                b.sock.sendall(img)
+            except OSError as e:
+                self._fail(b, e)
+
+    def _receive(self, b):
+        hdr = bytearray(RESP_V2.size); hdr_mv = memoryview(hdr)
+        try:
+            while True:
+                with self.cv:
+                    self.cv.wait_for(lambda: b.inflight or self.closed or not b.alive)
+                    if self.closed or not b.alive: return
+                    fid, item = b.inflight[0]
+                # socket timeout：有 frame 在路上卻超過 timeout 沒回應 -> 移出
+                recv_exact_into(b.sock, hdr_mv)
+                magic, ver, rflags, rfid, N = RESP_V2.unpack(hdr)
+                if magic != MAGIC or ver != VERSION:
+                    raise ValueError("server did not answer with protocol v2")
+                if rfid != fid:
+                    raise ValueError(f"reply out of order: expected {fid}, got {rfid}")
+                pts = np.empty((N, 4), dtype="<u2")
+                recv_exact_into(b.sock, memoryview(pts).cast('B')[:N * POINT_BYTES])
+                with self.cv:
+                    if not b.alive: return
+                    b.inflight.popleft()
+                    b.served += 1
+                    b.busy_s += time.perf_counter() - item[4]
+                    self.done[item[0]] = (pts, bool(rflags & RESP_TRUNCATED), b.name)
+                    self.cv.notify_all()
+        except Exception as e:
+            if not self.closed: self._fail(b, e)
+
+    def _fail(self, b, err):
+        with self.cv:
+            if not b.alive: return
+            b.alive = False
+            b.error = "timeout" if isinstance(err, socket.timeout) else str(err) or type(err).__name__
+            items = [item for _, item in b.inflight]
+            b.inflight.clear()
+            self.backlog.extendleft(reversed(items))     # 重做的排在最前面，順序不變
+            self.cv.notify_all()
+        try: b.sock.close()
+        except OSError: pass
+        print(f"[Pool] board {b.name} removed ({b.error}), {len(items)} frames redistributed, "
+              f"{len(self.alive())} boards left")
+
+# ================= CLI =================
+def parse_endpoints(text):
+    out = []
+    for tok in text.split(","):
+        host, _, port = tok.strip().rpartition(":")
+        if not host or not port.isdigit(): raise SystemExit(f"--boards expects HOST:PORT, got {tok!r}")
+        out.append((host, int(port)))
+    return out
+
+def main():
+    from loadgen import synthetic_frames, dataset_frames, start_local_server, SERVER_PY
+    ap = argparse.ArgumentParser(description="Shard frames across several FAST corner servers")
+    ap.add_argument("--boards", default=None, metavar="HOST:PORT[,HOST:PORT...]")
+    ap.add_argument("--local", choices=["emu", "cpu"], default=None,
+                    help="Start --local-boards server.py instances with this software backend on loopback")
+    ap.add_argument("--local-boards", type=int, default=2)
+    ap.add_argument("--source", default="synthetic", help="'synthetic', an image directory or a frame cache")
+    ap.add_argument("--size", default="752x480", help="WxH (synthetic frames, or resize the dataset)")
+    ap.add_argument("--frames", type=int, default=300, help="Frames to send")
+    ap.add_argument("--inflight", type=int, default=2, help="Frames in flight per board")
+    ap.add_argument("--timeout", type=float, default=5.0, help="Remove a board that does not answer in this many s")
+    ap.add_argument("--fail-after", type=float, default=0.0,
+                    help="[local] stop the first server after this many seconds (failover test)")
+    args = ap.parse_args()
+    W, H = map(int, args.size.lower().split("x"))
+    frames = synthetic_frames(W, H) if args.source == "synthetic" else dataset_frames(args.source, W, H, args.frames)
+
+    procs = []
+    try:
+        if args.local:
+            sa = SimpleNamespace(server_py=SERVER_PY, local_server=args.local, server_depth=args.inflight,
+                                 connections=1, server_arg=[], server_log=None)
+            for _ in range(args.local_boards):
+                procs.append(start_local_server(sa))
+            endpoints = [("127.0.0.1", port) for _, port in procs]
+        elif args.boards:
+            endpoints = parse_endpoints(args.boards)
+        else:
+            ap.error("give --boards or --local")
+        pool = BoardPool(endpoints, inflight=args.inflight, timeout=args.timeout)
+        print(f"[Pool] {len(pool.boards)} boards, {args.inflight} in flight each")
+        if args.fail_after > 0 and procs:
+            threading.Timer(args.fail_after, procs[0][0].terminate).start()
+
+        def feed():
+            try:
+                for i in range(args.frames): pool.submit(frames[i % len(frames)])
+            except ConnectionError as e:
+                print(f"[Pool] submit stopped: {e}")
+        threading.Thread(target=feed, daemon=True).start()
+        t0 = time.perf_counter()
+        n_pts = 0
+        for i in range(args.frames):
+            seq, pts, truncated, board = pool.get()
+            if seq != i: raise SystemExit(f"result {seq} returned for frame {i}")
+            n_pts += len(pts)
+        wall = time.perf_counter() - t0
+        print(f"[Pool] {args.frames} frames in order, {args.frames / wall:.1f} FPS, "
+              f"{n_pts / args.frames:.1f} corners/frame")
+        print(f"[Pool] {pool.summary()}")
+        pool.close()
+    finally:
+        for proc, _ in procs:
+            proc.terminate()
+            try: proc.wait(10)
+            except Exception: proc.kill()
+
+if __name__ == "__main__":
+    main()
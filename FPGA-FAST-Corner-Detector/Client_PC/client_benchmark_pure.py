@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 import os
 import glob
-import sys
+import argparse
+import json
 import socket
 import struct
+import threading
 import time
 import numpy as np
 import cv2
+from frame_cache import open_frames
+from protocol import (MAGIC, VERSION, REQ_V2, RESP_V2, SEL_V2, POINT_BYTES, REQ_STATS, REQ_INCREMENTAL,
+                      REQ_SELECT, REQ_STRONG_ONLY, RESP_CTRL)
 
 # ================= 設定區 =================
 DEFAULT_IMG_DIR = "/home/user/Datasets/EuRoc/MH01/mav0/cam0/data" # you have to motify it to your path
@@ -14,29 +19,164 @@ DEFAULT_HOST = "192.168.2.99"
 DEFAULT_PORT = 9092
 # =========================================
 
-def main():
-    img_dir = DEFAULT_IMG_DIR
-    if len(sys.argv) > 1: img_dir = sys.argv[1]
+def recv_exact_into(sock, mv):
+    got = 0; n = len(mv)
+    while got < n:
+        k = sock.recv_into(mv[got:], n - got)
+        if k == 0: raise ConnectionError("EOF")
+        got += k
 
-    # 1. 預先讀取所有圖片到記憶體 (排除硬碟 I/O 影響)
-    print("正在預先載入圖片到記憶體...")
-    exts = ['*.png', '*.jpg', '*.jpeg']
-    files = sorted([f for e in exts for f in glob.glob(os.path.join(img_dir, e))])
-    
-    # 只取前 500 張來測就好，不用全部
-    files = files[:500] 
-    if not files:
-        print("找不到圖片"); return
+def query_stats(sock, frame_id=0xFFFFFFFF):
+    # protocol v2 控制訊息：取回 server 各 stage 的延遲直方圖摘要 (JSON)
+    sock.sendall(REQ_V2.pack(MAGIC, VERSION, REQ_STATS, frame_id, 0, 0))
+    hdr = bytearray(RESP_V2.size)
+    recv_exact_into(sock, memoryview(hdr))
+    magic, ver, flags, fid, n = RESP_V2.unpack(hdr)
+    if magic != MAGIC or not (flags & RESP_CTRL):
+        raise ValueError("unexpected reply to stats query")
+    body = bytearray(n)
+    recv_exact_into(sock, memoryview(body))
+    return json.loads(body.decode())
+
+def print_stats(stats):
+    stats = dict(stats)
+    boot = stats.pop("startup", None)
+    if boot:
+        print(f"[startup] ready in {boot['ready_s']:.2f} s ("
+              + ", ".join(f"{k} {v:.2f}" for k, v in boot['phases'].items()) + ")")
+    energy = stats.pop("energy", None)
+    if energy:
+        line = f"[energy] {energy['frames']} frames, {energy['cpu_util']:.2f} cores"
+        if energy['cpu_s_per_frame'] is not None: line += f", {energy['cpu_s_per_frame'] * 1e3:.3f} ms CPU/frame"
+        if 'joules' in energy:
+            line += f", {energy['watts']:.2f} W, {energy['frames_per_joule']} frames/J"
+        print(line)
+    for res, d in stats.pop("incremental", {}).items():
+        print(f"[incremental {res}] {d['frames']} frames, {d['tiles_per_frame']} tiles/frame, "
+              f"{d['reuse']*100:.1f}% tiles reused")
+    for cid, d in stats.pop("adaptive", {}).items():
+        print(f"[adaptive {cid}] threshold {d['threshold']} in {d['range'][0]}..{d['range'][1]}, "
+              f"last {d['last']} corners, {d['in_band']*100:.1f}% of frames in {d['target'][0]}..{d['target'][1]}")
+    for backend, per_res in stats.items():
+        for res, stages in per_res.items():
+            print(f"[{backend} {res}] server stage latency (ms)")
+            print(f"  {'stage':<11} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+            for st, d in stages.items():
+                print(f"  {st:<11} {d['p50']:>8.3f} {d['p95']:>8.3f} {d['p99']:>8.3f} {d['max']:>8.3f}")
+
+def request_options(args):
+    # CLI -> (flags, header 後面接的 bytes)：incremental / server 端挑選角點
+    flags = REQ_INCREMENTAL if args.incremental else 0
+    if args.strong_only: flags |= REQ_STRONG_ONLY
+    ext = b""
+    if args.top_k or args.grid:
+        cols, _, rows = (args.grid or "0x0").lower().partition("x")
+        flags |= REQ_SELECT
+        ext = SEL_V2.pack(args.top_k, args.per_cell if args.grid else 0, int(cols), int(rows))
+    return flags, ext
+
+def run_inflight(sock, images_data, K, flags=0, ext=b""):
+    # protocol v2：送的一邊最多超前 K 張，收的一邊在另一條 thread 依序核對 frame_id
+    n = len(images_data)
+    t_send = [0.0] * n
+    t_done = [0.0] * n
+    n_pts = [0] * n
+    window = threading.Semaphore(K)
+    errs = []
+
+    def receiver():
+        hdr = bytearray(RESP_V2.size); hdr_mv = memoryview(hdr)
+        body = np.empty((8192, 4), dtype="<u2")
+        try:
+            for i in range(n):
+                recv_exact_into(sock, hdr_mv)
+                magic, ver, flags, fid, N = RESP_V2.unpack(hdr)
+                if magic != MAGIC or ver != VERSION:
+                    raise ValueError("server did not answer with protocol v2 (old server.py?)")
+                if fid != i:
+                    raise ValueError(f"reply out of order: expected frame {i}, got {fid}")
+                if N > len(body): body = np.empty((N, 4), dtype="<u2")
+                # 直接收進重複使用的 (N, 4) '<u2' 陣列
+                recv_exact_into(sock, memoryview(body).cast('B')[:N * POINT_BYTES])
+                t_done[i] = time.perf_counter()
+                n_pts[i] = N
+                window.release()
+        except Exception as e:
+            errs.append(e)
+            window.release()
+
+    th = threading.Thread(target=receiver, daemon=True)
+    th.start()
+    for i, (H, W, body) in enumerate(images_data):
+        window.acquire()
+        if errs: break
+        t_send[i] = time.perf_counter()
+        sock.sendall(REQ_V2.pack(MAGIC, VERSION, flags, i, H, W) + ext)
+        sock.sendall(body)
+        if i % 50 == 0:
+            print(f"Frame {i}: sent ({K} in flight)")
+    th.join()
+    if errs: raise errs[0]
+    return t_send, t_done, n_pts
 
+def report_stats(sock, dest):
+    if dest is None: return
+    try:
+        stats = query_stats(sock)
+    except Exception as e:
+        print(f"stats 查詢失敗: {e}"); return
+    if dest == "-":
+        print_stats(stats)
+    else:
+        with open(dest, "w") as f: json.dump(stats, f, indent=2)
+        print(f"server stats 已存到 {dest}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("img_dir", nargs="?", default=DEFAULT_IMG_DIR,
+                    help="Image directory, or a frame cache directory (frame_cache.py)")
+    ap.add_argument("--cache", default=None, metavar="DIR",
+                    help="Use this frame cache for img_dir; decoded once into it if it does not exist yet")
+    ap.add_argument("--host", default=DEFAULT_HOST)
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--inflight", type=int, default=1,
+                    help="Frames kept in flight (protocol v2); 1 = original send-then-wait loop")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Ask the server to recompute only changed tiles (REQ_INCREMENTAL; implies protocol v2)")
+    ap.add_argument("--top-k", type=int, default=0,
+                    help="Server returns only the K highest-score corners (REQ_SELECT; implies protocol v2)")
+    ap.add_argument("--grid", default=None, metavar="CxR",
+                    help="Server keeps at most --per-cell corners per cell of a C x R grid (REQ_SELECT)")
+    ap.add_argument("--per-cell", type=int, default=1)
+    ap.add_argument("--strong-only", action="store_true", help="Server returns only is_strong corners")
+    ap.add_argument("--stats", nargs="?", const="-", default=None, metavar="JSON",
+                    help="Query the server's per-stage latency histograms after the run (print, or save to JSON)")
+    args = ap.parse_args()
+    img_dir = args.img_dir
+
+    # 1. 準備影像：frame cache (mmap，不解碼也不複製，payload 直接從 mmap 送)，
+    #    沒有 cache 時照舊預先讀取所有圖片到記憶體 (排除硬碟 I/O 影響)
     images_data = []
-    for f in files:
-        img = cv2.imread(f, cv2.IMREAD_GRAYSCALE)
-        if img is not None:
-            H, W = img.shape
-            # 預先打包好 Header 和 Body
-            header = struct.pack("<HH", H, W)
-            body = img.tobytes()
-            images_data.append((header, body, len(body)))
+    fc = open_frames(img_dir, args.cache)
+    if fc is not None:
+        # 只取前 500 張來測就好，不用全部
+        images_data = [(f.shape[0], f.shape[1], f) for f in fc[:500]]
+        print(f"Frame cache: {fc.path} ({len(fc)} frames)")
+    else:
+        print("正在預先載入圖片到記憶體...")
+        exts = ['*.png', '*.jpg', '*.jpeg']
+        files = sorted([f for e in exts for f in glob.glob(os.path.join(img_dir, e))])
+        
+        # 只取前 500 張來測就好，不用全部
+        files = files[:500] 
+        for f in files:
+            img = cv2.imread(f, cv2.IMREAD_GRAYSCALE)
+            if img is not None:
+                H, W = img.shape
+                # 預先轉好 Body，Header 送的時候再打包 (v2 要放 frame_id)
+                images_data.append((H, W, img.tobytes()))
+    if not images_data:
+        print("找不到圖片"); return
     
     print(f"已載入 {len(images_data)} 張圖片，開始連接 Server...")
 
@@ -44,11 +184,34 @@ def main():
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(20.0)
     try:
-        sock.connect((DEFAULT_HOST, DEFAULT_PORT))
+        sock.connect((args.host, args.port))
         sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     except Exception as e:
         print(f"連線失敗: {e}"); return
 
+    flags, ext = request_options(args)
+    if args.inflight > 1 or flags:
+        print(f"開始極速傳輸測試 (Pure Network Benchmark, protocol v2, {args.inflight} in flight)...")
+        print("-" * 50)
+        try:
+            t_send, t_done, n_pts = run_inflight(sock, images_data, args.inflight, flags, ext)
+        except Exception as e:
+            print(f"傳輸失敗: {e}"); sock.close(); return
+        # 同樣略過第一張；吞吐量看相鄰完成的間隔，延遲看每張送出到收完
+        total_frames = len(images_data) - 1
+        wall = t_done[-1] - t_done[0]
+        avg_lat = sum(t_done[i] - t_send[i] for i in range(1, len(images_data))) / total_frames
+        print("-" * 50)
+        print(f"測試結束 (排除 GUI、硬碟讀取、OpenCV 繪圖)")
+        print(f"平均延遲 (送出->收完): {avg_lat*1000:.2f} ms")
+        avg_n = sum(n_pts) / len(n_pts)
+        print(f"平均角點數    : {avg_n:.1f} ({avg_n * POINT_BYTES / 1024:.1f} KiB/frame)")
+        print(f"系統極限 FPS  : {total_frames / wall:.2f} FPS")
+        print("-" * 50)
+        report_stats(sock, args.stats)
+        sock.close()
+        return
+
     print("開始極速傳輸測試 (Pure Network Benchmark)...")
     print("-" * 50)
     
@@ -58,12 +221,13 @@ def main():
     # Buffer 預分配
     recv_header = bytearray(4)
     recv_header_mv = memoryview(recv_header)
+    recv_body = np.empty((8192, 4), dtype="<u2")
 
-    for i, (header, body, body_len) in enumerate(images_data):
+    for i, (H, W, body) in enumerate(images_data):
         t0 = time.perf_counter()
 
         # (A) 發送
-        sock.sendall(header)
+        sock.sendall(struct.pack("<HH", H, W))
         sock.sendall(body)
 
         # (B) 接收 N
@@ -72,14 +236,9 @@ def main():
             read_n += sock.recv_into(recv_header_mv[read_n:], 4 - read_n)
         N = struct.unpack("<I", recv_header)[0]
 
-        # (C) 接收 Points
-        target_len = N * 8
-        read_len = 0
-        # 這裡我們只讀掉數據，不花時間轉成 numpy，只測傳輸速度
-        while read_len < target_len:
-            chunk = sock.recv(target_len - read_len)
-            if not chunk: break
-            read_len += len(chunk)
+        # (C) 接收 Points：直接收進重複使用的 (N, 4) '<u2' 陣列，不另外配置 / 複製
+        if N > len(recv_body): recv_body = np.empty((N, 4), dtype="<u2")
+        recv_exact_into(sock, memoryview(recv_body).cast('B')[:N * 8])
 
         t1 = time.perf_counter()
         
@@ -100,6 +259,7 @@ def main():
     print(f"平均延遲 (RTT): {avg_time*1000:.2f} ms")
     print(f"系統極限 FPS  : {avg_fps:.2f} FPS")
     print("-" * 50)
+    report_stats(sock, args.stats)
     
     sock.close()
 
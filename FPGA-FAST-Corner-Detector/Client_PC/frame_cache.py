@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ============================================================================
+# frame_cache.py  -  dataset 先解碼一次，之後用 mmap 直接拿灰階 frame
+#
+# client 每次跑都要 glob + cv2.imread 整個資料夾 (EuRoC 一段上千張 PNG)，
+# benchmark 還要先把 500 張解碼好放進 list 才能開始。這裡把一段序列解碼成
+# 一個 cache 資料夾：
+#   frames.u8   所有 frame 的灰階 raw bytes 依序接在一起
+#   index.json  shape (所有 frame 同尺寸時) 或每張的 shape / offset、
+#               timestamps (EuRoC 檔名就是 ns timestamp，不是數字時為 null)、
+#               原始檔名
+# FrameCache 用 np.memmap 開 frames.u8，cache[i] 是 (H, W) uint8 的 view：
+# 不複製、不解碼，OS 用到才讀進來 (RAM 不隨序列長度增加)，也可以直接交給
+# socket.sendall 當 payload。
+#   python3 frame_cache.py build /path/to/images MH01.cache [--max-frames N]
+#   python3 frame_cache.py info MH01.cache
+# client_benchmark_pure.py / gui_client.py / loadgen.py 的影像來源都可以直接
+# 給 cache 資料夾。
+# ============================================================================
+import os
+import glob
+import json
+import time
+import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+INDEX = "index.json"
+DATA = "frames.u8"
+EXTS = ['*.png', '*.jpg', '*.jpeg', '*.pgm']
+
+def is_cache(path):
+    return os.path.isfile(os.path.join(path, INDEX))
+
+def list_images(img_dir):
+    return sorted([f for e in EXTS for f in glob.glob(os.path.join(img_dir, e))])
+
+def _timestamp(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return int(stem) if stem.isdigit() else None
+
+def build_cache(img_dir, out_dir, max_frames=0, workers=4, prefetch=16):
+    """img_dir 的影像依檔名順序解碼成 out_dir (frames.u8 + index.json)。
+    解碼在 thread pool 上做，最多先做 prefetch 張，寫入是循序的。"""
+    import cv2
+    files = list_images(img_dir)
+    if max_frames > 0: files = files[:max_frames]
+    if not files:
+        raise FileNotFoundError(f"no images found in {img_dir}")
+    os.makedirs(out_dir, exist_ok=True)
+    if is_cache(out_dir):
+        os.remove(os.path.join(out_dir, INDEX))     # 重建時舊 index 先作廢
+    names, stamps, shapes, offsets = [], [], [], []
+    off = 0
+    tmp = os.path.join(out_dir, DATA + ".tmp")
+    pending = collections.deque()
+    it = iter(files)
+    with ThreadPoolExecutor(workers) as pool, open(tmp, "wb") as f:
+        while True:
+            while len(pending) < prefetch:
+                path = next(it, None)
+                if path is None: break
+                pending.append((path, pool.submit(cv2.imread, path, cv2.IMREAD_GRAYSCALE)))
+            if not pending: break
+            path, fut = pending.popleft()
+            img = fut.result()
+            if img is None:
+                print(f"[Cache] skip unreadable {path}")
+                continue
+            f.write(np.ascontiguousarray(img).data)
+            names.append(os.path.basename(path)); stamps.append(_timestamp(path))
+            shapes.append(img.shape); offsets.append(off)
+            off += img.size
+    if not names:
+        raise ValueError(f"no readable images in {img_dir}")
+    uniform = len(set(shapes)) == 1
+    index = dict(version=1, count=len(names), source=os.path.abspath(img_dir),
+                 shape=list(shapes[0]) if uniform else None,
+                 shapes=None if uniform else [list(s) for s in shapes],
+                 offsets=None if uniform else offsets,
+                 timestamps=stamps, files=names)
+    os.replace(tmp, os.path.join(out_dir, DATA))
+    # index 最後寫：沒寫完的 cache 不會被 is_cache 當成可用
+    with open(os.path.join(out_dir, INDEX), "w") as f:
+        json.dump(index, f)
+    return FrameCache(out_dir)
+
+class FrameCache:
+    """cache 資料夾 -> 可以 len() / [i] / 切片 / iterate 的 frame 序列，
+    每張都是 mmap 上的 (H, W) uint8 view。"""
+    def __init__(self, path):
+        with open(os.path.join(path, INDEX)) as f:
+            self.index = json.load(f)
+        self.path = path
+        self.files = self.index['files']
+        self.timestamps = self.index['timestamps']
+        n = self.index['count']
+        data = os.path.join(path, DATA)
+        if n == 0:
+            self.frames = []
+        elif self.index['shape'] is not None:
+            H, W = self.index['shape']
+            self.frames = np.memmap(data, dtype=np.uint8, mode="r", shape=(n, H, W))
+        else:
+            # 尺寸不一：整個檔案一個 memmap，每張切一段 reshape
+            flat = np.memmap(data, dtype=np.uint8, mode="r")
+            self.frames = [flat[o:o + H * W].reshape(H, W)
+                           for o, (H, W) in zip(self.index['offsets'], self.index['shapes'])]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def nbytes(self):
+        return os.path.getsize(os.path.join(self.path, DATA))
+
+def open_frames(src, cache=None, max_frames=0):
+    """影像來源 -> FrameCache。src 是 cache 資料夾就直接開；否則 src 是影像
+    資料夾，cache 資料夾已存在就開它，不存在先 build。cache=None 且 src 不是
+    cache 時回傳 None (由呼叫端照舊逐張解碼)。"""
+    if is_cache(src):
+        return FrameCache(src)
+    if cache is None:
+        return None
+    if is_cache(cache):
+        return FrameCache(cache)
+    print(f"[Cache] decoding {src} -> {cache} ...")
+    t0 = time.perf_counter()
+    fc = build_cache(src, cache, max_frames=max_frames)
+    print(f"[Cache] {len(fc)} frames, {fc.nbytes() / 2**20:.1f} MB in {time.perf_counter() - t0:.1f} s")
+    return fc
+
+def main():
+    ap = argparse.ArgumentParser(description="Pre-decode an image sequence into a memory-mapped frame cache")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="Decode img_dir into cache_dir")
+    b.add_argument("img_dir")
+    b.add_argument("cache_dir")
+    b.add_argument("--max-frames", type=int, default=0, help="Only the first N images (0 = all)")
+    b.add_argument("--workers", type=int, default=4, help="Decode threads")
+    i = sub.add_parser("info", help="Print what a cache holds")
+    i.add_argument("cache_dir")
+    args = ap.parse_args()
+
+    if args.cmd == "build":
+        t0 = time.perf_counter()
+        fc = build_cache(args.img_dir, args.cache_dir, args.max_frames, args.workers)
+        print(f"[Cache] {len(fc)} frames, {fc.nbytes() / 2**20:.1f} MB -> {args.cache_dir} "
+              f"in {time.perf_counter() - t0:.1f} s")
+    else:
+        fc = FrameCache(args.cache_dir)
+        shape = fc.index['shape']
+        ts = [t for t in fc.timestamps if t is not None]
+        print(f"{args.cache_dir}: {len(fc)} frames, "
+              f"{'x'.join(map(str, shape[::-1])) if shape else 'mixed sizes'}, {fc.nbytes() / 2**20:.1f} MB, "
+              f"source {fc.index['source']}")
+        if len(ts) > 1:
+            print(f"  timestamps {ts[0]} .. {ts[-1]} ({(ts[-1] - ts[0]) / 1e9:.2f} s)")
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,12 @@ import threading
 import time
 import queue
 import collections
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import ttk, messagebox
 from PIL import Image, ImageTk
 import numpy as np
+from frame_cache import is_cache, FrameCache
 
 try:
     import cv2
@@ -24,14 +26,48 @@ except ImportError:
 DEFAULT_IMG_DIR = "/home/user/Datasets/EuRoc/MH01/mav0/cam0/data" #you have to motify it to your path
 DEFAULT_HOST = "192.168.3.1"
 DEFAULT_PORT = 9092
-TARGET_FPS = 25.0  # [修正] 鎖定播放速度為 20 FPS (正常速度)
+TARGET_FPS = 25.0  # [修正] 鎖定播放速度為 20 FPS (正常速度)；0 = 不鎖，跟著硬體跑
+DECODE_WORKERS = 4 # 讀檔 + 解碼的 thread 數 (cv2.imread 會放掉 GIL)
+PREFETCH = 8       # 網路 thread 前面最多先解碼好幾張
+MARK_RADIUS = 3    # 角點圓點半徑 (原圖 pixel，縮小顯示時跟著縮)
 # =========================================
 
+def decode_image(path):
+    # decode stage (thread pool)：-> (gray, 秒)；EuRoC 本來就是灰階，不再轉 BGR
+    t0 = time.perf_counter()
+    gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    return gray, time.perf_counter() - t0
+
+def disk_offsets(r, W):
+    # 半徑 r 的實心圓 (與 cv2.circle 填滿的形狀相同) 在寬 W 的影像裡的 flat offset
+    d = np.arange(-r, r + 1)
+    dy, dx = np.meshgrid(d, d, indexing="ij")
+    m = dx * dx + dy * dy <= r * r
+    return (dy * W + dx)[m]
+
+def stamp_markers(img, xs, ys, r, offsets, color):
+    # 所有角點的圓點一次用 flat fancy indexing 蓋上去，取代逐點的 cv2.circle；
+    # 中心夾在離邊界 r 以內，圓點不會跨到隔壁 row (呼叫端保證 2r+1 <= W, H)
+    H, W = img.shape[:2]
+    cx = np.clip(xs, r, W - 1 - r)
+    cy = np.clip(ys, r, H - 1 - r)
+    flat = ((cy * W + cx)[:, None] + offsets).ravel()
+    v = img.reshape(-1, 3)
+    for c, val in enumerate(color):
+        v[flat, c] = val
+
 class NetworkClient:
+    # 回傳的 points 是 ring 裡的 view：raw_queue (2) + 處理中 1 張 + 正在收的 1 張，
+    # 所以輪流用 4 個 buffer，還在別的 thread 手上的不會被覆寫
+    RING = 4
+
     def __init__(self, host, port):
         self.host = host
         self.port = port
         self.sock = None
+        self.hdr = bytearray(4)
+        self.ring = [np.empty((4096, 4), dtype="<u2") for _ in range(self.RING)]
+        self.ring_i = 0
 
     def connect(self):
         try:
@@ -55,31 +91,33 @@ class NetworkClient:
         try:
             H, W = img_gray.shape
             self.sock.sendall(struct.pack("<HH", H, W))
-            self.sock.sendall(img_gray.tobytes())
+            self.sock.sendall(img_gray)     # 直接送 array (frame cache 時是 mmap 的 view)
             return True
         except: return False
 
     def recv_result(self):
+        # 角點直接收進可重複使用的 (N, 4) '<u2' 陣列，不再經過 bytes
         if not self.sock: return []
         try:
-            n_bytes = self.recv_exact(4)
-            N = struct.unpack("<I", n_bytes)[0]
-            points = []
+            self.recv_exact_into(memoryview(self.hdr))
+            N = struct.unpack("<I", self.hdr)[0]
+            buf = self.ring[self.ring_i]
+            if N > len(buf):
+                buf = self.ring[self.ring_i] = np.empty((max(N, 2 * len(buf)), 4), dtype="<u2")
+            self.ring_i = (self.ring_i + 1) % len(self.ring)
+            points = buf[:N]
             if N > 0:
-                body = self.recv_exact(N * 8)
-                points = np.frombuffer(body, dtype="<u2").reshape(-1, 4)
+                self.recv_exact_into(memoryview(points).cast('B'))
             return points
         except: return []
 
-    def recv_exact(self, n):
-        buf = bytearray(n)
-        view = memoryview(buf)
+    def recv_exact_into(self, view):
+        n = len(view)
         pos = 0
         while pos < n:
             read = self.sock.recv_into(view[pos:], n - pos)
             if read == 0: raise ConnectionError("EOF")
             pos += read
-        return bytes(buf)
 
 class UltimateGUI:
     def __init__(self, root, img_dir):
@@ -90,6 +128,7 @@ class UltimateGUI:
         
         self.img_dir = img_dir
         self.image_files = []
+        self.cache = None               # img_dir 是 frame cache 時的 FrameCache
         self.is_running = False
         
         # 佇列
@@ -97,6 +136,8 @@ class UltimateGUI:
         self.render_queue = queue.Queue(maxsize=2)
         
         self.fps_history = collections.deque(maxlen=100)
+        self.view_size = (0, 0)         # canvas 大小 (主執行緒的 <Configure> 更新)
+        self.markers = {}               # (半徑, 寬) -> disk_offsets
         
         self.setup_ui()
         self.load_images()
@@ -136,6 +177,7 @@ class UltimateGUI:
         self.canvas = tk.Canvas(mid_frame, bg="#000000", highlightthickness=0)
         self.canvas.pack(fill=tk.BOTH, expand=True)
         self.canvas.bind("<Double-Button-1>", self.toggle_fullscreen)
+        self.canvas.bind("<Configure>", self.on_canvas_resize)
         self.img_id = None
 
         btm_bar = tk.Frame(self.root, bg="#222", height=100)
@@ -153,6 +195,12 @@ class UltimateGUI:
     def load_images(self):
         if not os.path.exists(self.img_dir):
             return
+        if is_cache(self.img_dir):
+            # 預先解碼好的 frame cache：不必再讀檔解碼，frame 是 mmap 的 view
+            self.cache = FrameCache(self.img_dir)
+            self.image_files = self.cache.files
+            self.lbl_stats.config(text=f"Frame Cache Loaded: {len(self.cache)} frames")
+            return
         exts = ['*.png', '*.jpg', '*.jpeg']
         files = sorted([f for e in exts for f in glob.glob(os.path.join(self.img_dir, e))])
         self.image_files = files
@@ -176,19 +224,33 @@ class UltimateGUI:
             self.is_running = False
             self.btn_start.config(state=tk.DISABLED)
 
+    def on_canvas_resize(self, event):
+        self.view_size = (event.width, event.height)
+        if self.img_id is not None:
+            self.canvas.coords(self.img_id, event.width // 2, event.height // 2)
+
     # --- 執行緒 1: 網路 I/O (含 20 FPS 速限) ---
+    # 讀檔 / 解碼在 decode pool 裡先做好 PREFETCH 張，這裡只剩送 + 收
     def thread_network_io(self):
-        idx = 0
         total = len(self.image_files)
-        target_interval = 1.0 / TARGET_FPS  # 0.05秒 (20 FPS)
+        target_interval = 1.0 / TARGET_FPS if TARGET_FPS > 0 else 0.0
+        decoder = ThreadPoolExecutor(DECODE_WORKERS)
+        pending = collections.deque()
+        nxt = 0
 
-        while self.is_running and idx < total:
+        while self.is_running and (pending or nxt < total):
+            while nxt < total and len(pending) < PREFETCH:
+                if self.cache is not None:
+                    pending.append((nxt, None))
+                else:
+                    pending.append((nxt, decoder.submit(decode_image, self.image_files[nxt])))
+                nxt += 1
             loop_start = time.perf_counter() # 計時開始
-            
-            path = self.image_files[idx]
-            frame = cv2.imread(path)
-            if frame is None: idx+=1; continue
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+            idx, fut = pending.popleft()
+            gray, dec_time = fut.result() if fut is not None else (self.cache[idx], 0.0)
+            stall = time.perf_counter() - loop_start    # 解碼跟不上時網路 thread 等了多久
+            if gray is None: continue
             
             # --- 核心傳輸 (全力跑) ---
             t0 = time.perf_counter()
@@ -204,11 +266,9 @@ class UltimateGUI:
                 if self.raw_queue.full():
                     try: self.raw_queue.get_nowait()
                     except: pass
-                self.raw_queue.put((frame, points, net_time, idx))
+                self.raw_queue.put((gray, points, net_time, idx, dec_time, stall))
             except: pass
             
-            idx += 1
-            
             # --- [修正] 速度控制 (只影響播放，不影響 FPS 儀表板) ---
             # 如果跑太快 (例如硬體只花了 12ms)，我們就睡 38ms，湊滿 50ms (20 FPS)
             elapsed = time.perf_counter() - loop_start
@@ -216,37 +276,56 @@ class UltimateGUI:
             if wait_time > 0:
                 time.sleep(wait_time)
             
+        decoder.shutdown(wait=False, cancel_futures=True)
         self.is_running = False
         self.client.disconnect()
 
-    # --- 執行緒 2: 影像處理 ---
+    # --- 執行緒 2: render ---
+    def render(self, gray, points, only_strong):
+        # 先縮到 canvas 大小 (只縮不放大) 再轉 RGB、蓋角點，PIL / Tk 只處理顯示的 pixel
+        H, W = gray.shape
+        cw, ch = self.view_size
+        s = min(cw / W, ch / H, 1.0) if cw > 1 and ch > 1 else 1.0
+        if s < 1.0:
+            gray = cv2.resize(gray, (max(1, int(W * s)), max(1, int(H * s))), interpolation=cv2.INTER_AREA)
+        rgb = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+        pts = points[points[:, 2] != 0] if only_strong else points
+        if len(pts):
+            h, w = rgb.shape[:2]
+            # canvas 比圓點還窄 (例如視窗剛建立時只有幾個 pixel)：半徑跟著縮，中心才夾得住
+            r = min(max(1, int(round(MARK_RADIUS * s))), (w - 1) // 2, (h - 1) // 2)
+            key = (r, w)
+            offsets = self.markers.get(key)
+            if offsets is None:
+                offsets = self.markers[key] = disk_offsets(r, w)
+            xs = (pts[:, 0] * s).astype(np.intp)
+            ys = (pts[:, 1] * s).astype(np.intp)
+            stamp_markers(rgb, xs, ys, r, offsets, (0, 255, 0))
+        return rgb
+
     def thread_processor(self):
         while self.is_running:
             try:
-                frame, points, net_time, idx = self.raw_queue.get(timeout=0.5)
+                gray, points, net_time, idx, dec_time, stall = self.raw_queue.get(timeout=0.5)
             except queue.Empty:
                 continue
 
-            only_strong = self.var_strong_only.get()
-            n_pts = len(points)
-            for i in range(n_pts):
-                x, y, stg, score = points[i]
-                if only_strong and stg == 0: continue
-                cv2.circle(frame, (int(x), int(y)), 3, (0, 255, 0), -1)
-
-            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            t0 = time.perf_counter()
+            rgb = self.render(gray, points, self.var_strong_only.get())
             img_pil = Image.fromarray(rgb)
             img_tk = ImageTk.PhotoImage(image=img_pil)
+            render_time = time.perf_counter() - t0
             
             if self.render_queue.full():
                 try: self.render_queue.get_nowait()
                 except: pass
-            self.render_queue.put((img_tk, net_time, n_pts, idx))
+            self.render_queue.put((img_tk, net_time, len(points), idx, gray.shape,
+                                   dec_time, stall, render_time))
 
     # --- 主執行緒: GUI 更新 ---
     def update_gui_loop(self):
         try:
-            img_tk, net_time, n_pts, idx = self.render_queue.get_nowait()
+            img_tk, net_time, n_pts, idx, (H, W), dec_time, stall, render_time = self.render_queue.get_nowait()
             
             if self.img_id is None:
                 self.img_id = self.canvas.create_image(
@@ -259,7 +338,7 @@ class UltimateGUI:
             
             # 計算硬體能力 FPS (基於純延遲，不受播放速度影響)
             hw_fps = 1.0 / net_time if net_time > 0 else 0
-            bw = (752*480 / 1024 / 1024) * hw_fps
+            bw = (H * W / 1024 / 1024) * hw_fps
             
             self.fps_history.append(hw_fps)
             avg_fps = sum(self.fps_history) / len(self.fps_history)
@@ -267,12 +346,15 @@ class UltimateGUI:
             # 顯示 HW FPS (硬體能跑多快)，而不是播放 FPS
             self.lbl_fps.config(text=f"HW FPS: {avg_fps:.1f}")
             
+            # Latency 只算送 + 收；解碼 (stall = 網路 thread 等解碼) 與 render 分開列
             stats_text = (
                 f"Frame ID : {idx}\n"
                 f"Points   : {n_pts}\n"
                 f"Latency  : {net_time*1000:.1f} ms\n"
                 f"Bandwidth: {bw:.2f} MB/s\n"
-                f"Display  : Locked @ {TARGET_FPS} FPS"
+                f"Decode   : {dec_time*1000:.1f} ms (stall {stall*1000:.1f} ms)\n"
+                f"Render   : {render_time*1000:.1f} ms\n"
+                f"Display  : " + (f"Locked @ {TARGET_FPS} FPS" if TARGET_FPS > 0 else "Unlocked")
             )
             self.lbl_stats.config(text=stats_text)
             self.draw_graph()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ============================================================================
+# loadgen.py  -  server 的負載產生 / benchmark 工具 (取代 client_benchmark_pure.py)
+#
+#   frame 來源  : --source synthetic (預設，只需要 numpy) 或 --source /path/to/images
+#                 (也可以是 frame_cache.py 做好的 cache 資料夾)
+#   解析度      : --sizes 640x480,1024x768 或 --sweep (一路到硬體 MAX_W x MAX_H)
+#   連線        : --connections N，每條連線 protocol v2、最多 --inflight K 張在路上
+#   模式        : closed (送完等回應、窗口 K) / open (--rate 固定到達率，延遲從
+#                 「預定送出時間」算起，server 塞住時不會低估延遲)
+#   時間        : --warmup 秒內的 frame 不計，之後量 --duration 秒
+#   輸出        : p50 / p99 / p99.9 延遲、throughput、corners/frame -> --json / --csv
+#   本機 server : --local-server emu|cpu 會在 loopback 起一個 server.py，
+#                 沒有板子也能跑整條 host 端 pipeline 的效能回歸
+#
+# 例：
+#   python3 loadgen.py --local-server emu --sweep --duration 5 --json out.json
+#   python3 loadgen.py --host 192.168.2.99 --source ~/EuRoc/MH01/mav0/cam0/data \
+#       --sizes 752x480 --connections 2 --inflight 4 --csv out.csv
+# ============================================================================
+import os
+import sys
+import glob
+import csv
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import numpy as np
+from protocol import MAGIC, VERSION, REQ_V2, RESP_V2, POINT_BYTES, REQ_STATS, RESP_CTRL
+
+DEFAULT_HOST = "192.168.2.99"
+DEFAULT_PORT = 9092
+MAX_W, MAX_H = 1024, 768            # top_fast_nms_to_dma 的 MAX_W / MAX_H
+SWEEP_SIZES = [(160, 120), (320, 240), (640, 480), (752, 480), (800, 600), (1024, 768)]
+SERVER_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server_PYNQ", "server.py")
+
+# ================= frame 來源 =================
+def synthetic_frames(W, H, n=8, seed=0):
+    # 低雜訊背景 + 隨機矩形 (每個矩形 4 個角點)，固定 seed，每次跑都一樣
+    frames = []
+    for k in range(n):
+        rng = np.random.default_rng(seed * 1000 + k)
+        img = rng.integers(96, 112, size=(H, W), dtype=np.uint8)
+        for _ in range(max(4, W * H // 4000)):
+            w = int(rng.integers(6, max(7, W // 8))); h = int(rng.integers(6, max(7, H // 8)))
+            x = int(rng.integers(0, max(1, W - w))); y = int(rng.integers(0, max(1, H - h)))
+            img[y:y+h, x:x+w] = rng.integers(0, 256)
+        frames.append(img)
+    return frames
+
+def dataset_frames(img_dir, W, H, max_frames):
+    import cv2
+    from frame_cache import is_cache, FrameCache
+    if is_cache(img_dir):
+        # frame cache：同尺寸的直接用 mmap 的 view，不同尺寸才縮放
+        frames = [f if f.shape == (H, W) else cv2.resize(f, (W, H), interpolation=cv2.INTER_AREA)
+                  for f in FrameCache(img_dir)[:max_frames]]
+        if not frames:
+            raise SystemExit(f"frame cache {img_dir} is empty")
+        return frames
+    exts = ['*.png', '*.jpg', '*.jpeg', '*.pgm']
+    files = sorted([f for e in exts for f in glob.glob(os.path.join(img_dir, e))])[:max_frames]
+    frames = []
+    for f in files:
+        img = cv2.imread(f, cv2.IMREAD_GRAYSCALE)
+        if img is None: continue
+        if img.shape != (H, W):
+            img = cv2.resize(img, (W, H), interpolation=cv2.INTER_AREA)
+        frames.append(np.ascontiguousarray(img))
+    if not frames:
+        raise SystemExit(f"no images found in {img_dir}")
+    return frames
+
+# ================= 單條連線 =================
+def recv_exact_into(sock, mv):
+    got = 0; n = len(mv)
+    while got < n:
+        k = sock.recv_into(mv[got:], n - got)
+        if k == 0: raise ConnectionError("EOF")
+        got += k
+
+class LoadConn:
+    """一條連線：sender thread 依模式送 frame，receiver thread 依序收回應。
+    結果存成 (t_ref, t_done, N)，t_ref 在 closed 模式是實際送出時間，
+    open 模式是預定送出時間。"""
+    def __init__(self, host, port, frames, inflight, rate, t_measure, t_end):
+        self.frames = frames
+        self.rate = rate                    # None = closed loop
+        self.t_measure, self.t_end = t_measure, t_end
+        self.window = threading.Semaphore(inflight)
+        self.t_ref = {}                     # frame_id -> t_ref
+        self.n_sent = 0
+        self.done = []                      # (t_ref, t_done, N)
+        self.errs = []
+        self.sock = socket.create_connection((host, port), timeout=30.0)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.pending = threading.Semaphore(0)   # 已送出、還沒收的張數 (+1 表示送完了)
+
+    def start(self, t0):
+        self.t0 = t0
+        self.th_tx = threading.Thread(target=self._sender, daemon=True)
+        self.th_rx = threading.Thread(target=self._receiver, daemon=True)
+        self.th_tx.start(); self.th_rx.start()
+
+    def join(self):
+        self.th_tx.join(); self.th_rx.join()
+        try: self.sock.close()
+        except: pass
+
+    def _sender(self):
+        fid = 0
+        try:
+            while True:
+                if self.rate is not None:
+                    t_sched = self.t0 + fid / self.rate
+                    if t_sched >= self.t_end: break
+                    dt = t_sched - time.perf_counter()
+                    if dt > 0: time.sleep(dt)
+                self.window.acquire()
+                if self.errs: break
+                now = time.perf_counter()
+                if self.rate is None:
+                    if now >= self.t_end: self.window.release(); break
+                    t_sched = now
+                img = self.frames[fid % len(self.frames)]
+                self.t_ref[fid] = t_sched
+                self.n_sent = fid + 1
+                self.pending.release()
+                H, W = img.shape
+                self.sock.sendall(REQ_V2.pack(MAGIC, VERSION, 0, fid & 0xFFFFFFFF, H, W))
+                self.sock.sendall(img)
+                fid += 1
+        except Exception as e:
+            self.errs.append(e)
+            try: self.sock.shutdown(socket.SHUT_RDWR)
+            except: pass
+        finally:
+            self.pending.release()
+
+    def _receiver(self):
+        hdr = bytearray(RESP_V2.size); hdr_mv = memoryview(hdr)
+        body = np.empty((8192, 4), dtype="<u2")     # 角點直接收進這裡，重複使用
+        fid = 0
+        try:
+            while True:
+                self.pending.acquire()
+                if fid >= self.n_sent: break    # sender 結束時多 release 的那一次
+                recv_exact_into(self.sock, hdr_mv)
+                magic, ver, flags, rfid, N = RESP_V2.unpack(hdr)
+                if magic != MAGIC or ver != VERSION:
+                    raise ValueError("server did not answer with protocol v2")
+                if rfid != (fid & 0xFFFFFFFF):
+                    raise ValueError(f"reply out of order: expected {fid}, got {rfid}")
+                if N > len(body): body = np.empty((N, 4), dtype="<u2")
+                recv_exact_into(self.sock, memoryview(body).cast('B')[:N * POINT_BYTES])
+                t_done = time.perf_counter()
+                t_ref = self.t_ref.pop(fid)
+                if t_ref >= self.t_measure:
+                    self.done.append((t_ref, t_done, N))
+                fid += 1
+                self.window.release()
+        except Exception as e:
+            self.errs.append(e)
+            self.window.release()
+
+def query_stats(host, port):
+    with socket.create_connection((host, port), timeout=10.0) as s:
+        s.sendall(REQ_V2.pack(MAGIC, VERSION, REQ_STATS, 0, 0, 0))
+        hdr = bytearray(RESP_V2.size); recv_exact_into(s, memoryview(hdr))
+        magic, ver, flags, fid, n = RESP_V2.unpack(hdr)
+        if magic != MAGIC or not (flags & RESP_CTRL): raise ValueError("bad stats reply")
+        body = bytearray(n); recv_exact_into(s, memoryview(body))
+        return json.loads(body.decode())
+
+# ================= 一個解析度跑一輪 =================
+def run_point(args, W, H, frames):
+    t0 = time.perf_counter() + 0.2
+    t_measure = t0 + args.warmup
+    t_end = t_measure + args.duration
+    rate = None
+    if args.mode == "open":
+        rate = args.rate / args.connections
+    conns = [LoadConn(args.host, args.port, frames, args.inflight, rate, t_measure, t_end)
+             for _ in range(args.connections)]
+    for c in conns: c.start(t0)
+    for c in conns: c.join()
+
+    errs = [e for c in conns for e in c.errs]
+    done = [d for c in conns for d in c.done]
+    row = dict(size=f"{W}x{H}", width=W, height=H, mode=args.mode, connections=args.connections,
+               inflight=args.inflight, rate=args.rate if args.mode == "open" else None,
+               frames=len(done), errors=len(errs))
+    if errs:
+        row['error'] = str(errs[0])
+    if done:
+        arr = np.array(done, dtype=np.float64)
+        lat = (arr[:, 1] - arr[:, 0]) * 1000.0
+        # throughput：量測區間內完成的張數 / 量測區間長度
+        span = max(arr[:, 1].max() - t_measure, 1e-9)
+        row.update(throughput_fps=round(len(done) / span, 2),
+                   mbps_in=round(len(done) * W * H * 8 / span / 1e6, 2),
+                   lat_mean_ms=round(float(lat.mean()), 3),
+                   lat_p50_ms=round(float(np.percentile(lat, 50)), 3),
+                   lat_p99_ms=round(float(np.percentile(lat, 99)), 3),
+                   lat_p999_ms=round(float(np.percentile(lat, 99.9)), 3),
+                   lat_max_ms=round(float(lat.max()), 3),
+                   corners_mean=round(float(arr[:, 2].mean()), 1))
+    return row
+
+# ================= 本機 server =================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0)); return s.getsockname()[1]
+
+def start_local_server(args):
+    port = free_port()
+    cmd = [sys.executable, args.server_py, "--backend", args.local_server, "--port", str(port),
+           "--quiet", "--pipeline-depth", str(args.server_depth),
+           "--max-clients", str(args.connections + 1)] + args.server_arg
+    print(f"[Local] {' '.join(cmd)}")
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"local server exited with code {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1.0).close()
+            return proc, port
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit("local server did not start listening")
+
+def parse_sizes(text):
+    out = []
+    for tok in text.split(","):
+        w, h = tok.lower().split("x")
+        out.append((int(w), int(h)))
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="Load generator / benchmark for the FAST corner server")
+    ap.add_argument("--host", default=DEFAULT_HOST)
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--source", default="synthetic", help="'synthetic' or a directory of images")
+    ap.add_argument("--max-frames", type=int, default=200, help="Images preloaded from the dataset")
+    ap.add_argument("--sizes", default=None, help="Comma-separated WxH list, e.g. 640x480,1024x768")
+    ap.add_argument("--sweep", action="store_true", help=f"Sweep standard sizes up to {MAX_W}x{MAX_H}")
+    ap.add_argument("--max-w", type=int, default=MAX_W)
+    ap.add_argument("--max-h", type=int, default=MAX_H)
+    ap.add_argument("--connections", type=int, default=1)
+    ap.add_argument("--inflight", type=int, default=1, help="Frames in flight per connection")
+    ap.add_argument("--mode", choices=["closed", "open"], default="closed")
+    ap.add_argument("--rate", type=float, default=30.0, help="[open] total frames/s over all connections")
+    ap.add_argument("--warmup", type=float, default=2.0, help="Seconds not counted (JIT, buffer init)")
+    ap.add_argument("--duration", type=float, default=10.0, help="Measured seconds per size")
+    ap.add_argument("--json", default=None, help="Write results (and server stage stats) as JSON")
+    ap.add_argument("--csv", default=None, help="Write one row per size as CSV")
+    ap.add_argument("--local-server", choices=["emu", "cpu"], default=None,
+                    help="Start server.py with this software backend on loopback and test against it")
+    ap.add_argument("--server-py", default=SERVER_PY)
+    ap.add_argument("--server-depth", type=int, default=3, help="[local] --pipeline-depth of the server")
+    ap.add_argument("--server-arg", action="append", default=[], help="[local] extra server.py argument")
+    ap.add_argument("--server-log", default=None, help="[local] file for the server's console output")
+    args = ap.parse_args()
+    if args.mode == "open" and args.inflight == 1:
+        args.inflight = 64      # open loop 不該被窗口限制，只是防止無限堆積
+
+    if args.sizes: sizes = parse_sizes(args.sizes)
+    elif args.sweep: sizes = SWEEP_SIZES
+    else: sizes = [(640, 480)]
+    for W, H in sizes:
+        if W > args.max_w or H > args.max_h or W < 7 or H < 7:
+            raise SystemExit(f"{W}x{H} outside 7x7 .. {args.max_w}x{args.max_h}")
+
+    proc = None
+    if args.local_server:
+        proc, args.port = start_local_server(args)
+        args.host = "127.0.0.1"
+
+    rows = []
+    try:
+        print(f"{'size':<10} {'fps':>8} {'p50':>8} {'p99':>8} {'p99.9':>8} {'max':>8} {'corners':>8} {'err':>4}")
+        for W, H in sizes:
+            if args.source == "synthetic": frames = synthetic_frames(W, H)
+            else: frames = dataset_frames(args.source, W, H, args.max_frames)
+            row = run_point(args, W, H, frames)
+            rows.append(row)
+            if 'throughput_fps' in row:
+                print(f"{row['size']:<10} {row['throughput_fps']:>8.1f} {row['lat_p50_ms']:>8.2f} "
+                      f"{row['lat_p99_ms']:>8.2f} {row['lat_p999_ms']:>8.2f} {row['lat_max_ms']:>8.2f} "
+                      f"{row['corners_mean']:>8.1f} {row['errors']:>4}")
+            else:
+                print(f"{row['size']:<10} no frames completed ({row.get('error', 'too short?')})")
+        server_stats = None
+        try: server_stats = query_stats(args.host, args.port)
+        except Exception as e: print(f"[WARN] stats query failed: {e}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try: proc.wait(10)
+            except subprocess.TimeoutExpired: proc.kill()
+
+    if args.json:
+        cfg = {k: v for k, v in vars(args).items() if k not in ("server_arg",)}
+        with open(args.json, "w") as f:
+            json.dump(dict(config=cfg, results=rows, server_stats=server_stats), f, indent=2)
+        print(f"[Out] {args.json}")
+    if args.csv:
+        keys = []
+        for r in rows:
+            keys += [k for k in r if k not in keys]
+        with open(args.csv, "w", newline="") as f:
+            wr = csv.DictWriter(f, fieldnames=keys)
+            wr.writeheader(); wr.writerows(rows)
+        print(f"[Out] {args.csv}")
+    if any(r['errors'] for r in rows):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
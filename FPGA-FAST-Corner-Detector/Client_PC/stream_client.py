@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ============================================================================
+# stream_client.py  -  REQ_STREAM：上面幾列的角點不必等整張 frame 做完
+#
+# request 帶 REQ_STREAM 時 server 把回應拆成 row 範圍的 chunk (見 protocol.py)，
+# 每個 chunk 一收到就能用 (例如 tracker 先處理影像上半部)。iter_chunks() 依序
+# 交回 (y0, y1, pts, last, truncated)，接起來就是整張的結果。
+#   python3 stream_client.py --host 192.168.2.99 --source /path/to/images
+#   python3 stream_client.py --local cpu --frames 50 --size 1024x768
+#   python3 stream_client.py --local emu --emu-line-us 20
+# 每張 frame 先不串流送一次 (暖身)，再串流、不串流各送一次，比對兩者的角點是否相同，並印出
+# time-to-first-chunk 與整張完成時間 (client 端量，包含上傳 payload 的時間)。
+# 最後用 REQ_STATS 拿 server 端串流的那幾張的 first (payload 收完 -> 第一個 chunk) 與
+# last (-> END chunk) 的 p50 (total 也含不串流的 frame，不能拿來比)：first 超過 last 的
+# --max-first 倍 (預設一半) 時印 FAIL 並以 exit code 1 結束。
+# 串流要一張 frame 算得夠久才划算 (fpga / emu、板子上的 cpu)：每多一個 chunk 就多一次
+# parse + send。cpu backend 整張只要幾 ms 時會少切幾個 band (見 cpu_fast.STREAM_MIN_BAND_NS)，
+# 切成一塊 (第一個 chunk 就是整張) 時不檢查 --max-first。
+# ============================================================================
+import sys
+import time
+import socket
+import argparse
+from types import SimpleNamespace
+import numpy as np
+from protocol import (MAGIC, VERSION, REQ_V2, RESP_V2, CHUNK_V2,
+                      REQ_STREAM, RESP_TRUNCATED, RESP_CHUNK, RESP_END)
+from board_pool import recv_exact_into
+from client_benchmark_pure import query_stats
+
+def send_frame(sock, fid, img, flags=REQ_STREAM):
+    H, W = img.shape
+    sock.sendall(REQ_V2.pack(MAGIC, VERSION, flags, fid, H, W))
+    sock.sendall(np.ascontiguousarray(img, dtype=np.uint8))
+
+def recv_points(sock, N):
+    pts = np.empty((N, 4), dtype="<u2")
+    if N: recv_exact_into(sock, memoryview(pts).cast("B"))
+    return pts
+
+def iter_chunks(sock, fid):
+    # 一張 frame 的回應 -> (y0, y1, pts, last, truncated)，最後一個 last = True
+    hdr = bytearray(RESP_V2.size + CHUNK_V2.size)
+    while True:
+        recv_exact_into(sock, memoryview(hdr))
+        magic, ver, flags, rid, N = RESP_V2.unpack_from(hdr)
+        if magic != MAGIC or rid != fid or not flags & RESP_CHUNK:
+            raise ConnectionError(f"unexpected response (flags={flags:#x}, frame_id={rid}, want {fid})")
+        y0, y1 = CHUNK_V2.unpack_from(hdr, RESP_V2.size)
+        last = bool(flags & RESP_END)
+        yield y0, y1, recv_points(sock, N), last, bool(flags & RESP_TRUNCATED)
+        if last: return
+
+def recv_whole(sock, fid):
+    hdr = bytearray(RESP_V2.size)
+    recv_exact_into(sock, memoryview(hdr))
+    magic, ver, flags, rid, N = RESP_V2.unpack_from(hdr)
+    if magic != MAGIC or rid != fid:
+        raise ConnectionError(f"unexpected response (frame_id={rid}, want {fid})")
+    return recv_points(sock, N)
+
+def main():
+    from loadgen import DEFAULT_PORT, SERVER_PY, synthetic_frames, dataset_frames, start_local_server
+    ap = argparse.ArgumentParser(description="Row-streamed responses: time-to-first-chunk vs whole frame")
+    ap.add_argument("--host", default="192.168.2.99")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--source", default="synthetic", help="'synthetic' or an image directory / frame cache")
+    ap.add_argument("--size", default="1024x768", help="WxH")
+    ap.add_argument("--frames", type=int, default=30)
+    ap.add_argument("--local", choices=["cpu", "emu"], default=None,
+                    help="start a software server on loopback instead of --host")
+    ap.add_argument("--stream-bands", type=int, default=8, help="[local] --stream-bands of the server")
+    ap.add_argument("--emu-line-us", type=float, default=0.0, help="[local emu] --emu-line-us of the server")
+    ap.add_argument("--max-first", type=float, default=0.5,
+                    help="Fail when the server sends the first chunk later than this fraction of the whole streamed "
+                         "frame (p50 of the 'first' and 'last' stages)")
+    args = ap.parse_args()
+    W, H = map(int, args.size.lower().split("x"))
+    frames = synthetic_frames(W, H) if args.source == "synthetic" else dataset_frames(args.source, W, H, args.frames)
+
+    proc = None
+    ok = True
+    try:
+        host, port = args.host, args.port
+        if args.local:
+            sa = SimpleNamespace(server_py=SERVER_PY, local_server=args.local, server_depth=1, connections=1,
+                                 server_arg=["--stream-bands", str(args.stream_bands),
+                                             "--emu-line-us", str(args.emu_line_us)], server_log=None)
+            proc, port = start_local_server(sa)
+            host = "127.0.0.1"
+        sock = socket.create_connection((host, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        first, full, whole, chunks = [], [], [], []
+        mismatch = 0
+        for i in range(args.frames):
+            img = frames[i % len(frames)]
+            # emu 的 line buffer 會帶到下一張的前幾列：先送一次，讓兩次比對的前一張相同
+            send_frame(sock, 3 * i, img, 0)
+            recv_whole(sock, 3 * i)
+            t0 = time.perf_counter()
+            send_frame(sock, 3 * i + 1, img)
+            parts = []
+            for y0, y1, pts, last, truncated in iter_chunks(sock, 3 * i + 1):
+                if not parts: first.append(time.perf_counter() - t0)
+                parts.append(pts)
+            full.append(time.perf_counter() - t0)
+            chunks.append(len(parts))
+            t0 = time.perf_counter()
+            send_frame(sock, 3 * i + 2, img, 0)
+            ref = recv_whole(sock, 3 * i + 2)
+            whole.append(time.perf_counter() - t0)
+            if not np.array_equal(np.concatenate(parts), ref): mismatch += 1
+        stats = query_stats(sock)
+        sock.close()
+        ms = lambda v: np.median(v) * 1e3
+        print(f"[Stream] {args.frames} frames {W}x{H}, {np.mean(chunks):.1f} chunks/frame, "
+              f"{args.frames - mismatch}/{args.frames} identical to non-streamed")
+        print(f"[Stream] first chunk {ms(first):.2f} ms, last chunk {ms(full):.2f} ms, "
+              f"non-streamed {ms(whole):.2f} ms (median) -> first chunk at {ms(first) / ms(whole):.0%}")
+        res = f"{W}x{H}"
+        st = next((per[res] for per in stats.values()
+                   if isinstance(per, dict) and 'last' in per.get(res, {})), None)
+        if st is None:
+            print("[Stream] server reported no 'first' / 'last' stages (frames not streamed?)")
+            ok = False
+        elif max(chunks) <= 2:
+            ok = mismatch == 0
+            print(f"[Stream] server side: frames sent in one piece ({st['last']['p50']:.2f} ms, p50), computing them "
+                  f"takes less than sending more chunks would cost; --max-first not checked")
+        else:
+            r = st['first']['p50'] / st['last']['p50']
+            ok = r <= args.max_first and mismatch == 0
+            print(f"[Stream] server side: first chunk {st['first']['p50']:.2f} ms after the payload, "
+                  f"last chunk {st['last']['p50']:.2f} ms (p50) -> {r:.0%} "
+                  f"({'OK' if r <= args.max_first else 'FAIL'}, limit {args.max_first:.0%})")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try: proc.wait(10)
+            except Exception: proc.kill()
+    if not ok: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+// ============================================================================
+// tb_top_stream.sv  -  top_fast_nms_to_dma 連續多幀，給 fast_emu.py 逐 word 比對
+//
+// 與 tb_fast_nms.sv 不同：
+//   - MM2S 每拍都 valid (VDMA 的行為)，握手後下一拍直接送下一個 pixel
+//   - S2MM 一直 ready；幀與幀之間 idle GAP 個 cycle
+//   - 一次跑 LIST 裡的多張 frame (每行一個 txt，格式同 tb_fast_nms.sv)
+// 輸出 (OUT 前綴)：
+//   <OUT>.fast  FAST 送給 NMS 的每個事件 "x y strong score"
+//   <OUT>.axis  top 的每個輸出 beat   "data(hex) tlast"
+//   兩個檔在每張 frame 的 SOF 被收下的那一拍寫一行 "F <index>"
+// 參數與 top 相同，可以用 verilator -G 覆寫。
+// Server_PYNQ/rtl_compare.py 會產生 frame、編譯並執行這個 testbench，再與
+// FastNmsModel(AS_BUILT=1) 逐 word 比對：
+//   python3 rtl_compare.py --size 96x64,64x48 --frames 6 --gap 0,64
+// ============================================================================
+module tb_top_stream #(
+  parameter int MAX_W = 1024,
+  parameter int MAX_H = 768,
+  parameter int TLAST_EACH_ROW = 1,
+  parameter int FAST_INI_TH = 20,
+  parameter int FAST_MIN_TH = 7,
+  parameter int FAST_MIN_CONTIG = 12,
+  parameter int NMS_MIN_SCORE = 1,
+  parameter int NMS_STRICT_GT = 0,
+  parameter int NMS_TIE_MODE = 1,
+  parameter int NMS_APPLY_NEG1 = 1,
+  parameter int NMS_CLAMP_MAX = 1
+);
+
+  localparam real CLK_PERIOD = 10.0;
+  reg clk = 0;
+  always #(CLK_PERIOD/2.0) clk = ~clk;
+
+  reg rst_n = 0;
+
+  string LIST = "frames.lst";
+  string OUT  = "rtl";
+  int    GAP  = 4096;
+
+  initial begin
+    void'($value$plusargs("LIST=%s", LIST));
+    void'($value$plusargs("OUT=%s",  OUT));
+    void'($value$plusargs("GAP=%d",  GAP));
+  end
+
+  reg  [63:0] s_axis_tdata  = 64'd0;
+  reg         s_axis_tvalid = 1'b0;
+  wire        s_axis_tready;
+  reg         s_axis_tlast  = 1'b0;
+  reg         s_axis_tuser  = 1'b0;
+
+  wire [63:0] m_axis_tdata;
+  wire        m_axis_tvalid;
+  wire        m_axis_tlast;
+  wire        m_axis_tuser;
+  wire [7:0]  m_axis_tkeep;
+
+  top_fast_nms_to_dma #(
+    .MAX_W(MAX_W), .MAX_H(MAX_H),
+    .TLAST_EACH_ROW(TLAST_EACH_ROW),
+    .FAST_INI_TH(FAST_INI_TH[8:0]), .FAST_MIN_TH(FAST_MIN_TH[8:0]), .FAST_MIN_CONTIG(FAST_MIN_CONTIG),
+    .NMS_MIN_SCORE(NMS_MIN_SCORE), .NMS_STRICT_GT(NMS_STRICT_GT), .NMS_TIE_MODE(NMS_TIE_MODE),
+    .NMS_APPLY_NEG1(NMS_APPLY_NEG1), .NMS_CLAMP_MAX(NMS_CLAMP_MAX)
+  ) dut (
+    .aclk(clk), .aresetn(rst_n),
+    .s_axis_tdata(s_axis_tdata), .s_axis_tvalid(s_axis_tvalid), .s_axis_tready(s_axis_tready),
+    .s_axis_tlast(s_axis_tlast), .s_axis_tuser(s_axis_tuser),
+    .m_axis_tdata(m_axis_tdata), .m_axis_tvalid(m_axis_tvalid), .m_axis_tready(1'b1),
+    .m_axis_tlast(m_axis_tlast), .m_axis_tuser(m_axis_tuser), .m_axis_tkeep(m_axis_tkeep)
+  );
+
+  // ---------------- monitors (邊緣前的值 = 這一拍的握手) ----------------
+  integer ffast, faxis, frame_no = 0;
+
+  always @(posedge clk) begin
+    if (rst_n) begin
+      if (s_axis_tvalid && s_axis_tready && s_axis_tuser) begin
+        $fwrite(ffast, "F %0d\n", frame_no);
+        $fwrite(faxis, "F %0d\n", frame_no);
+        frame_no = frame_no + 1;
+      end
+      if (dut.u_fast.m_valid)
+        $fwrite(ffast, "%0d %0d %0d %0d\n", dut.u_fast.m_x, dut.u_fast.m_y,
+                dut.u_fast.m_is_strong, dut.u_fast.m_score);
+      if (m_axis_tvalid)
+        $fwrite(faxis, "%016h %0d\n", m_axis_tdata, m_axis_tlast);
+    end
+  end
+
+  // ---------------- MM2S：一直 valid ----------------
+  // 在 negedge 驅動、取樣 tready (只由 DUT 的暫存器決定，週期中間已經穩定)，
+  // 這樣 posedge 的握手與 DUT 看到的一致，tuser / tlast 不會多停一拍
+  task automatic send_beat(input [63:0] tdata, input tlast, input tuser);
+    reg ok;
+    begin
+      s_axis_tdata  = tdata;
+      s_axis_tlast  = tlast;
+      s_axis_tuser  = tuser;
+      s_axis_tvalid = 1'b1;
+      do begin
+        ok = s_axis_tready;
+        @(negedge clk);
+      end while (!ok);
+    end
+  endtask
+
+  task automatic send_frame(input string path);
+    integer fin;
+    int rv, W, H, r, c, pix;
+    reg [63:0] beat;
+    begin
+      fin = $fopen(path, "r");
+      if (!fin) begin $display("ERROR: cannot open %s", path); $finish; end
+      rv = $fscanf(fin, "%d %d", W, H);
+      for (r = 0; r < H; r++) begin
+        for (c = 0; c < W; c++) begin
+          rv = $fscanf(fin, "%d", pix);
+          beat = 64'd0;
+          beat[7:0] = pix[7:0];
+          if (r == 0 && c == 0) begin
+            beat[23:8]  = H[15:0];
+            beat[39:24] = W[15:0];
+          end
+          send_beat(beat, c == W - 1, r == 0 && c == 0);
+        end
+      end
+      $fclose(fin);
+      s_axis_tvalid = 1'b0; s_axis_tlast = 1'b0; s_axis_tuser = 1'b0;
+      repeat (GAP) @(negedge clk);
+    end
+  endtask
+
+  initial begin : STIM
+    integer flist;
+    string path;
+    int rv;
+    ffast = $fopen({OUT, ".fast"}, "w");
+    faxis = $fopen({OUT, ".axis"}, "w");
+    repeat (20) @(posedge clk);
+    rst_n <= 1'b1;
+    @(negedge clk);
+    flist = $fopen(LIST, "r");
+    if (!flist) begin $display("ERROR: cannot open %s", LIST); $finish; end
+    while (!$feof(flist)) begin
+      rv = $fscanf(flist, "%s\n", path);
+      if (rv == 1) send_frame(path);
+    end
+    $fclose(flist);
+    $fclose(ffast); $fclose(faxis);
+    $display("tb_top_stream: %0d frames", frame_no);
+    $finish;
+  end
+
+endmodule
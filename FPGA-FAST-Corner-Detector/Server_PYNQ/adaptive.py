@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# adaptive.py  -  每個連線的 FAST threshold 回授控制 (--target-corners LO:HI)
+#
+# 固定的 threshold 在一段序列裡角點數會差很多，處理時間與回傳大小跟著跳。
+# 這裡比照 fast9_dualth_event_pix_dyn 在 INI_TH / MIN_TH 之間調 threshold 的
+# 想法，每個連線一個控制器，依上一張的角點數調下一張的 threshold：
+#   - 角點數在 [LO, HI] 內不動 (dead band)
+#   - 超出時依 log2(N / 目標) 成比例調整 (FAST 角點數對 threshold 大致是
+#     指數關係)，每步至少 1、最多 max_step，並限制在 [th_min, th_max]
+# threshold 怎麼套用由 backend 決定：
+#   - cpu：直接當 cv2 FAST 的 threshold (少掉的角點也省下偵測時間)
+#   - fpga / emu：IP 的 INI_TH / MIN_TH 是合成參數，只能在送出前丟掉
+#     score < threshold 的角點 (NMS 仍是 IP 自己的 threshold)
+# pipeline 模式下回授會晚 depth 張。狀態放在 REQ_STATS 的 JSON ("adaptive")。
+# ============================================================================
+import math
+
+class ThresholdController:
+    def __init__(self, lo, hi, th_min=7, th_max=20, th0=None, gain=2.0, max_step=4):
+        self.lo, self.hi = lo, hi
+        self.th_min, self.th_max = th_min, th_max
+        self.gain, self.max_step = gain, max_step
+        self.threshold = min(max(th_max if th0 is None else th0, th_min), th_max)
+        self.last = 0               # 上一張的角點數 (挑選 / 截斷前)
+        self.frames = self.in_band = self.changes = 0
+
+    def update(self, n):
+        # n：用目前 threshold 得到的角點數 -> 下一張的 threshold
+        self.last = n
+        self.frames += 1
+        if self.lo <= n <= self.hi:
+            self.in_band += 1
+            return self.threshold
+        err = math.log2(max(n, 1) / ((self.lo + self.hi) / 2))
+        step = int(round(self.gain * err)) or (1 if err > 0 else -1)
+        step = max(-self.max_step, min(self.max_step, step))
+        th = min(max(self.threshold + step, self.th_min), self.th_max)
+        if th != self.threshold:
+            self.changes += 1
+            self.threshold = th
+        return th
+
+    def snapshot(self):
+        return dict(threshold=self.threshold, target=[self.lo, self.hi], range=[self.th_min, self.th_max],
+                    last=self.last, frames=self.frames, changes=self.changes,
+                    in_band=round(self.in_band / max(self.frames, 1), 4))
+
+def filter_score(pts, threshold):
+    # backend 不能直接換 threshold 時 (fpga / emu)：丟掉 score < threshold 的角點
+    return pts[pts[:, 3] >= threshold]
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# backends.py  -  server 的運算後端 (fpga / cpu / emu)
+#
+# 每個 backend 都用同一組 slot 介面，server 的 serial / pipeline 兩條路徑
+# 不需要知道自己跑在哪個後端上：
+#   alloc_slot(H, W) -> slot   slot['plane'] 是 (H, W) uint8、C-contiguous，
+#                              socket 直接 recv_into 這裡
+#   receive(conn, slot, recv)  payload 從 socket 收進 slot (recv = server 的 recv_exact_into)；
+#                              FPGA 邊收邊把收完的列展開進 in_buf，prepare 就不用再搬一次
+#   free_slot(slot)
+#   slot_bytes(H, W)        -> 一組 slot 佔用的 bytes (bufpool 的 budget 用)
+#   prepare(slot)              payload 收完後 (FPGA: 搬進 CMA、寫 SOF header、flush)
+#   run(slot)                  算一張 frame (FPGA: vdma_start / wait_ioc / invalidate)
+#   collect(slot, extract)  -> pts, truncated
+#                              pts: (N, 4) '<u2' C-contiguous (x, y, strong, score)，
+#                              就是回傳給 client 的封包 body，server 直接送出
+# prepare / run 會把各段時間 (ns) 記進 slot['t'] (stage 名稱見 latency.STAGES)。
+# run() 只會在 scheduler 的 worker thread 上依序呼叫 (fpga / emu 有跨幀狀態)。
+# slot['stream'] 不是 None 時 (REQ_STREAM)，run 邊跑邊把進度回報給它 (見 rowstream.py)。
+# ============================================================================
+import time
+import numpy as np
+from rowstream import SENTINEL, band_edges
+
+INGEST_BYTES = 64 << 10     # FPGA receive：每收這麼多 bytes (整數列) 就展開一次
+
+def recv_plane(conn, slot, recv):
+    # H*W bytes 一次收進 slot['plane'] (cpu / emu，與 FPGA 不直接展開的 slot)
+    slot.pop('ingested', None)      # in_buf 不是這一張：prepare 要照舊搬
+    recv(conn, memoryview(slot['plane']).cast('B'))
+
+class FpgaBackend:
+    name = "FPGA"
+
+    def __init__(self, mmio, timeout=2.0, reset_per_frame=False, waiter=None):
+        import vdma, ioc_wait
+        self.vdma = vdma
+        self.waiter = waiter or ioc_wait.SpinWait()
+        self.mmio = mmio
+        self.timeout = timeout
+        self.reset_per_frame = reset_per_frame
+        self.tag = "RST" if reset_per_frame else "FPGA"
+        self.vdma_w = None      # 目前 VDMA HSIZE/STRIDE 對應的寬度
+
+    def alloc_slot(self, H, W):
+        slot = self.vdma.alloc_io_slot(H, W)
+        slot['plane'] = np.empty((H, W), dtype=np.uint8)
+        slot['shape'] = (H, W)
+        slot['t'] = {}
+        return slot
+
+    def free_slot(self, slot):
+        self.vdma.free_io_slot(slot)
+
+    def slot_bytes(self, H, W):
+        return 2 * H * W * 8        # in_buf + out_buf (CMA)
+
+    def receive(self, conn, slot, recv):
+        # 一次收幾列：收完就用 expand_rows 展開進 in_buf (後面的 bytes 這時還在進 socket
+        # buffer)，整張收完 in_buf 也好了。plane 仍然收一份 (incremental / tile / --record 用)
+        H, W = slot['shape']
+        plane, words = slot['plane'], slot['in_words']
+        mv = memoryview(plane).cast('B')
+        step = max(1, INGEST_BYTES // W)
+        slot.pop('ingested', None)  # 中途斷線時 in_buf 只有一半
+        ns = 0
+        for r0 in range(0, H, step):
+            r1 = min(H, r0 + step)
+            recv(conn, mv[r0 * W:r1 * W])
+            t0 = time.perf_counter_ns()
+            self.vdma.expand_rows(plane[r0:r1], words, r0, H, W)
+            ns += time.perf_counter_ns() - t0
+        slot['ingested'] = ns       # prepare 看到就只剩 flush (copy_in 記展開的時間)
+
+    def prepare(self, slot):
+        H, W = slot['shape']
+        t = slot['t']
+        t0 = time.perf_counter_ns()
+        ns = slot.pop('ingested', None)
+        if ns is None:
+            np.copyto(slot['in_plane0'], slot['plane'], casting='no')
+            self.vdma.write_frame_header(slot['in_bytes'], H, W)
+            ns = time.perf_counter_ns() - t0
+        t1 = time.perf_counter_ns()
+        slot['in_buf'].flush()
+        t['copy_in'] = ns; t['flush'] = time.perf_counter_ns() - t1
+
+    def run(self, slot):
+        H, W = slot['shape']
+        if self.vdma_w != W or self.reset_per_frame:
+            # [Reset Per Frame] 最簡單的 Soft Reset，不加任何複雜檢查
+            if self.reset_per_frame: self.vdma.vdma_soft_reset(self.mmio)
+            self.vdma.vdma_init(self.mmio, W, irq=self.waiter.irq)
+            self.vdma_w = W
+        stream = slot.get('stream')
+        if stream is not None:
+            marks = self._mark_bands(slot['out_buf'], band_edges(H, stream.bands)[:-1])
+        self.waiter.arm()
+        t0 = time.perf_counter_ns()
+        self.vdma.vdma_start(self.mmio, slot['in_buf'].physical_address,
+                             slot['out_buf'].physical_address, H)
+        try:
+            if stream is None:
+                self.waiter.wait(self.mmio, (H, W), t0, self.timeout)
+            else:
+                self._wait_bands(slot['out_buf'], marks, stream, t0)
+        except TimeoutError:
+            # 板子是共用的：重置後讓下一張 (可能是別的 client) 重新 init
+            self.vdma.vdma_soft_reset(self.mmio)
+            self.vdma_w = None
+            raise
+        t1 = time.perf_counter_ns()
+        slot['out_buf'].invalidate()
+        slot['t']['hw'] = t1 - t0; slot['t']['invalidate'] = time.perf_counter_ns() - t1
+        slot['t']['wait_cpu'] = self.waiter.last_cpu_ns
+
+    def _mark_bands(self, out, lines):
+        # 串流：每個 band 第一條 line 的第一個 word 寫 SENTINEL (原值留著，沒被 DMA 寫到時還原)
+        marks = [(L, out[L, 0]) for L in lines]
+        for L, _ in marks: out[L, 0] = SENTINEL
+        out.flush()
+        return marks
+
+    def _wait_bands(self, out, marks, stream, t0):
+        # 等 IOC 的同時看下一個 band 的 SENTINEL 有沒有被蓋掉：被蓋掉就表示前面的 line
+        # 都寫完了 (S2MM 依序寫)。每看一次要 invalidate 整個 out_buf，所以 band 不宜切太細
+        deadline = t0 + int(self.timeout * 1e9)
+        c0 = time.thread_time_ns()
+        i = 0
+        while self.vdma.poll_ioc(self.mmio) is None:
+            if i < len(marks):
+                out.invalidate()
+                if out[marks[i][0], 0] != SENTINEL:
+                    stream.lines(marks[i][0]); i += 1
+                    continue
+            if time.perf_counter_ns() > deadline:
+                raise TimeoutError("VDMA timeout")
+        out.invalidate()
+        for L, v in marks[i:]:
+            if out[L, 0] == SENTINEL: out[L, 0] = v
+        stream.lines(out.shape[0])
+        self.waiter.last_cpu_ns = time.thread_time_ns() - c0     # 一直在 poll，wait_cpu ~ hw
+
+    def collect(self, slot, extract):
+        return extract.records(slot['out_buf'])
+
+class CpuBackend:
+    name = tag = "CPU"
+    native_threshold = True         # slot['threshold'] 直接換 FAST threshold (adaptive.py)
+
+    def __init__(self, threshold=20, threads=0):
+        from cpu_fast import TiledFast
+        # 水平 strip 分給 thread pool，threads=0 用所有核心 (見 cpu_fast.py)
+        self.fast = TiledFast(threshold=threshold, threads=threads)
+        self.threshold = threshold
+
+    def alloc_slot(self, H, W):
+        return dict(plane=np.empty((H, W), dtype=np.uint8), shape=(H, W), t={})
+
+    def free_slot(self, slot):
+        pass
+
+    def slot_bytes(self, H, W):
+        return H * W
+
+    def receive(self, conn, slot, recv):
+        recv_plane(conn, slot, recv)
+
+    def prepare(self, slot):
+        pass
+
+    def run(self, slot):
+        t0 = time.perf_counter_ns()
+        stream = slot.get('stream')
+        if stream is None:
+            slot['result'] = self.fast.detect(slot['plane'], slot.get('threshold'))
+        else:
+            self.fast.detect_stream(slot['plane'], stream.rows, slot.get('threshold'), stream.bands)
+        slot['t']['hw'] = time.perf_counter_ns() - t0
+
+    def pool_cpu_ns(self):
+        # thread pool 累計的 CPU time；scheduler 在 run 前後各讀一次 (run 只在 worker 上跑)
+        return self.fast.cpu_ns
+
+    def collect(self, slot, extract):
+        # 角點不經過 extract，--max-corners 的上限與 truncated 照 TiledBackend.collect
+        rec = slot.pop('result')
+        n = len(rec)
+        extract.last_total = n
+        cap = len(extract.out) if extract.fixed else n      # --max-corners
+        return rec[:min(n, cap)], n > cap
+
+class EmuBackend:
+    """fast_emu.FastNmsModel 當成板子用：輸出與 out_buf 同樣的 64-bit layout，
+    再走與 FPGA 相同的 CornerExtractor，沒有板子時可以跑整條 server 路徑。"""
+    name = tag = "EMU"
+
+    def __init__(self, line_ns=0, **params):
+        from fast_emu import FastNmsModel
+        self.model = FastNmsModel(**params)
+        self.line_ns = line_ns      # 模擬 S2MM 寫一條 line 的時間 (0 = 不模擬，算完就回)
+
+    def alloc_slot(self, H, W):
+        if W > self.model.MAX_W or H > self.model.MAX_H:
+            raise ValueError(f"frame {W}x{H} exceeds MAX {self.model.MAX_W}x{self.model.MAX_H}")
+        return dict(plane=np.empty((H, W), dtype=np.uint8),
+                    out_buf=np.empty((H, W), dtype=np.uint64), shape=(H, W), t={})
+
+    def free_slot(self, slot):
+        pass
+
+    def slot_bytes(self, H, W):
+        return H * W * 9
+
+    def receive(self, conn, slot, recv):
+        recv_plane(conn, slot, recv)
+
+    def prepare(self, slot):
+        pass
+
+    def run(self, slot):
+        t0 = time.perf_counter_ns()
+        stream = slot.get('stream')
+
+        def written(n):
+            # out_buf 的前 n 條 line 做完了；line_ns 時不早於 S2MM 寫到那裡的時間
+            dt = (t0 + n * self.line_ns - time.perf_counter_ns()) / 1e9
+            if dt > 0: time.sleep(dt)
+            if stream is not None: stream.lines(n)
+
+        if stream is None:
+            self.model.run(slot['plane'], slot['out_buf'])
+            if self.line_ns: written(slot['shape'][0])
+        else:
+            # 模型一個 band 一個 band 算 (FAST / NMS / layout 都只做那幾列)，每做完一段就回報
+            self.model.run(slot['plane'], slot['out_buf'], bands=stream.bands, progress=written)
+        slot['t']['hw'] = time.perf_counter_ns() - t0
+
+    def collect(self, slot, extract):
+        return extract.records(slot['out_buf'])
+
+# ================= 演算法核心 =================
+def run_cpu_fast(img_gray, threshold=20, fast=None):
+    if fast is None:
+        import cv2
+        fast = cv2.FastFeatureDetector_create(threshold=threshold, nonmaxSuppression=True)
+    from cpu_fast import keypoints_to_records
+    return keypoints_to_records(fast.detect(img_gray, None), threshold)
+
+def make_backend(kind, mmio=None, timeout=2.0, reset_per_frame=False, threshold=20, emu_params=None,
+                 waiter=None, cpu_threads=0, max_shape=(768, 1024), incr_params=None):
+    # fpga / emu 受 IP 的 MAX_H x MAX_W 限制：更大的 frame 由 TiledBackend 切 tile。
+    # 最外層的 IncrementalBackend 只處理打開 incremental 的 slot，其餘直接往下傳
+    from tiling import TiledBackend
+    from incremental import IncrementalBackend
+    if kind == "fpga":
+        be = TiledBackend(FpgaBackend(mmio, timeout=timeout, reset_per_frame=reset_per_frame, waiter=waiter),
+                          *max_shape)
+    elif kind == "cpu":
+        be = CpuBackend(threshold=threshold, threads=cpu_threads)
+    elif kind == "emu":
+        emu = EmuBackend(**(emu_params or {}))
+        be = TiledBackend(emu, emu.model.MAX_H, emu.model.MAX_W)
+    else:
+        raise ValueError(f"unknown backend: {kind}")
+    return IncrementalBackend(be, **(incr_params or {}))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# bufpool.py  -  依解析度保留 in/out slot 的 pool (CMA 不必每次換尺寸都重配)
+#
+# client 交替送不同解析度 (整張 + pyramid 的縮小層) 時，原本每換一次尺寸就
+# free + allocate 一次 CMA。這裡把用完的 slot 放回 idle，下次同尺寸直接拿；
+# 換尺寸只剩 FpgaBackend.run 裡 vdma_init 的幾個 register write。
+#   - 已配置的總量 (idle + 使用中) 超過 budget 時，從最久沒用的 idle 開始釋放
+#   - CMA 真的配不到 (MemoryError / RuntimeError) 時先清掉全部 idle 再試一次
+#   - prewarm() 在開 server 時先配好宣告過的解析度
+# slot 的大小由 backend.slot_bytes(H, W) 決定 (FPGA 只算 CMA 的部分)。
+# TiledBackend / IncrementalBackend 跑 tile 用的 slot 也從同一個 pool 借
+# (backend.use_pool)，一樣算在 budget 裡、idle 時可以被 evict。
+# ============================================================================
+import threading
+from collections import OrderedDict
+
+class SlotPool:
+    def __init__(self, backend, budget_bytes=0):
+        self.backend = backend
+        self.budget = int(budget_bytes)     # 0 = 不限制
+        self.lock = threading.Lock()
+        self.idle = OrderedDict()           # id(slot) -> slot，最久沒用的在前面
+        self.bytes = 0                      # 目前配置中的總量 (idle + 使用中)
+        self.hits = self.misses = self.evictions = 0
+        use_pool = getattr(backend, "use_pool", None)
+        if use_pool is not None: use_pool(self)
+
+    def acquire(self, H, W):
+        with self.lock:
+            for k in reversed(self.idle):
+                if self.idle[k]['shape'] == (H, W):
+                    self.hits += 1
+                    return self.idle.pop(k)
+            self.misses += 1
+            need = self.backend.slot_bytes(H, W)
+            self._evict(need)
+            try:
+                slot = self.backend.alloc_slot(H, W)
+            except (MemoryError, RuntimeError):
+                if not self.idle: raise
+                self._evict(None)
+                slot = self.backend.alloc_slot(H, W)
+            slot['nbytes'] = need
+            self.bytes += need
+            print(f"[Pool] alloc {W}x{H} ({self._usage()})")
+            if self.budget and self.bytes > self.budget:
+                print(f"[Pool] WARN: slots in use exceed the budget ({self._usage()})")
+            return slot
+
+    def release(self, slot):
+        with self.lock:
+            self.idle[id(slot)] = slot
+            if self.budget and self.bytes > self.budget:
+                self._evict(0)
+
+    def prewarm(self, shapes, count=1):
+        # shapes: [(H, W), ...]；每個解析度先配 count 組 (pipeline 要 depth 組)
+        slots = [self.acquire(H, W) for H, W in shapes for _ in range(count)]
+        for slot in slots:
+            self.release(slot)
+        return self.summary()
+
+    def _evict(self, need):
+        # need=None：全部 idle 都釋放；否則釋放到 bytes + need 不超過 budget
+        while self.idle and (need is None or (self.budget and self.bytes + need > self.budget)):
+            _, slot = self.idle.popitem(last=False)
+            self.backend.free_slot(slot)
+            self.bytes -= slot['nbytes']
+            self.evictions += 1
+            H, W = slot['shape']
+            print(f"[Pool] evict {W}x{H} ({self._usage()})")
+
+    def _usage(self):
+        mb = self.bytes / 2**20
+        return f"{mb:.1f}/{self.budget / 2**20:.1f} MB" if self.budget else f"{mb:.1f} MB"
+
+    def summary(self):
+        with self.lock:
+            idle = sorted(f"{s['shape'][1]}x{s['shape'][0]}" for s in self.idle.values())
+            return (f"{self.hits} hits, {self.misses} allocs, {self.evictions} evictions, "
+                    f"{self._usage()}, idle [{', '.join(idle)}]")
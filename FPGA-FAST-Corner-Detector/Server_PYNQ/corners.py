@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# corners.py  -  top_fast_nms_to_dma 輸出 (64-bit word) 的角點抽取
+#   word = { y[63:48], x[47:32], 21'b0, is_strong[10], score[9:0] }
+#   score == 0 的 word 不是角點 (TLAST-only 佔位 / 沒被寫到的位置)
+#
+# 多核版本：把 H 列切成 row block，prange 先數每個 block 的角點數，
+# prefix-sum 得到每個 block 的起始 offset，再 prange 把角點寫到輸出。
+# 輸出順序與逐一掃描 (raster order) 完全相同。
+#
+# CornerSelector：送出前的挑選 (per-request，見 protocol.py 的 REQ_SELECT)
+#   - strong-only：只留 is_strong 的角點
+#   - grid：cols x rows 的格子，每格最多 per_cell 個 (分數高的優先)
+#   - top-K：整張最多 K 個 (分數高的優先)
+# score 只有 10 bits，用 counting sort 排出「分數高到低、同分依 raster」的
+# 順序後一次走完；留下的角點仍依 raster 順序輸出。
+#
+# kernel 到第一次呼叫 (或 startup.py 的 warm-up) 才 import numba 並編譯，
+# cache=True 讓編譯結果存在 __pycache__，重開 server 時直接載入；cpu backend
+# 不挑選角點時完全不會 import numba。
+# ============================================================================
+import numpy as np
+
+ROWS_PER_BLOCK = 16
+prange = range                      # 編譯前換成 numba.prange (見 compile_kernel)
+
+def _jit(**opts):
+    # 等同 njit(cache=True, **opts)，但延到第一次呼叫才 import numba / 編譯
+    def deco(fn):
+        def call(*args):
+            k = call.kernel
+            if k is None:
+                k = compile_kernel(call)
+            return k(*args)
+        call.kernel = None
+        call.py_func, call.opts = fn, opts
+        return call
+    return deco
+
+def compile_kernel(call):
+    global prange
+    from numba import njit, prange as numba_prange
+    prange = numba_prange
+    call.kernel = njit(cache=True, **call.opts)(call.py_func)
+    return call.kernel
+
+@_jit(parallel=True, fastmath=True)
+def _block_counts(words, rows_per_block, row_skip):
+    H, W = words.shape
+    nb = (H + rows_per_block - 1) // rows_per_block
+    counts = np.zeros(nb, dtype=np.int64)
+    for b in prange(nb):
+        r1 = min(H, (b + 1) * rows_per_block)
+        c = 0
+        for r in range(b * rows_per_block, r1):
+            for i in range(W):
+                if (words[r, i] & 0x3FF) != 0:
+                    c += 1
+                elif row_skip:
+                    break   # TLAST 佔位 word：這一列後面都是沒寫到的舊資料
+        counts[b] = c
+    return counts
+
+@_jit(parallel=True, fastmath=True)
+def _block_scatter(words, rows_per_block, row_skip, offsets, out):
+    H, W = words.shape
+    cap = out.shape[0]
+    nb = offsets.size
+    for b in prange(nb):
+        k = offsets[b]
+        r1 = min(H, (b + 1) * rows_per_block)
+        for r in range(b * rows_per_block, r1):
+            if k >= cap: break
+            for i in range(W):
+                w = words[r, i]
+                if (w & 0x3FF) != 0:
+                    if k >= cap: break
+                    out[k, 0] = (w >> 32) & 0xFFFF
+                    out[k, 1] = (w >> 48) & 0xFFFF
+                    out[k, 2] = (w >> 10) & 0x1
+                    out[k, 3] = w & 0x3FF
+                    k += 1
+                elif row_skip:
+                    break
+
+class CornerExtractor:
+    """把一整幀輸出 word 轉成 (x, y, strong, score) 四個 uint16 欄位。
+
+    內部 buffer 是 (N, 4) '<u2'，也就是回傳給 client 的封包格式：
+    records() 回傳它的前 N 列，server 可以不再打包直接送出。
+
+    out=None 時使用內部可成長的 buffer (不會截斷)；給定 out (N x 4, uint16)
+    或 max_corners 時容量固定，超過的部分會被截斷，並由 truncated 回報。
+    row_skip=True 時假設 TLAST_EACH_ROW=1 的 VDMA layout：每一列是
+    「角點 ... 0 (TLAST)」，遇到第一個 score==0 的 word 就跳到下一列。
+    回傳的陣列是 buffer 的 view，下一次呼叫前有效。
+    """
+    def __init__(self, out=None, max_corners=0, row_skip=False,
+                 rows_per_block=ROWS_PER_BLOCK):
+        self.fixed = out is not None or max_corners > 0
+        if out is None:
+            out = np.empty((max_corners if max_corners > 0 else 4096, 4), dtype="<u2")
+        self.out = out
+        self.row_skip = bool(row_skip)
+        self.rows_per_block = int(rows_per_block)
+        self.last_total = 0     # 截斷前的角點總數
+
+    def records(self, words):
+        # -> (pts, truncated)；pts 是 (N, 4) '<u2'、C-contiguous 的 buffer view
+        if words.ndim != 2:
+            raise ValueError("words must be (H, W)")
+        counts = _block_counts(words, self.rows_per_block, self.row_skip)
+        offsets = np.zeros(counts.size, dtype=np.int64)
+        np.cumsum(counts[:-1], out=offsets[1:])
+        total = int(offsets[-1] + counts[-1]) if counts.size else 0
+        if total > self.out.shape[0] and not self.fixed:
+            cap = self.out.shape[0]
+            while cap < total: cap *= 2
+            self.out = np.empty((cap, 4), dtype=self.out.dtype)
+        if total:
+            _block_scatter(words, self.rows_per_block, self.row_skip, offsets, self.out)
+        n = min(total, self.out.shape[0])
+        self.last_total = total
+        return self.out[:n], total > n
+
+    def __call__(self, words):
+        pts, truncated = self.records(words)
+        return pts[:, 0], pts[:, 1], pts[:, 2], pts[:, 3], truncated
+
+@_jit(fastmath=True)
+def _select(pts, H, W, top_k, per_cell, cols, rows, strong_only, out):
+    N = pts.shape[0]
+    # counting sort：key = 1023 - score，stable (同分保持 raster 順序)
+    start = np.zeros(1025, dtype=np.int64)
+    for i in range(N):
+        start[1024 - (pts[i, 3] & 0x3FF)] += 1
+    for k in range(1, 1025):
+        start[k] += start[k - 1]
+    order = np.empty(N, dtype=np.int64)
+    for i in range(N):
+        k = 1023 - (pts[i, 3] & 0x3FF)
+        order[start[k]] = i
+        start[k] += 1
+    keep = np.zeros(N, dtype=np.bool_)
+    cnt = np.zeros(max(cols * rows, 1), dtype=np.int64)
+    n = 0
+    for j in range(N):
+        if n >= top_k: break
+        i = order[j]
+        if strong_only and pts[i, 2] == 0: continue
+        if per_cell > 0:
+            cy = min(np.int64(pts[i, 1]) * rows // H, rows - 1)
+            cx = min(np.int64(pts[i, 0]) * cols // W, cols - 1)
+            c = cy * cols + cx
+            if cnt[c] >= per_cell: continue
+            cnt[c] += 1
+        keep[i] = True
+        n += 1
+    k = 0
+    for i in range(N):
+        if keep[i]:
+            for c in range(4):
+                out[k, c] = pts[i, c]
+            k += 1
+    return k
+
+class CornerSelector:
+    """(N, 4) records -> 挑選後的 records (raster 順序)。
+
+    sel = (top_k, per_cell, cols, rows, strong_only)；top_k = 0 不限總數，
+    per_cell = 0 或 cols / rows = 0 不分格。回傳內部 buffer 的 view，下一次
+    呼叫前有效 (每個連線一個)。
+    """
+    def __init__(self):
+        self.out = np.empty((4096, 4), dtype="<u2")
+
+    def __call__(self, pts, H, W, sel):
+        top_k, per_cell, cols, rows, strong_only = sel
+        N = len(pts)
+        if N > len(self.out):
+            self.out = np.empty((max(N, 2 * len(self.out)), 4), dtype="<u2")
+        if not (cols and rows): per_cell = 0
+        n = _select(pts, H, W, top_k or N, per_cell, cols, rows, bool(strong_only), self.out)
+        return self.out[:n]
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# cpu_fast.py  -  多核心 CPU FAST (--backend cpu)
+#
+# OpenCV 的 FAST 只用一顆核心。這裡把 frame 切成 n 條水平 strip，每條上下
+# 各多帶 3 rows (FAST 圓半徑) 丟給 thread pool (cv2.detect 期間會放掉 GIL)：
+#   - strip 內部的 row：偵測與 3x3 NMS 需要的分數都在 strip 裡，直接用
+#     OpenCV 的結果 (與整張跑完全相同)
+#   - 接縫兩側各一個 row：NMS 需要隔壁 strip 的分數，OpenCV 又不會回傳被
+#     抑制掉的分數，所以這兩個 row 用 numpy 重算 cornerScore 後自己做 NMS
+# 結果與整張 frame 跑一次 cv2 FAST (nonmaxSuppression=True) 逐點相同，
+# 順序也一樣是 row-major。keypoint 直接轉成 (N, 4) '<u2' records
+# (cv2.KeyPoint_convert 與 map(attrgetter))，沒有逐點的 Python 迴圈。
+#   python3 cpu_fast.py img.png [--threads N]    # 與單執行緒比對並計時
+# ============================================================================
+import os, time, threading, operator
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+PAD = 3                     # FAST 圓半徑：strip 上下多帶的 rows
+# REQ_STREAM 每個 band 至少要算這麼久 (ns) 才分開送：每多一個 chunk，connection 端
+# 要多一次 parse + send，單核心還要多切換兩次 thread (PC 上約 0.1-0.2 ms)
+STREAM_MIN_BAND_NS = 1_000_000
+# Bresenham 圓 (radius 3) 的 16 點，順序與 OpenCV makeOffsets(16) 相同
+CIRCLE = ((0, 3), (1, 3), (2, 2), (3, 1), (3, 0), (3, -1), (2, -2), (1, -3),
+          (0, -3), (-1, -3), (-2, -2), (-3, -1), (-3, 0), (-3, 1), (-2, 2), (-1, 3))
+_response = operator.attrgetter("response")
+
+def keypoints_to_records(keypoints, threshold):
+    # KeyPoint list -> (N, 4) '<u2' 的 x, y, strong, score (回傳給 client 的封包格式)；
+    # 全在 C 層完成
+    N = len(keypoints)
+    rec = np.empty((N, 4), dtype="<u2")
+    if N == 0:
+        return rec
+    rec[:, :2] = cv2.KeyPoint_convert(keypoints)
+    resp = np.fromiter(map(_response, keypoints), dtype=np.float32, count=N)
+    rec[:, 2] = 1
+    rec[:, 3] = np.where(resp > 0, resp, threshold)
+    return rec
+
+def corner_scores(img, y0, y1, threshold):
+    """rows [y0, y1) 的 OpenCV cornerScore (非 corner 或離邊界 < 3 為 0)，
+    shape (y1 - y0, W)。需要 3 <= y0 且 y1 <= H - 3。"""
+    H, W = img.shape
+    ring = np.stack([img[y0 + dy:y1 + dy, PAD + dx:W - PAD + dx]
+                     for dx, dy in CIRCLE + CIRCLE[:8]])          # 圓周 wrap 成 24 點
+    d = img[y0:y1, PAD:W - PAD].astype(np.int16) - ring
+    d = np.stack([d, -d])               # [0]: 中心比圓周亮，[1]: 中心比圓周暗
+    m2 = np.minimum(d[:, :-1], d[:, 1:])
+    m4 = np.minimum(m2[:, :-2], m2[:, 2:])
+    m8 = np.minimum(m4[:, :-4], m4[:, 4:])
+    m = np.minimum(m8[:, :16], d[:, 8:24]).max(axis=(0, 1))   # 最好的連續 9 點弧
+    out = np.zeros((y1 - y0, W), dtype=np.int16)
+    out[:, PAD:W - PAD] = np.where(m > threshold, m - 1, 0)
+    return out
+
+def seam_corners(img, s, threshold):
+    # 接縫 s (上一條 strip 的最後一 row 是 s-1) 的 rows s-1, s：
+    # 先算 s-2 .. s+1 的分數，再做與 OpenCV 相同的 3x3 NMS (嚴格大於 8 個鄰居)
+    sc = corner_scores(img, s - 2, s + 2, threshold)
+    W = sc.shape[1]
+    ctr = sc[1:3, 1:W - 1]
+    keep = ctr > 0
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            if dy != 1 or dx != 1:
+                keep &= ctr > sc[dy:dy + 2, dx:dx + W - 2]
+    yy, xx = np.nonzero(keep)
+    rec = np.empty((len(xx), 4), dtype="<u2")
+    rec[:, 0] = xx + 1; rec[:, 1] = yy + s - 1
+    rec[:, 2] = 1; rec[:, 3] = ctr[yy, xx]
+    return rec
+
+class TiledFast:
+    """cv2 FAST + NMS，水平 strip 平行化。threads=0 用所有核心；每條 strip
+    至少 min_rows rows，小 frame 會自動少切幾條。"""
+    def __init__(self, threshold=20, threads=0, min_rows=32):
+        self.threshold = threshold
+        self.threads = threads or os.cpu_count() or 1
+        self.min_rows = max(min_rows, 4 * PAD)
+        self.pool = ThreadPoolExecutor(self.threads) if self.threads > 1 else None
+        self.local = threading.local()          # 每條 thread 自己一個 detector
+        self.cpu_ns = 0                         # pool 裡的 thread 累計用掉的 CPU time
+        self.cpu_lock = threading.Lock()
+        self.px_ns = 0.0                        # 每個 pixel 的 CPU time (EMA)，決定串流的 band 數
+
+    def _detector(self, threshold):
+        fast = getattr(self.local, "fast", None)
+        if fast is None:
+            fast = self.local.fast = cv2.FastFeatureDetector_create(threshold=threshold,
+                                                                    nonmaxSuppression=True)
+        elif fast.getThreshold() != threshold:
+            fast.setThreshold(threshold)        # adaptive threshold (見 adaptive.py)
+        return fast
+
+    def _submit(self, fn, *args):
+        return self.pool.submit(self._timed, fn, args)
+
+    def _timed(self, fn, args):
+        # future 的結果在這裡 return 之後才設定，所以 result() 回來時 cpu_ns 已經加上了
+        c0 = time.thread_time_ns()
+        try:
+            return fn(*args)
+        finally:
+            with self.cpu_lock: self.cpu_ns += time.thread_time_ns() - c0
+
+    def _strip(self, img, r0, r1, threshold):
+        # 擁有 rows [r0, r1)；回傳其中不貼著接縫的部分
+        H = img.shape[0]
+        a, b = max(r0 - PAD, 0), min(r1 + PAD, H)
+        rec = keypoints_to_records(self._detector(threshold).detect(img[a:b], None), threshold)
+        rec[:, 1] += a
+        lo = r0 + 1 if r0 > 0 else 0
+        hi = r1 - 1 if r1 < H else H
+        i, j = np.searchsorted(rec[:, 1], (lo, hi))     # 輸出是 row-major，y 已排序
+        return rec[i:j]
+
+    def _learn(self, cpu_ns, px):
+        v = cpu_ns / px
+        self.px_ns = v if not self.px_ns else 0.8 * self.px_ns + 0.2 * v
+
+    def bounds(self, H):
+        n = max(1, min(self.threads, H // self.min_rows))
+        return [H * k // n for k in range(n + 1)]
+
+    def detect(self, img, threshold=None):
+        # -> (N, 4) '<u2' records (x, y, strong, score)；threshold=None 用建構時的值
+        th = self.threshold if threshold is None else threshold
+        rows = self.bounds(img.shape[0])
+        c0, p0 = time.thread_time_ns(), self.cpu_ns
+        if len(rows) == 2:
+            rec = keypoints_to_records(self._detector(th).detect(img, None), th)
+        else:
+            # strip 0, seam 1, strip 1, seam 2, ... 依序接起來就是 row-major
+            jobs = []
+            for k in range(len(rows) - 1):
+                jobs.append(self._submit(self._strip, img, rows[k], rows[k + 1], th))
+                if k + 2 < len(rows):
+                    jobs.append(self._submit(seam_corners, img, rows[k + 1], th))
+            rec = np.concatenate([j.result() for j in jobs])
+        self._learn(time.thread_time_ns() - c0 + self.cpu_ns - p0, img.size)
+        return rec
+
+    def _band(self, img, r0, r1, threshold):
+        # 擁有 rows [r0, r1)，上下各多帶 PAD + 1 rows：cv2 的 NMS 在視窗內第 PAD + 1 row
+        # 起才有上一 row 的分數，所以 [r0, r1) 的結果與整張相同，不必另外算接縫
+        H = img.shape[0]
+        a, b = max(r0 - PAD - 1, 0), min(r1 + PAD + 1, H)
+        rec = keypoints_to_records(self._detector(threshold).detect(img[a:b], None), threshold)
+        rec[:, 1] += a
+        i, j = np.searchsorted(rec[:, 1], (r0, r1))
+        return rec[i:j]
+
+    def detect_stream(self, img, emit, threshold=None, bands=8):
+        # REQ_STREAM 用：切成 bands 條，依序 emit(records, y_done)，y_done 以上的 row 都已完成。
+        # 每個 band 再切成 (最多) threads 條一起做，band 依序排進 pool：band 0 約在整張
+        # 1/bands 的時間就做完 (每條 thread 一個 band 的話，前 threads 個 band 會同時才完成)。
+        # 整張算得快的時候 band 少切一點，每個 band 至少 STREAM_MIN_BAND_NS (最少一個 band，
+        # 這時第一個 chunk 就是整張)，不然多送的 chunk 比省下的時間還多
+        th = self.threshold if threshold is None else threshold
+        H = img.shape[0]
+        n = max(1, min(bands, H // self.min_rows))
+        if self.px_ns:
+            n = max(1, min(n, int(self.px_ns * img.size / self.threads / STREAM_MIN_BAND_NS)))
+        rows = [H * k // n for k in range(n + 1)]
+        if self.pool is None:
+            c = 0
+            for k in range(n):
+                c0 = time.thread_time_ns()
+                rec = self._band(img, rows[k], rows[k + 1], th)
+                c += time.thread_time_ns() - c0
+                emit(rec, rows[k + 1])
+                # 單核心：讓 connection thread 先把這個 chunk 送出，不然要等整張做完才輪到它
+                os.sched_yield()
+            self._learn(c, img.size)
+            return
+        p0 = self.cpu_ns
+        futs = []
+        for k in range(n):
+            r0, r1 = rows[k], rows[k + 1]
+            m = max(1, min(self.threads, (r1 - r0) // self.min_rows))
+            sub = [r0 + (r1 - r0) * i // m for i in range(m + 1)]
+            futs.append([self._submit(self._band, img, sub[i], sub[i + 1], th) for i in range(m)])
+        for k, fs in enumerate(futs):
+            parts = [f.result() for f in fs]
+            emit(np.concatenate(parts) if len(parts) > 1 else parts[0], rows[k + 1])
+        self._learn(self.cpu_ns - p0, img.size)
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser()
+    ap.add_argument("images", nargs="+")
+    ap.add_argument("--threshold", type=int, default=20)
+    ap.add_argument("--threads", type=int, default=0)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    tf = TiledFast(args.threshold, args.threads)
+    ref = cv2.FastFeatureDetector_create(threshold=args.threshold, nonmaxSuppression=True)
+    for path in args.images:
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        want = keypoints_to_records(ref.detect(img, None), args.threshold)
+        got = tf.detect(img)
+        same = np.array_equal(want, got)
+        t0 = time.perf_counter()
+        for _ in range(args.repeat): keypoints_to_records(ref.detect(img, None), args.threshold)
+        t1 = time.perf_counter()
+        for _ in range(args.repeat): tf.detect(img)
+        t2 = time.perf_counter()
+        print(f"{path}: {len(want)} corners, match={same}, 1 thread {(t1 - t0) / args.repeat * 1e3:.2f} ms, "
+              f"{tf.threads} threads x {len(tf.bounds(img.shape[0])) - 1} strips {(t2 - t1) / args.repeat * 1e3:.2f} ms")
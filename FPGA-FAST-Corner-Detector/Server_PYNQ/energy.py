@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# energy.py  -  每張 frame 花多少能量 / CPU (--energy)
+#
+# Docs/power.png 是 Vivado 的靜態估計；這裡在 server 跑的時候實際量：
+#   - 電源 rail：<root>/class/hwmon/hwmon*/power*_input (uW，取樣後梯形積分) 與
+#     energy*_input (uJ 累計)，<root>/class/powercap/*/energy_uj (uJ 累計，
+#     依 max_energy_range_uj 處理 wrap)。ZCU104 的 INA226 走 ina2xx 驅動就是
+#     hwmon 的 power1_input；PYNQ-Z2 沒有量測晶片時只剩 CPU time。
+#     powercap 的子 zone (intel-rapl:0:0) 已算在上層 zone 裡，不加進總和。
+#   - CPU：resource.getrusage 的 user + sys (整個 process，含 worker、cv2 的
+#     thread)。serial 模式每張另記各段的 CPU time (cpu_rx / cpu_run / cpu_post，
+#     見 latency.STAGES)：connection thread 與 worker 各自的 thread time，只算
+#     這一張，多個 client 同時連線也不會互相灌水；pipeline 模式幾張 frame 同時
+#     在不同 stage，只看整個 session 的 CPU-s/frame。
+# 能量是整塊板子 (含閒置) 在這段時間的總和，所以 frames/J 是「這個負載下」的
+# 值；多個 client 同時連線時各 session 的數字會重疊。
+# root 預設 /sys，可以指到假的目錄樹測試：
+#   python3 energy.py --root /tmp/fake_sys [--seconds 2]
+# ============================================================================
+import os, re, glob, time, threading, resource
+
+def _read(path):
+    try:
+        with open(path) as f: return f.read().strip()
+    except OSError:
+        return None
+
+class Rail:
+    __slots__ = ("name", "path", "kind", "scale", "wrap", "in_total")
+
+    def __init__(self, name, path, kind, scale, wrap=0, in_total=True):
+        self.name, self.path = name, path
+        self.kind = kind            # 'power' (瞬間值，積分) / 'energy' (累計計數器)
+        self.scale = scale          # 讀到的整數 -> W 或 J
+        self.wrap = wrap            # energy 計數器的上限 (0 = 不知道)
+        self.in_total = in_total
+
+    def read(self):
+        v = _read(self.path)
+        return None if v is None or not v.lstrip("-").isdigit() else int(v) * self.scale
+
+def find_rails(root="/sys", pattern=None):
+    """root 底下的 hwmon / powercap rail；pattern (regex) 只留名稱符合的。"""
+    rails = []
+    for hw in sorted(glob.glob(os.path.join(root, "class", "hwmon", "hwmon*"))):
+        dev = _read(os.path.join(hw, "name")) or os.path.basename(hw)
+        for kind, scale in (("power", 1e-6), ("energy", 1e-6)):
+            for path in sorted(glob.glob(os.path.join(hw, f"{kind}*_input"))):
+                ch = os.path.basename(path)[:-len("_input")]
+                label = _read(os.path.join(hw, f"{ch}_label")) or ch
+                rails.append(Rail(f"{dev}/{label}", path, kind, scale))
+    for zone in sorted(glob.glob(os.path.join(root, "class", "powercap", "*"))):
+        path = os.path.join(zone, "energy_uj")
+        if not os.path.exists(path): continue
+        z = os.path.basename(zone)
+        label = _read(os.path.join(zone, "name")) or z
+        wrap = _read(os.path.join(zone, "max_energy_range_uj"))
+        rails.append(Rail(f"{z}/{label}", path, "energy", 1e-6, int(wrap) * 1e-6 if wrap and wrap.isdigit() else 0,
+                          in_total=z.count(":") <= 1))
+    if pattern:
+        rails = [r for r in rails if re.search(pattern, r.name)]
+    return [r for r in rails if r.read() is not None]
+
+def cpu_seconds():
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_utime + ru.ru_stime
+
+class EnergyMeter:
+    """rail 的累計能量 (J)、process CPU 秒數與處理過的 frame 數。power rail 由
+    背景 thread 每 interval 秒取樣一次；snapshot() 會先補一次取樣。"""
+    def __init__(self, rails, interval=0.05):
+        self.rails = rails
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.joules = {r.name: 0.0 for r in rails}
+        self.last = {r.name: r.read() for r in rails}
+        self.t_last = self.t0 = time.perf_counter()
+        self.cpu0 = cpu_seconds()
+        self.frames = 0
+        self.stop = threading.Event()
+        self.th = None
+        if rails:
+            self.th = threading.Thread(target=self._loop, daemon=True)
+            self.th.start()
+
+    def _loop(self):
+        while not self.stop.wait(self.interval):
+            with self.lock: self._sample()
+
+    def _sample(self):
+        now = time.perf_counter()
+        dt = now - self.t_last
+        self.t_last = now
+        for r in self.rails:
+            v = r.read()
+            prev = self.last[r.name]
+            if v is None or prev is None:
+                self.last[r.name] = v if v is not None else prev
+                continue
+            if r.kind == "power":
+                self.joules[r.name] += (prev + v) / 2 * dt
+            else:
+                d = v - prev
+                if d < 0: d = d + r.wrap if r.wrap else 0.0       # 計數器繞回
+                self.joules[r.name] += d
+            self.last[r.name] = v
+
+    def add_frames(self, n=1):
+        with self.lock: self.frames += n
+
+    def snapshot(self):
+        # 累計值；report(since=...) 拿兩次 snapshot 相減
+        with self.lock:
+            if self.rails: self._sample()
+            return dict(t=self.t_last if self.rails else time.perf_counter(), cpu=cpu_seconds() - self.cpu0,
+                        frames=self.frames, rails=dict(self.joules))
+
+    def report(self, since=None):
+        s = self.snapshot()
+        b = since or dict(t=self.t0, cpu=0.0, frames=0, rails={k: 0.0 for k in s['rails']})
+        dt = max(s['t'] - b['t'], 1e-9)
+        n = s['frames'] - b['frames']
+        cpu = s['cpu'] - b['cpu']
+        rails = {k: s['rails'][k] - b['rails'][k] for k in s['rails']}
+        total = [r.name for r in self.rails if r.in_total]
+        out = dict(seconds=round(dt, 3), frames=n, cpu_s=round(cpu, 4),
+                   cpu_s_per_frame=round(cpu / n, 6) if n else None, cpu_util=round(cpu / dt, 3))
+        if total:
+            J = sum(rails[k] for k in total)
+            out.update(joules=round(J, 4), watts=round(J / dt, 3),
+                       frames_per_joule=round(n / J, 3) if J > 0 else None,
+                       mj_per_frame=round(J / n * 1e3, 4) if n else None,
+                       rails={k: dict(joules=round(v, 4), watts=round(v / dt, 3)) for k, v in rails.items()})
+        return out
+
+    def summary(self, since=None):
+        d = self.report(since)
+        cpf = f"{d['cpu_s_per_frame'] * 1e3:.3f} ms" if d['cpu_s_per_frame'] is not None else "-"
+        line = f"{d['frames']} frames in {d['seconds']:.1f} s, CPU {d['cpu_s']:.2f} s ({d['cpu_util']:.2f} cores), {cpf} CPU/frame"
+        if 'joules' not in d:
+            return line + ", no power rails"
+        fpj = f"{d['frames_per_joule']:.2f}" if d['frames_per_joule'] is not None else "-"
+        return line + f", {d['joules']:.2f} J (avg {d['watts']:.2f} W), {fpj} frames/J"
+
+    def close(self):
+        self.stop.set()
+        if self.th is not None: self.th.join()
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="List power rails and measure idle power")
+    ap.add_argument("--root", default="/sys", help="sysfs root (a fake tree works for testing)")
+    ap.add_argument("--rails", default=None, metavar="REGEX", help="only rails whose name matches")
+    ap.add_argument("--seconds", type=float, default=1.0)
+    ap.add_argument("--interval", type=float, default=0.05)
+    args = ap.parse_args()
+    rails = find_rails(args.root, args.rails)
+    for r in rails:
+        print(f"  {r.name:<32} {r.kind:<6} {'' if r.in_total else '(sub-zone, not in total) '}{r.path}")
+    if not rails: print(f"no hwmon / powercap rails under {args.root}")
+    meter = EnergyMeter(rails, args.interval)
+    time.sleep(args.seconds)
+    d = meter.report()
+    meter.close()
+    for k, v in d.get('rails', {}).items():
+        print(f"  {k:<32} {v['watts']:.3f} W")
+    print(f"total {d.get('watts', '-')} W, CPU {d['cpu_util']} cores")
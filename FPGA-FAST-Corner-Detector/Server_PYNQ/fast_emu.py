@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# fast_emu.py  -  top_fast_nms_to_dma 的軟體模型 (NumPy / numba)
+#
+# 輸入一張 gray frame，輸出與 S2MM 寫回 out_buf 相同格式的 64-bit word：
+#   { y[63:48], x[47:32], 21'b0, is_strong[10], score[9:0] }
+#
+# FAST (fast9_dualth_event_pix_dyn) 逐 bit 照 fast.v 的資料路徑：
+#   - 事件座標 x = 3..W-4、y = 3..H-4
+#   - 圓周最下面一列 (dy=+3) 讀的是正在被寫入的 BRAM bank (read-first)，
+#     實際拿到的是 y-4 那一列；y==3 時拿到的是上一幀留在 bank 6 的內容
+#   - hits_from_mask_balanced 只取 [15:0]，連續段不會跨過 15 -> 0；
+#     score 是從命中位置 j 往後 12 點 (j..j+11 mod 16) 的 min |P-Ic|
+#   - strong score != 0 時 is_strong=1，否則輸出 weak (MIN_TH) 的 score
+#   BRAM 的內容會跨幀保留，所以模型本身也是有狀態的 (同一塊板子的行為)。
+#
+# NMS 有兩種模型，用 AS_BUILT 選：
+#   AS_BUILT=0 (預設) 是 nms3x3_event_pix_dense 設計上的 3x3 語意：中心與 8 鄰居比，
+#     STRICT_GREATER / TIE_MODE (parity 用的是 +1,+1 的串流座標) / APPLY_NEG1 /
+#     CLAMP_MAX 與 RTL 參數相同。TLAST 與角點的先後用輸入位置決定。
+#   AS_BUILT=1 照 nms.v / top 目前寫的樣子逐 cycle 模擬 (MM2S 每拍 valid、S2MM 一直
+#     ready、幀後 IDLE_CYCLES 個 idle cycle)：FAST 的 3 級 pipeline 與 backpressure、
+#     NMS 的 line buffer (跨幀保留) 與各級暫存器、top 的 TLAST 仲裁。
+#     nms.v 的 row*_max 比 c_s_d1 早一拍註冊而且含中心，neigh_max == c_s，
+#     所以只剩 tie 的規則會保留角點，keep 在事件之間維持住會重複輸出；
+#     上一幀最後一個 FAST 事件要到下一幀 SOF 才送出。
+#   AS_BUILT=1 與 Verilator 跑 Hardware_Source/tb_top_stream.sv 逐 word 比對的
+#   工具是 rtl_compare.py (FAST 事件也一併比對)。
+#
+# 輸出 layout：TLAST_EACH_ROW=1 時 top 在輸入第 1..H-2 列的行尾各插一個
+# data=0 的 TLAST word，S2MM 每遇到 TLAST 就換到下一條 line，所以 line k 是
+# 「角點 ... 0」，其餘位置沒被寫到 (模型填 0)。超過 H 條 line 的 word 丟掉。
+# ============================================================================
+import numpy as np
+from numba import njit, prange
+
+RADIUS = 3
+# Bresenham circle，與 fast.v 的 dx_lut / dy_lut 相同順序
+CIRCLE_DX = np.array([0, 1, 2, 3, 3, 3, 2, 1, 0, -1, -2, -3, -3, -3, -2, -1], dtype=np.int64)
+CIRCLE_DY = np.array([-3, -3, -2, -1, 0, 1, 2, 3, 3, 3, 2, 1, 0, -1, -2, -3], dtype=np.int64)
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _fast9_dualth(img, bank6, ini_th, min_th, min_contig, pack, ya, yb):
+    # pack[y, x] = {is_strong, score}，y in [ya, yb)；只寫事件範圍，其他位置保持 0
+    H, W = img.shape
+    for y in prange(ya, yb):
+        P = np.empty(16, dtype=np.int64)
+        D = np.empty(16, dtype=np.int64)
+        for x in range(RADIUS, W - RADIUS):
+            Ic = np.int64(img[y, x])
+            for k in range(16):
+                dx = CIRCLE_DX[k]; dy = CIRCLE_DY[k]
+                if dy == 3:
+                    # read-first BRAM：拿到 y-4 列，y==3 時是上一幀的 bank 6
+                    P[k] = img[y - 4, x + dx] if y > 3 else bank6[x - 1 + dx]
+                else:
+                    P[k] = img[y + dy, x + dx]
+                D[k] = P[k] - Ic if P[k] >= Ic else Ic - P[k]
+            score = np.int64(0); strong = 0
+            for th_i in range(2):
+                th = ini_th if th_i == 0 else min_th
+                mb = 0; md = 0; sim = 0
+                for k in range(16):
+                    if P[k] >= Ic + th:   mb |= 1 << k
+                    elif P[k] + th <= Ic: md |= 1 << k
+                    else:                 sim += 1
+                best = np.int64(0)
+                if sim <= 4:
+                    for j in range(min_contig - 1, 16):
+                        run = ((1 << min_contig) - 1) << (j - min_contig + 1)
+                        if (mb & run) == run or (md & run) == run:
+                            m = np.int64(255)
+                            for t in range(12):
+                                d = D[(j + t) & 15]
+                                if d < m: m = d
+                            if m > best: best = m
+                if th_i == 0:
+                    if best != 0:
+                        score = best; strong = 1
+                        break
+                else:
+                    score = best
+            pack[y, x] = (strong << 10) | score
+
+@njit(fastmath=True, cache=True)
+def _nms3x3(pack, x0, x1, y0, y1, min_score, strict_gt, tie_mode, apply_neg1, clamp_max,
+            W, H, words, pos):
+    # 中心 (x, y) 在串流上由事件 (x+1, y+1) 觸發；pos 是該事件的輸入 pixel index
+    n = 0
+    for y in range(y0, y1):
+        for x in range(x0, x1):
+            c = pack[y, x] & 0x3FF
+            if c < min_score: continue
+            nmax = 0; eq = False
+            for dy in range(-1, 2):
+                for dx in range(-1, 2):
+                    if dx == 0 and dy == 0: continue
+                    v = pack[y + dy, x + dx] & 0x3FF
+                    if v > nmax: nmax = v
+                    if v == c: eq = True
+            sx = x + 1; sy = y + 1
+            keep = c > nmax
+            if not strict_gt and not keep and c == nmax and eq:
+                if tie_mode == 1:   keep = (sx & 1) == 0 and (sy & 1) == 0
+                elif tie_mode == 2: keep = ((sx ^ sy) & 1) == 1
+            if not keep: continue
+            ox = (sx - 1 if sx > 0 else 0) if apply_neg1 else sx
+            oy = (sy - 1 if sy > 0 else 0) if apply_neg1 else sy
+            if clamp_max and ox >= W: ox = W - 1
+            if clamp_max and oy >= H: oy = H - 1
+            words[n] = (np.uint64(oy) << np.uint64(48)) | (np.uint64(ox) << np.uint64(32)) | np.uint64(pack[y, x])
+            # FAST 事件 (sx, sy) 在 acc (col=sx+3, row=sy+3) 時被擷取
+            pos[n] = (sy + RADIUS) * W + (sx + RADIUS) + 1
+            n += 1
+    return n
+
+@njit(fastmath=True, cache=True)
+def _layout(words, pos, n, W, H, tlast_each_row, out, st, p_end, final):
+    # S2MM：每條 line W 個 word，TLAST 提早結束目前的 line。
+    # 可以分段呼叫：st = [line, col, j, t] 接著上次的位置，只處理輸入位置 < p_end
+    # 的 TLAST (之前的角點 word 都已經在 words[:n])；final 時把剩下的 word 寫完。
+    # 回傳已經寫完的 line 數
+    line = st[0]; col = st[1]; j = st[2]; t = st[3]
+    n_tlast = H - 2 if tlast_each_row else 0
+    while t <= n_tlast:
+        p_tlast = t * W + (W - 1)
+        if p_tlast >= p_end and not final: break
+        while j < n and pos[j] < p_tlast:
+            if line < H:
+                out[line, col] = words[j]
+                col += 1
+                if col == W: line += 1; col = 0
+            j += 1
+        if line < H:
+            out[line, col] = 0
+            line += 1; col = 0
+        t += 1
+    if final:
+        while j < n:
+            if line < H:
+                out[line, col] = words[j]
+                col += 1
+                if col == W: line += 1; col = 0
+            j += 1
+        line = H
+    st[0] = line; st[1] = col; st[2] = j; st[3] = t
+    return line
+
+# ---------------- AS_BUILT：逐 cycle 的 FAST 控制 + nms.v + top 仲裁 ----------------
+# cs 是跨幀保留的暫存器 (index 見 _CS)，lb 是 nms.v 的兩條 line buffer
+_CS = ('col row fw fh sof_acc s0_v s0_x s0_y s0_ok s0_p s1_v s1_x s1_y s1_ok s1_p '
+       's2_v s2_x s2_y s2_ok s2_p fm_v fm_x fm_y fm_p '
+       'x_d1 y_d1 last_y lb_sel lb1_rd lb2_rd r0l r0c r0r r1l r1c r1r r2l r2c r2r '
+       'rm0 rm1 rm2 nmax any_eq cv cx cy cp nv nw '
+       'in_y tw th pend_row pend_frm ov ol od prev_p').split()
+
+@njit(cache=True)
+def _stream_asbuilt(pack, H, W, max_w, max_h, tlast_each_row, min_score, strict_gt, tie_mode,
+                    apply_neg1, clamp_max, idle, cs, lb, words, tl):
+    # 送進一幀 (每拍 valid) 再跑 idle 個 idle cycle；回傳這段期間 m_axis 上的 word 數。
+    # 每一拍先用邊緣前的值算組合邏輯，再一起更新暫存器
+    (col, row, fw, fh, sof_acc, s0_v, s0_x, s0_y, s0_ok, s0_p, s1_v, s1_x, s1_y, s1_ok, s1_p,
+     s2_v, s2_x, s2_y, s2_ok, s2_p, fm_v, fm_x, fm_y, fm_p,
+     x_d1, y_d1, last_y, lb_sel, lb1_rd, lb2_rd, r0l, r0c, r0r, r1l, r1c, r1r, r2l, r2c, r2r,
+     rm0, rm1, rm2, nmax, any_eq, cv, cx, cy, cp, nv, nw,
+     in_y, tw, th, pend_row, pend_frm, ov, ol, od, prev_p) = cs
+    n_pix = H * W
+    b = 0; cyc = 0; n = 0
+    while True:
+        tvalid = b < n_pix
+        if not tvalid:
+            if cyc >= idle: break
+            cyc += 1
+        tuser = tvalid and b == 0
+        tlast = tvalid and b % W == W - 1
+        # ---- FAST：3 級 pipeline，輸出端 m_ready 一直是 1
+        s1_take = s0_v == 1 and s1_v == 0
+        s2_take = s1_v == 1 and s2_v == 0
+        out_take = s2_v == 1
+        acc = tvalid and (s0_v == 0 or s1_take)
+        # ---- NMS：keep 只看 _d1 暫存器
+        c = cp & 0x3FF
+        keep = c > nmax
+        if strict_gt == 0 and c == nmax and any_eq == 1:
+            if tie_mode == 1:   keep = keep or ((cx & 1) == 0 and (cy & 1) == 0)
+            elif tie_mode == 2: keep = keep or ((cx ^ cy) & 1) == 1
+        keep = cv == 1 and c >= min_score and keep
+        ox = (cx - 1 if cx > 0 else 0) if apply_neg1 else cx
+        oy = (cy - 1 if cy > 0 else 0) if apply_neg1 else cy
+        if clamp_max and ox >= tw: ox = tw - 1
+        if clamp_max and oy >= th: oy = th - 1
+        last_center = cv == 1 and cx == tw - 2 and cy == th - 2
+        # ---- top 輸出
+        if ov == 1:
+            words[n] = od; tl[n] = ol; n += 1
+        # ================= 暫存器更新 =================
+        # top：TLAST 注入與輸出仲裁
+        n_pend_row = pend_row; n_pend_frm = pend_frm
+        if acc and tlast:
+            if tlast_each_row:
+                if in_y >= 1 and in_y + 1 < th: n_pend_row = 1
+            elif in_y == th - 1:
+                n_pend_frm = 1
+        if ov == 1 and ol == 1 and nv == 0:
+            if tlast_each_row: n_pend_row = 0
+            else:              n_pend_frm = 0
+        want_tlast = pend_row if tlast_each_row else pend_frm
+        n_ov = 0 if ov == 1 else ov
+        n_ol = ol; n_od = od
+        if ov == 0 and nv == 1:
+            n_ov = 1; n_ol = 0; n_od = nw
+        elif ov == 0 and want_tlast == 1 and nv == 0:
+            n_ov = 1; n_ol = 1; n_od = 0
+        n_in_y = in_y; n_tw = tw; n_th = th
+        if acc:
+            if tuser:
+                n_in_y = 0; n_tw = min(W, max_w); n_th = min(H, max_h)
+                n_pend_row = 0; n_pend_frm = 0
+            elif tlast:
+                n_in_y = in_y + 1
+        # NMS：事件進來時推動 3x3 視窗
+        n_nv = 0; n_nw = nw
+        if keep:
+            n_nv = 1
+            n_nw = (oy << 48) | (ox << 32) | cp
+        elif last_center:
+            n_nv = 1
+            n_nw = (oy << 48) | (ox << 32)
+        if fm_v == 1:
+            n_cv = 1 if (x_d1 >= 1 and x_d1 + 1 < tw and y_d1 >= 1 and y_d1 + 1 < th) else 0
+            a0 = r0l & 0x3FF; a1 = r0c & 0x3FF; a2 = r0r & 0x3FF
+            b0 = r1l & 0x3FF; b1 = r1c & 0x3FF; b2 = r1r & 0x3FF
+            d0 = r2l & 0x3FF; d1 = r2c & 0x3FF; d2 = r2r & 0x3FF
+            n_any_eq = 1 if (a0 == b1 or a1 == b1 or a2 == b1 or b0 == b1 or b2 == b1
+                             or d0 == b1 or d1 == b1 or d2 == b1) else 0
+            n_nmax = max(rm0, rm1, rm2)
+            n_rm0 = max(a0, a1, a2); n_rm1 = max(b0, b2); n_rm2 = max(d0, d1, d2)
+            cx = x_d1; cy = y_d1; cp = r1c; cv = n_cv; nmax = n_nmax; any_eq = n_any_eq
+            rm0 = n_rm0; rm1 = n_rm1; rm2 = n_rm2
+            r0l = r0c; r0c = r0r; r0r = fm_p
+            r1l = r1c; r1c = r1r; r1r = lb1_rd
+            r2l = r2c; r2c = r2r; r2r = lb2_rd
+            # read-first：讀出的是寫入前的內容
+            if lb_sel == 1:
+                lb1_rd = lb[1, fm_x]; lb2_rd = lb[0, fm_x]; lb[0, fm_x] = fm_p
+            else:
+                lb1_rd = lb[0, fm_x]; lb2_rd = lb[1, fm_x]; lb[1, fm_x] = fm_p
+            if tuser:
+                last_y = fm_y; lb_sel = 1
+            elif fm_y != last_y:
+                last_y = fm_y; lb_sel = 1 - lb_sel
+            x_d1 = fm_x; y_d1 = fm_y
+        nv = n_nv; nw = n_nw
+        # FAST：window_ok 用的是這一拍的計數 (事件座標 col-3, row-3)
+        ok = 1 if (fw >= 7 and fh >= 7 and row >= 6 and col >= 6 and col < fw) else 0
+        n_fm_v = 0
+        if out_take:
+            if s2_ok == 1:
+                n_fm_v = 1; fm_x = s2_x; fm_y = s2_y; fm_p = s2_p
+            s2_v = 0
+        if sof_acc == 1: s2_v = 0
+        if s2_take:
+            s2_x = s1_x; s2_y = s1_y; s2_ok = s1_ok; s2_p = s1_p; s2_v = 1
+        n_s1_v = s1_v
+        if sof_acc == 1: n_s1_v = 0
+        if s1_take:
+            n_s1_v = 1; s1_x = s0_x; s1_y = s0_y; s1_ok = s0_ok; s1_p = s0_p
+        elif s2_take:
+            n_s1_v = 0
+        n_s0_v = s0_v
+        if sof_acc == 1: n_s0_v = 0
+        if acc:
+            s0_x = col - 3; s0_y = row - 3; s0_ok = ok
+            # SOF 那一拍的事件是上一幀的最後一個 (W-4, H-4)
+            s0_p = 0 if ok == 0 else (prev_p if tuser else pack[row - 3, col - 3])
+            n_s0_v = 1
+        elif s1_take:
+            n_s0_v = 0
+        s0_v = n_s0_v; s1_v = n_s1_v; fm_v = n_fm_v
+        sof_acc = 1 if (acc and tuser) else 0
+        if acc:
+            if tuser:
+                fw = max(7, min(W, max_w)); fh = max(7, min(H, max_h)); col = 0; row = 0
+            elif col != fw - 1:
+                col += 1
+            else:
+                col = 0
+                if row != fh - 1: row += 1
+            b += 1
+        in_y = n_in_y; tw = n_tw; th = n_th
+        pend_row = n_pend_row; pend_frm = n_pend_frm
+        ov = n_ov; ol = n_ol; od = n_od
+    prev_p = pack[H - 4, W - 4]
+    cs[:] = np.array((col, row, fw, fh, sof_acc, s0_v, s0_x, s0_y, s0_ok, s0_p, s1_v, s1_x, s1_y, s1_ok, s1_p,
+                     s2_v, s2_x, s2_y, s2_ok, s2_p, fm_v, fm_x, fm_y, fm_p,
+                     x_d1, y_d1, last_y, lb_sel, lb1_rd, lb2_rd, r0l, r0c, r0r, r1l, r1c, r1r, r2l, r2c, r2r,
+                     rm0, rm1, rm2, nmax, any_eq, cv, cx, cy, cp, nv, nw,
+                     in_y, tw, th, pend_row, pend_frm, ov, ol, od, prev_p))
+    return n
+
+@njit(cache=True)
+def _layout_stream(words, tl, n, H, W, out):
+    # S2MM：每條 line W 個 word，TLAST 提早結束目前的 line，超過 H 條 line 的丟掉
+    line = 0; col = 0
+    for j in range(n):
+        if line >= H: break
+        out[line, col] = words[j]
+        if tl[j] or col == W - 1: line += 1; col = 0
+        else: col += 1
+
+class FastNmsModel:
+    """top_fast_nms_to_dma 的軟體模型，參數名稱與 RTL 相同。
+
+    與硬體一樣有跨幀狀態 (FAST 的 BRAM line buffer；AS_BUILT 時還有 NMS / top 的
+    暫存器)，reset() 相當於 aresetn。AS_BUILT / IDLE_CYCLES 不是 RTL 參數，見檔頭。
+    """
+    def __init__(self, MAX_W=1024, MAX_H=768, TLAST_EACH_ROW=1,
+                 FAST_INI_TH=20, FAST_MIN_TH=7, FAST_MIN_CONTIG=12,
+                 NMS_MIN_SCORE=1, NMS_STRICT_GT=0, NMS_TIE_MODE=1,
+                 NMS_APPLY_NEG1=1, NMS_CLAMP_MAX=1, AS_BUILT=0, IDLE_CYCLES=4096):
+        self.MAX_W, self.MAX_H = MAX_W, MAX_H
+        self.TLAST_EACH_ROW = TLAST_EACH_ROW
+        self.FAST_INI_TH, self.FAST_MIN_TH = FAST_INI_TH, FAST_MIN_TH
+        self.FAST_MIN_CONTIG = FAST_MIN_CONTIG
+        self.NMS_MIN_SCORE, self.NMS_STRICT_GT = NMS_MIN_SCORE, NMS_STRICT_GT
+        self.NMS_TIE_MODE, self.NMS_APPLY_NEG1 = NMS_TIE_MODE, NMS_APPLY_NEG1
+        self.NMS_CLAMP_MAX = NMS_CLAMP_MAX
+        self.AS_BUILT, self.IDLE_CYCLES = AS_BUILT, IDLE_CYCLES
+        self.reset()
+
+    def reset(self):
+        self.banks = np.zeros((7, self.MAX_W), dtype=np.uint8)
+        self.bank_wr, self.wr_addr = 0, 0    # SOF 那一拍寫入的位置
+        self.pack = self.stream = None
+        self.cs = np.zeros(len(_CS), dtype=np.int64)
+        self.cs[_CS.index('lb_sel')] = 1     # nms.v 重置後先寫 LB1
+        self.lb = np.zeros((2, self.MAX_W), dtype=np.int64)
+
+    def _sof_write(self, pix0):
+        self.banks[self.bank_wr, self.wr_addr] = pix0
+
+    def _update_banks(self, flat, H, W):
+        # line l 存在 bank l%7，位址 a 是 pixel l*W + a + 1 (整幀晚一個 pixel)
+        for b in range(7):
+            l = b + 7 * ((H - 1 - b) // 7)
+            if l < H - 1:
+                self.banks[b, :W] = flat[l*W + 1 : l*W + W + 1]
+            else:
+                self.banks[b, :W-1] = flat[l*W + 1 : l*W + W]
+                if l >= 7:
+                    self.banks[b, W-1] = flat[(l - 7)*W + W]
+        self.bank_wr, self.wr_addr = (H - 1) % 7, W - 1
+
+    def run(self, img, out=None, bands=1, progress=None):
+        # bands > 1：FAST / NMS / layout 一次做一段 row，每段做完呼叫 progress(n)，
+        # 表示 out 的前 n 條 line 已經是最後的內容 (REQ_STREAM，見 backends.EmuBackend)。
+        # 結果與 bands=1 完全相同
+        H, W = img.shape
+        if not (2*RADIUS + 1 <= W <= self.MAX_W and 2*RADIUS + 1 <= H <= self.MAX_H):
+            raise ValueError(f"frame {W}x{H} outside 7x7 .. {self.MAX_W}x{self.MAX_H}")
+        if out is None:
+            out = np.empty((H, W), dtype=np.uint64)
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        flat = img.reshape(-1)
+
+        self._sof_write(flat[0])
+        bank6 = self.banks[6].copy()
+        pack = np.zeros((H, W), dtype=np.int64)
+        if self.AS_BUILT:
+            # 逐 cycle 模擬不分 band：整幀做完才回報
+            _fast9_dualth(img, bank6, self.FAST_INI_TH, self.FAST_MIN_TH,
+                          self.FAST_MIN_CONTIG, pack, RADIUS, H - RADIUS)
+            # 每拍最多一個 word，每個 pixel 最多 2 拍 (FAST 的 S0 隔拍才收)
+            cap = 2 * H * W + self.IDLE_CYCLES + 2
+            words = np.empty(cap, dtype=np.uint64)
+            tl = np.empty(cap, dtype=np.uint8)
+            n = _stream_asbuilt(pack, H, W, self.MAX_W, self.MAX_H, self.TLAST_EACH_ROW,
+                                self.NMS_MIN_SCORE, self.NMS_STRICT_GT, self.NMS_TIE_MODE,
+                                self.NMS_APPLY_NEG1, self.NMS_CLAMP_MAX, self.IDLE_CYCLES,
+                                self.cs, self.lb, words, tl)
+            self.stream = (words[:n], tl[:n])     # m_axis 上的 (data, tlast)，rtl_compare.py 用
+            out.fill(0)
+            _layout_stream(words, tl, n, H, W, out)
+            if progress is not None: progress(H)
+            self._update_banks(flat, H, W)
+            self.pack = pack
+            return out
+        # 觸發事件 (x+1, y+1) 需在 x = 3..W-4、y = 3..H-4 且不是本幀最後一個事件
+        cap = (W - 2*RADIUS) * (H - 2*RADIUS)
+        words = np.empty(cap, dtype=np.uint64)
+        pos = np.empty(cap, dtype=np.int64)
+        st = np.zeros(4, dtype=np.int64)
+        st[3] = 1
+        out.fill(0)
+        n = 0
+        fy = ny = RADIUS                # FAST 算到 fy (不含)、NMS 中心做到 ny (不含)
+        y_end = H - RADIUS - 1          # NMS 中心的範圍 [RADIUS, y_end)
+        n_bands = max(1, min(bands, H))
+        for k in range(1, n_bands + 1):
+            L = H * k // n_bands
+            fy1 = min(max(L, RADIUS), H - RADIUS)
+            if fy1 > fy:
+                _fast9_dualth(img, bank6, self.FAST_INI_TH, self.FAST_MIN_TH,
+                              self.FAST_MIN_CONTIG, pack, fy, fy1)
+                fy = fy1
+            # 中心 y 要等 pack 的 y+1 列 (最後一列事件範圍外是 0)
+            ny1 = y_end if fy >= H - RADIUS else min(fy - 1, y_end)
+            if ny1 > ny:
+                n += _nms3x3(pack, RADIUS, W - RADIUS - 1, ny, ny1,
+                             self.NMS_MIN_SCORE, self.NMS_STRICT_GT, self.NMS_TIE_MODE,
+                             self.NMS_APPLY_NEG1, self.NMS_CLAMP_MAX, W, H, words[n:], pos[n:])
+                ny = ny1
+            # 中心 ny 之前的 word 都有了：它們的輸入位置都 < (ny + 4) * W
+            final = k == n_bands
+            lines = _layout(words, pos, n, W, H, self.TLAST_EACH_ROW, out, st, (ny + RADIUS + 1) * W, final)
+            if progress is not None: progress(lines)
+        self._update_banks(flat, H, W)
+        self.pack = pack
+        return out
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# incremental.py  -  影片輸入：跟上一張比，只重算有變動的 tile
+#
+# client 送的是連續的影片 (EuRoC 逐張重播)，相鄰兩張大部分區域常常不動。
+# 連線打開 incremental (v2 flags 帶 REQ_INCREMENTAL，或 server --incremental)
+# 之後，server 為這個連線保留上一張 frame 與它每個 tile 的角點：
+#   1. frame 依 tiling.tile_grid 切成 tile (邊長 --incr-tile)，每個 tile 的
+#      輸入視窗已經包含 FAST 半徑與 NMS 的邊界，它「擁有」的角點只由視窗內的
+#      pixel 決定
+#   2. |本張 - 上一張| > threshold 的 pixel 用 reduceat 算到各視窗，視窗內
+#      沒有變動的 tile 直接沿用上一次的角點
+#   3. 有變動的 tile 在 backend 上重算 (兩個 tile 尺寸的 slot 輪流用，跟
+#      SlotPool 借、跑完還回去，算在它的 budget 裡)；
+#      變動的 tile 太多時整張照常跑一次，再把結果分回各 tile 的 cache
+# threshold = 0 時，cpu backend 的結果與每張都完整重算相同；fpga / emu 除了
+# 整張最上面 y = 3, 4 兩列以外相同 —— 那兩列讀的是 BRAM 裡上一次 DMA 留下的
+# row (見 tiling.py)，完整重算時是上一張 frame 的，incremental 時是上一個
+# tile 的，兩邊本來就取決於板子的歷史，不保證一致。> 0 時容許輕微雜訊
+# (代價是沿用的角點可能稍微過時)。每張 frame 沿用的 tile 比例放在 slot['reuse']，
+# 累計的比例在 snapshot() (REQ_STATS 的 JSON 裡的 "incremental")。
+# ============================================================================
+import threading, time
+import numpy as np
+from corners import CornerExtractor
+from tiling import tile_grid
+from backends import recv_plane
+from bufpool import SlotPool
+
+class IncrState:
+    """一個連線的 incremental 狀態；只在 scheduler worker 上更新 (同一連線的
+    job 是 FIFO，所以依序)。"""
+    def __init__(self):
+        self.shape = None
+        self.prev = None            # 上一張 frame (H, W) uint8
+        self.tiles = None           # tile_grid 的 tile 清單
+        self.recs = None            # 每個 tile 擁有的角點 (n, 4) '<u2'
+        self.threshold = None       # 算 recs 時的 slot['threshold'] (adaptive)
+
+    def reset(self, shape, th, tw, tiles):
+        H, W = self.shape = shape
+        self.tile_shape, self.tiles = (th, tw), tiles
+        self.prev = np.empty(shape, dtype=np.uint8)
+        self.recs = None
+        # 所有視窗的邊界把 frame 切成格子；每個 tile 視窗 = 格子 [y0, y1) x [x0, x1)
+        self.cut_y = sorted({b for oy, *_ in tiles for b in (oy, oy + th)} - {H})
+        self.cut_x = sorted({b for _, ox, *_ in tiles for b in (ox, ox + tw)} - {W})
+        yi = {b: i for i, b in enumerate(self.cut_y + [H])}
+        xi = {b: i for i, b in enumerate(self.cut_x + [W])}
+        self.cell_idx = tuple(np.array(v) for v in zip(*[(yi[oy], yi[oy + th], xi[ox], xi[ox + tw])
+                                                          for oy, ox, *_ in tiles]))
+
+class IncrementalBackend:
+    def __init__(self, inner, tile=128, threshold=0, full_ratio=0.5):
+        self.inner = inner
+        self.tile = tile
+        self.threshold = threshold
+        self.full_ratio = full_ratio        # 變動 tile 超過這個比例就整張重跑
+        self.name, self.tag = inner.name, inner.tag
+        self.extract = CornerExtractor()    # 只在 worker thread 上用
+        self.pool = SlotPool(self)          # tile 的 slot 從這裡借；server 的 pool 建好後換成那個
+        self.lock = threading.Lock()
+        self.stats = {}                     # "WxH" -> [frames, tiles, reused]
+
+    def __getattr__(self, k):
+        if k == "inner": raise AttributeError(k)
+        return getattr(self.inner, k)
+
+    def use_pool(self, pool):
+        # SlotPool 建立時呼叫 (bufpool.py)；TiledBackend 也用同一個
+        self.pool = pool
+        use_pool = getattr(self.inner, "use_pool", None)
+        if use_pool is not None: use_pool(pool)
+
+    def alloc_slot(self, H, W):
+        return self.inner.alloc_slot(H, W)
+
+    def free_slot(self, slot):
+        self.inner.free_slot(slot)
+
+    def slot_bytes(self, H, W):
+        return self.inner.slot_bytes(H, W)
+
+    def receive(self, conn, slot, recv):
+        # incremental 的 frame 多半只跑幾個 tile，收的時候不展開 (slot['incr'] 要先設好)
+        if slot.get('incr') is None:
+            return self.inner.receive(conn, slot, recv)
+        recv_plane(conn, slot, recv)
+
+    def prepare(self, slot):
+        # incremental 的 frame 不一定整張送進 backend，copy-in 延到 run 決定之後
+        if slot.get('incr') is None:
+            self.inner.prepare(slot)
+
+    def collect(self, slot, extract):
+        if slot.get('incr') is None:
+            return self.inner.collect(slot, extract)
+        rec = slot['incr_rec']
+        n = len(rec)
+        extract.last_total = n
+        cap = len(extract.out) if extract.fixed else n      # --max-corners
+        return rec[:min(n, cap)], n > cap
+
+    def run(self, slot):
+        st = slot.get('incr')
+        if st is None:
+            return self.inner.run(slot)
+        H, W = slot['shape']
+        plane = slot['plane']
+        t = slot['t']
+        if st.shape != (H, W):
+            st.reset((H, W), *tile_grid(H, W, min(self.tile, H), min(self.tile, W)))
+        t0 = time.perf_counter_ns()
+        if st.threshold != slot.get('threshold'):
+            st.recs, st.threshold = None, slot.get('threshold')    # threshold 換了，cache 全部作廢
+        dirty = self._dirty_tiles(st, plane) if st.recs is not None else np.ones(len(st.tiles), bool)
+        t['diff'] = time.perf_counter_ns() - t0
+        nd = int(np.count_nonzero(dirty))
+        if st.recs is None or nd > self.full_ratio * len(st.tiles):
+            self.inner.prepare(slot)
+            self.inner.run(slot)
+            t0 = time.perf_counter_ns()
+            pts, _ = self.inner.collect(slot, self.extract)
+            st.recs = [pts[(pts[:, 0] >= xlo) & (pts[:, 0] < xhi) & (pts[:, 1] >= ylo) & (pts[:, 1] < yhi)]
+                       for oy, ox, ylo, yhi, xlo, xhi in st.tiles]
+            parse_ns = time.perf_counter_ns() - t0
+        else:
+            parse_ns = self._run_tiles(st, plane, np.flatnonzero(dirty), t)
+        t0 = time.perf_counter_ns()
+        np.copyto(st.prev, plane)
+        # 各 tile 的角點接起來，排回整張的 raster 順序
+        rec = np.concatenate(st.recs)
+        rec = rec[np.argsort((rec[:, 1].astype(np.uint32) << 16) | rec[:, 0], kind="stable")]
+        slot['incr_rec'] = rec
+        t['tile_parse'] = parse_ns + time.perf_counter_ns() - t0
+        slot['reuse'] = 1.0 - nd / len(st.tiles)
+        with self.lock:
+            s = self.stats.setdefault(f"{W}x{H}", [0, 0, 0])
+            s[0] += 1; s[1] += len(st.tiles); s[2] += len(st.tiles) - nd
+
+    def _dirty_tiles(self, st, plane):
+        # 變動 mask 先縮到所有視窗邊界切出來的格子上 (reduceat)，再用 2D prefix
+        # sum 一次算出每個 tile 視窗內有幾個變動的格子
+        if self.threshold:
+            changed = (np.maximum(plane, st.prev) - np.minimum(plane, st.prev)) > self.threshold
+        else:
+            changed = plane != st.prev
+        cells = np.logical_or.reduceat(np.logical_or.reduceat(changed, st.cut_y, axis=0), st.cut_x, axis=1)
+        cum = np.zeros((cells.shape[0] + 1, cells.shape[1] + 1), dtype=np.int32)
+        cum[1:, 1:] = cells.cumsum(0).cumsum(1)
+        y0, y1, x0, x1 = st.cell_idx
+        return (cum[y1, x1] - cum[y0, x1] - cum[y1, x0] + cum[y0, x0]) > 0
+
+    def _run_tiles(self, st, plane, idx, t):
+        th, tw = st.tile_shape
+        subs = [self.pool.acquire(th, tw)]
+        try:
+            if len(idx) > 1: subs.append(self.pool.acquire(th, tw))
+            parse_ns = 0
+            for k, i in enumerate(idx):
+                oy, ox, ylo, yhi, xlo, xhi = st.tiles[i]
+                sub = subs[k & 1]
+                sub['t'] = {}
+                sub['threshold'] = st.threshold
+                sub['stream'] = None            # 可能是連線還回來的 slot
+                np.copyto(sub['plane'], plane[oy:oy + th, ox:ox + tw])
+                self.inner.prepare(sub)
+                self.inner.run(sub)
+                for s, ns in sub['t'].items():
+                    t[s] = t.get(s, 0) + ns
+                t0 = time.perf_counter_ns()
+                pts, _ = self.inner.collect(sub, self.extract)
+                gx = pts[:, 0] + ox; gy = pts[:, 1] + oy
+                rec = pts[(gx >= xlo) & (gx < xhi) & (gy >= ylo) & (gy < yhi)]
+                rec[:, 0] += ox; rec[:, 1] += oy
+                st.recs[i] = rec
+                parse_ns += time.perf_counter_ns() - t0
+        finally:
+            for sub in subs: self.pool.release(sub)
+        return parse_ns
+
+    def snapshot(self):
+        # {"WxH": {frames, tiles, reuse}}：reuse = 沿用 tile 的比例
+        with self.lock:
+            return {res: dict(frames=f, tiles_per_frame=round(n / max(f, 1), 1),
+                              reuse=round(r / max(n, 1), 4))
+                    for res, (f, n, r) in self.stats.items()}
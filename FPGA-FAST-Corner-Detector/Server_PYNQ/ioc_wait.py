@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# ioc_wait.py  -  等 VDMA 做完一張 frame (IOC) 的策略
+#
+#   spin  : 一直讀 DMASR (原本的 wait_ioc)，延遲最低，但整段 DMA 時間吃滿一顆核心
+#   sleep : 每個解析度估計 DMA 時間，先 sleep 到預估完成前 margin，再 spin
+#   uio   : S2MM_DMACR 開 IOC_IrqEn，block 在 /dev/uioN 的 read 上 (需要
+#           device tree 把 VDMA 的 s2mm_introut 接成 generic-uio)
+#
+# 每種策略都統計等待的 wall time 與這條 thread 實際用掉的 CPU time
+# (time.thread_time_ns)，最後一張的 CPU time 放在 last_cpu_ns。
+# 只依賴 mmio.read / mmio.write，可以用下面的 DelayMMIO 在沒有板子時測：
+#   python3 ioc_wait.py --delay-ms 10
+# ============================================================================
+import os, select, struct, time, threading
+from collections import deque
+import vdma
+
+class IocWait:
+    name = "?"
+    irq = False         # True 時 vdma_init 要開 S2MM IOC interrupt
+
+    def __init__(self, window=16):
+        # key (H, W) -> 最近 window 張的 DMA 時間；估計值取最小值，
+        # 偶發的慢 frame (第一張、VDMA 卡住) 不會把估計拉高
+        self.window = window
+        self.dma_ns = {}
+        self.n = 0
+        self.wall_ns = 0
+        self.cpu_ns = 0
+        self.last_cpu_ns = 0
+
+    def arm(self):
+        pass
+
+    def wait(self, mmio, key, t_start_ns, timeout_s=2.0):
+        # t_start_ns: vdma_start 前取的 perf_counter_ns
+        c0 = time.thread_time_ns(); w0 = time.perf_counter_ns()
+        st = self._wait(mmio, key, t_start_ns, t_start_ns + int(timeout_s * 1e9))
+        w1 = time.perf_counter_ns(); c1 = time.thread_time_ns()
+        hist = self.dma_ns.get(key)
+        if hist is None: hist = self.dma_ns[key] = deque(maxlen=self.window)
+        hist.append(self._observed(w1 - t_start_ns))
+        self.n += 1
+        self.wall_ns += w1 - w0
+        self.cpu_ns += c1 - c0
+        self.last_cpu_ns = c1 - c0
+        return st
+
+    def _observed(self, dma_ns):
+        return dma_ns
+
+    def estimate_ns(self, key):
+        hist = self.dma_ns.get(key)
+        return min(hist) if hist else None
+
+    def _spin(self, mmio, deadline_ns):
+        while True:
+            st = vdma.poll_ioc(mmio)
+            if st is not None:
+                return st
+            if time.perf_counter_ns() > deadline_ns:
+                raise TimeoutError("VDMA timeout")
+
+    def summary(self):
+        pct = 100.0 * self.cpu_ns / self.wall_ns if self.wall_ns else 0.0
+        return (f"{self.name}: {self.n} frames, wait {self.wall_ns / max(self.n, 1) / 1e6:.3f} ms/frame, "
+                f"CPU {self.cpu_ns / max(self.n, 1) / 1e6:.3f} ms/frame ({pct:.1f}% of wait)")
+
+class SpinWait(IocWait):
+    name = "spin"
+
+    def _wait(self, mmio, key, t_start_ns, deadline_ns):
+        return self._spin(mmio, deadline_ns)
+
+class SleepSpinWait(IocWait):
+    name = "sleep"
+
+    def __init__(self, margin=0.2, min_sleep_s=200e-6, window=16):
+        super().__init__(window)
+        self.margin = margin                    # 預估值的這個比例留給 spin
+        self.min_sleep_ns = int(min_sleep_s * 1e9)   # 太短的 sleep 排程誤差比省下的還多
+        self.overslept = False
+
+    def _wait(self, mmio, key, t_start_ns, deadline_ns):
+        self.overslept = False
+        est = self.estimate_ns(key)
+        if est is not None:
+            nap = t_start_ns + int(est * (1.0 - self.margin)) - time.perf_counter_ns()
+            if nap > self.min_sleep_ns:
+                time.sleep(nap / 1e9)
+                st = vdma.poll_ioc(mmio)
+                if st is not None:
+                    self.overslept = True
+                    return st
+        return self._spin(mmio, deadline_ns)
+
+    def _observed(self, dma_ns):
+        # 醒來第一次讀就已經 IOC：真正的 DMA 時間只知道比醒來早，記一半，
+        # 估計值幾張之內就會降到實際值附近 (不會被第一張的慢 frame 拖住)
+        return dma_ns // 2 if self.overslept else dma_ns
+
+class UioWait(IocWait):
+    name = "uio"
+    irq = True
+
+    def __init__(self, dev, window=16):
+        super().__init__(window)
+        # dev: /dev/uioN 的路徑，或已經開好的 fd (測試用 socketpair)
+        self.fd = dev if isinstance(dev, int) else os.open(dev, os.O_RDWR)
+
+    def arm(self):
+        # UIO：寫 1 重新打開 interrupt (generic-uio 每次觸發後會自動關掉)
+        os.write(self.fd, struct.pack("<I", 1))
+
+    def _wait(self, mmio, key, t_start_ns, deadline_ns):
+        while True:
+            st = vdma.poll_ioc(mmio)
+            if st is not None:
+                return st
+            left = (deadline_ns - time.perf_counter_ns()) / 1e9
+            if left <= 0:
+                raise TimeoutError("VDMA timeout (uio)")
+            r, _, _ = select.select([self.fd], [], [], left)
+            if r:
+                os.read(self.fd, 4)     # interrupt 次數，讀掉就好
+                self.arm()
+
+def make_waiter(kind, uio_dev=None, margin=0.2):
+    if kind == "spin": return SpinWait()
+    if kind == "sleep": return SleepSpinWait(margin=margin)
+    if kind == "uio":
+        if not uio_dev: raise ValueError("--wait uio needs --uio-dev /dev/uioN")
+        return UioWait(uio_dev)
+    raise ValueError(f"unknown wait strategy: {kind}")
+
+# ================= 沒有板子時的測試 =================
+class DelayMMIO:
+    """假的 VDMA register：寫 MM2S_VSIZE 視為開始，delay_s 後兩個 DMASR 的
+    IOC bit 同時立起來 (W1C 清除)。irq_sock 給定時會在完成時送 4 bytes，
+    模擬 UIO 的 read。"""
+    def __init__(self, delay_s, irq_sock=None):
+        self.delay_s = delay_s
+        self.irq_sock = irq_sock
+        self.regs = {}
+        self.t_done = None
+        self.lock = threading.Lock()
+
+    def read(self, off):
+        with self.lock:
+            v = self.regs.get(off, 0)
+            if off in (vdma.MM2S_DMASR, vdma.S2MM_DMASR) and self.t_done is not None \
+                    and time.perf_counter() >= self.t_done and not self.regs.get(("clr", off)):
+                v |= vdma.DMASR_IOC
+            return v
+
+    def write(self, off, v):
+        with self.lock:
+            if off in (vdma.MM2S_DMASR, vdma.S2MM_DMASR):
+                if v & vdma.DMASR_IOC: self.regs[("clr", off)] = True
+                return
+            self.regs[off] = v
+            if off == vdma.MM2S_VSIZE:
+                self.t_done = time.perf_counter() + self.delay_s
+                self.regs[("clr", vdma.MM2S_DMASR)] = self.regs[("clr", vdma.S2MM_DMASR)] = False
+                if self.irq_sock is not None:
+                    threading.Timer(self.delay_s, self.irq_sock.send, args=(struct.pack("<I", 1),)).start()
+
+if __name__ == "__main__":
+    import argparse, socket
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--delay-ms", type=float, default=10.0)
+    ap.add_argument("--frames", type=int, default=50)
+    args = ap.parse_args()
+
+    for kind in ("spin", "sleep", "uio"):
+        a = b = None
+        if kind == "uio":
+            a, b = socket.socketpair()
+            w = UioWait(a.fileno())
+            mmio = DelayMMIO(args.delay_ms / 1e3, irq_sock=b)
+        else:
+            w = make_waiter(kind)
+            mmio = DelayMMIO(args.delay_ms / 1e3)
+        vdma.vdma_init(mmio, 640, irq=w.irq)
+        lat = []
+        for _ in range(args.frames):
+            w.arm()
+            t0 = time.perf_counter_ns()
+            vdma.vdma_start(mmio, 0, 0, 480)
+            w.wait(mmio, (480, 640), t0)
+            lat.append((time.perf_counter_ns() - t0) / 1e6 - args.delay_ms)
+            if b is not None:
+                b.setblocking(False)
+                try: b.recv(64)     # 丟掉 arm() 寫過來的 enable
+                except BlockingIOError: pass
+        lat.sort()
+        print(f"[{kind:<5}] {w.summary()}; overshoot p50 {lat[len(lat)//2]:.3f} ms, max {lat[-1]:.3f} ms")
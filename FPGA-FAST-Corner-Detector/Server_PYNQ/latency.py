@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# latency.py  -  各 stage 的延遲直方圖 (固定 bucket，p50/p95/p99/max)
+#
+# 每張 frame 的各段時間 (ns) 先記在 slot['t'] 這個 dict 裡，frame 送完後
+# 一次 add_frame() 進來，依 (backend, WxH) 分開統計；多相機 batch 整組算一筆
+# (各 frame 的 stage 加總)，另記在 "WxHxMcam"。bucket 是固定的
+# log 刻度，記一筆只是一次 bisect + 幾個加法，不必保留每一筆樣本。
+# ============================================================================
+import bisect, json, threading
+
+# stage 名稱與在一張 frame 裡的先後順序
+STAGES = ("hdr_rx",       # 等 header (含 client 還沒送下一張的閒置時間)
+          "payload_rx",   # 收 H*W bytes
+          "copy_in",      # plane -> CMA in_buf byte0 (FPGA；收 payload 時逐段展開，與 payload_rx 重疊)
+          "flush",        # in_buf cache flush (FPGA)
+          "queue",        # 在 scheduler 裡等板子
+          "hw",           # FPGA: vdma_start -> IOC；cpu / emu: 整個運算
+          "wait_cpu",     # FPGA: 等 IOC 期間這條 thread 實際用掉的 CPU time
+          "invalidate",   # out_buf cache invalidate (FPGA)
+          "diff",         # incremental：與上一張比出有變動的 tile
+          "tile_parse",   # 超過 MAX 或 incremental 的 frame：各 tile 抽角點 + 合併 (在 worker 上)
+          "parse",        # out_buf -> (x, y, strong, score)
+          "select",       # REQ_SELECT / --top-k 等的挑選 (有要求時)
+          "first",        # REQ_STREAM：payload 收完 -> 第一個 chunk 送出
+          "last",         # REQ_STREAM：payload 收完 -> END chunk 送出 (與 first 同一批 frame)
+          "pack",         # 填回應 header (body 已是 parse 寫好的 <u2 records)
+          "send",         # header + body 一次 sendmsg
+          "total",        # payload 收完 -> 回應送完
+          # --energy (serial 模式)：這一張在各段用掉的 CPU time (thread time)，不是經過的時間
+          "cpu_rx",       # 收 header + payload
+          "cpu_run",      # prepare + worker 上的 backend.run (含等 IOC 的 spin、cpu backend 的 thread pool)
+          "cpu_post")     # parse / 挑選 / 回應
+
+# bucket 上界 (ns)：從 1 us 開始每 1/8 octave 一格 (相鄰約差 9%)，到約 67 s
+_EDGES = [int(1000 * 2 ** (k / 8)) for k in range(8 * 26 + 1)]
+
+class Histogram:
+    __slots__ = ("counts", "n", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(_EDGES) + 1)
+        self.n = 0; self.total = 0; self.max = 0
+
+    def add(self, ns):
+        self.counts[bisect.bisect_left(_EDGES, ns)] += 1
+        self.n += 1; self.total += ns
+        if ns > self.max: self.max = ns
+
+    def percentile(self, q):
+        # 回傳落點 bucket 的上界 (不超過實際最大值)
+        if not self.n: return 0
+        rank = q * self.n; c = 0
+        for i, k in enumerate(self.counts):
+            c += k
+            if c >= rank:
+                return min(_EDGES[i], self.max) if i < len(_EDGES) else self.max
+        return self.max
+
+    def summary(self):
+        ms = 1e-6
+        return dict(n=self.n, mean=round(self.total / max(self.n, 1) * ms, 4),
+                    p50=round(self.percentile(0.50) * ms, 4), p95=round(self.percentile(0.95) * ms, 4),
+                    p99=round(self.percentile(0.99) * ms, 4), max=round(self.max * ms, 4))
+
+class LatencyStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hists = {}     # (backend, "WxH") -> {stage: Histogram}
+
+    def add_frame(self, backend, H, W, t, cams=1):
+        key = (backend, f"{W}x{H}" if cams == 1 else f"{W}x{H}x{cams}cam")
+        with self.lock:
+            hs = self.hists.get(key)
+            if hs is None: hs = self.hists[key] = {}
+            for stage, ns in t.items():
+                h = hs.get(stage)
+                if h is None: h = hs[stage] = Histogram()
+                h.add(ns)
+
+    def snapshot(self):
+        # {backend: {"WxH": {stage: {n, mean, p50, p95, p99, max}}}}，時間單位 ms
+        out = {}
+        with self.lock:
+            for (backend, res), hs in self.hists.items():
+                order = [s for s in STAGES if s in hs] + sorted(s for s in hs if s not in STAGES)
+                out.setdefault(backend, {})[res] = {s: hs[s].summary() for s in order}
+        return out
+
+    def dump_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def format_table(self):
+        lines = []
+        for backend, per_res in self.snapshot().items():
+            for res, stages in per_res.items():
+                lines.append(f"  [{backend} {res}]  {'stage':<11} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+                for s, d in stages.items():
+                    lines.append(f"  {'':<{len(backend) + len(res) + 3}}  {s:<11} {d['n']:>6} {d['p50']:>9.3f} "
+                                 f"{d['p95']:>9.3f} {d['p99']:>9.3f} {d['max']:>9.3f}")
+        return "\n".join(lines)
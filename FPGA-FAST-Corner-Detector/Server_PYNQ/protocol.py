@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# protocol.py  -  PC <-> PYNQ 的 TCP 協定
+#   Server_PYNQ/protocol.py 與 Client_PC/protocol.py 是同一份，改的時候兩邊一起改
+#
+# v1 (舊 client，仍然支援)：
+#   request : <HH   H, W                              + H*W bytes gray
+#   response: <I    N                                 + N * <HHHH (x, y, strong, score)
+#   一問一答，client 收到回應才送下一張。
+#
+# v2：header 第一個 u16 放 MAGIC (不可能是合法的高度)，server 讀前 4 bytes
+# 就能分辨是 v1 還是 v2。
+#   request : <HBBIHH  MAGIC, VERSION, flags, frame_id, H, W   + H*W bytes gray
+#   response: <HBBII   MAGIC, VERSION, flags, frame_id, N      + N * <HHHH
+#   server 依收到的順序回覆並原樣 echo frame_id，client 可以同時有 K 張在路上
+#   (不必每張都等一個 RTT)。
+#   flags 帶 REQ_SELECT 時 header 後面 (payload 前) 多一段
+#     <IHBB  top_k, per_cell, cols, rows
+#   server 送出前只留分數最高的 top_k 個 (0 = 不限)，cols x rows 的格子每格
+#   最多 per_cell 個 (0 = 不分格)；REQ_STRONG_ONLY 只留 is_strong 的角點。
+#   回傳的角點仍是 raster 順序。
+#   flags 帶 REQ_STREAM 時回應拆成多個 chunk，上面幾列的角點不必等整張做完：
+#     <HBBII (flags 含 RESP_CHUNK) + <HH y0, y1 + N * <HHHH
+#   每個 chunk 是 y0 <= y < y1 的全部角點 (依序接起來就是整張的結果)，最後一個
+#   chunk 另帶 RESP_END (y1 = H，可能 N = 0)。top-K / grid 挑選或 incremental
+#   時整張做完才送，只有一個 END chunk (見 Server_PYNQ/rowstream.py)。
+#   flags 帶 REQ_BATCH 時一個 request 帶 M 張同尺寸的 frame (例如 stereo 的
+#   cam0 / cam1)，server 在板子上連續跑完才回一次：
+#     request : <HBBIHH (H, W 是每一張的尺寸) [+ SEL_V2] + <HH M, 0
+#               + M * (<HH cam_id, 0 + H*W bytes gray)
+#     response: <HBBII (flags 含 RESP_BATCH，N = M) + M * (<HHI cam_id, flags, N + N * <HHHH)
+#   每段依 request 的順序；段的 flags 只有 RESP_TRUNCATED。incremental 依 cam_id
+#   各自跟同一台相機的上一張比；batch 不串流 (REQ_STREAM 忽略)。
+#
+# 控制訊息 (v2 only)：flags 帶 REQ_STATS、H = W = 0、沒有 payload。
+#   server 依序回 <HBBII (flags = RESP_CTRL, N = JSON 的 byte 數) + JSON，
+#   內容是各 stage 延遲直方圖的摘要 (見 Server_PYNQ/latency.py)；
+#   incremental 有用到時另有 "incremental" 一項 (各解析度沿用 tile 的比例)，
+#   --target-corners 時另有 "adaptive" (各連線的 threshold 控制器狀態)。
+#   "startup" 是 server 的 time-to-ready 與各階段秒數 (見 Server_PYNQ/startup.py)。
+#   server --energy 時另有 "energy"：累計的 J、W、frames/J、CPU-s/frame (見 Server_PYNQ/energy.py)。
+# ============================================================================
+import struct
+
+MAGIC   = 0xFA57
+VERSION = 2
+
+HDR_V1  = struct.Struct("<HH")        # 舊版 request header，也是 v2 header 的前 4 bytes
+CNT_V1  = struct.Struct("<I")         # 舊版 response header
+REQ_V2  = struct.Struct("<HBBIHH")
+SEL_V2  = struct.Struct("<IHBB")        # REQ_SELECT 的參數，接在 REQ_V2 後面
+RESP_V2 = struct.Struct("<HBBII")
+CHUNK_V2 = struct.Struct("<HH")         # RESP_CHUNK 的 row 範圍 [y0, y1)，接在 RESP_V2 後面
+BATCH_V2 = struct.Struct("<HH")         # REQ_BATCH：frame 數 M (接在 REQ_V2 / SEL_V2 後面)
+CAM_V2  = struct.Struct("<HH")        # REQ_BATCH：每張 payload 前面的 cam_id
+SECT_V2 = struct.Struct("<HHI")       # RESP_BATCH：每台相機一段 cam_id, flags, N
+MAX_BATCH = 8                         # 一個 batch 最多幾張
+POINT_BYTES = 8                       # 每個角點 <HHHH
+
+# ===== request flags =====
+REQ_INCREMENTAL = 0x01                # 這張與上一張比，只重算有變動的 tile (見 Server_PYNQ/incremental.py)
+REQ_SELECT     = 0x02                 # header 後面接 SEL_V2：top-K / grid 每格上限
+REQ_STRONG_ONLY = 0x04                # 只回傳 is_strong 的角點
+REQ_STREAM     = 0x08                 # 回應依 row 範圍分段送出 (CHUNK_V2)
+REQ_BATCH      = 0x10                 # 多相機：一個 request 帶 M 張 (BATCH_V2)
+REQ_STATS      = 0x80                 # 查詢延遲統計 (控制訊息)
+
+# ===== response flags =====
+RESP_TRUNCATED = 0x01                 # 角點數超過 server 的 --max-corners，已截斷
+RESP_CHUNK     = 0x02                 # REQ_STREAM 的一段，header 後面接 CHUNK_V2
+RESP_END       = 0x04                 # 這張 frame 的最後一段
+RESP_BATCH     = 0x08                 # REQ_BATCH 的回應，N 是段數 (SECT_V2)
+RESP_CTRL      = 0x80                 # 控制訊息的回應，N 是後面 JSON 的 byte 數
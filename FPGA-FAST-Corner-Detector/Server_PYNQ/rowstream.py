@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# rowstream.py  -  REQ_STREAM：frame 還沒做完，上面幾列的角點先送出去
+#
+# nms3x3_event_pix_dense 用 TLAST_EACH_ROW=1，S2MM 本來就是一條 line 一條 line
+# 寫進 out_buf，角點也依 raster 順序出來。串流模式下：
+#   backend (worker thread) 邊跑邊回報進度到 slot['stream'] (RowStream)：
+#     lines(n)        out_buf 的前 n 條 line 已寫完 (fpga / emu)
+#                     fpga：每個 band 第一條 line 的第一個 word 先寫 SENTINEL，
+#                     被 S2MM 蓋掉就表示前一條 line 已寫完 (見 backends.FpgaBackend)
+#                     emu ：模型一個 band 一個 band 算 (fast_emu 的 bands / progress)，
+#                     --emu-line-us 時不早於模擬的 DMA 寫到那條 line
+#     rows(pts, y)    y 以上的 row 已完成，pts 是新完成的角點 (cpu：band 依序做完)
+#   connection 端 (serial handler / pipeline 的 send thread) 收到進度就 parse
+#   新的 line，用 ChunkCutter 切成 row 範圍 [y0, y1) 已經完整的 chunk 送出，
+#   最後送一個 RESP_END 的 chunk (剩下的角點，範圍到 H)。
+# 只依賴「角點依 raster 順序輸出」：parse 到的最後一個角點那一列可能還沒出完，
+# 所以留到下一個 chunk。top-K / grid 挑選與 incremental 需要整張 frame，這時
+# 不串流，整張做完後只送一個 END chunk (格式相同)。
+# ============================================================================
+import queue
+import numpy as np
+
+SENTINEL = np.uint64(0xFFFFFFFFFFFFFFFF)   # 不會是角點 word (y = 0xFFFF)，也不是 TLAST 的 0
+
+def band_edges(H, bands):
+    # 每個 band 的結束 line (最後一個一定是 H)
+    n = max(1, min(bands, H))
+    return [H * k // n for k in range(1, n + 1)]
+
+class RowStream:
+    def __init__(self, bands=8):
+        self.bands = bands
+        self.q = queue.SimpleQueue()
+
+    # ---------- backend (worker thread) ----------
+    def lines(self, n):
+        self.q.put(('lines', n))
+
+    def rows(self, pts, y_done):
+        self.q.put(('rows', pts, y_done))
+
+    def finish(self, err=None):
+        # scheduler 在 backend.run 結束 (或丟出錯誤) 後呼叫
+        self.q.put(('end', err))
+
+    # ---------- connection 端 ----------
+    def __iter__(self):
+        while True:
+            ev = self.q.get()
+            if ev[0] == 'end':
+                if ev[1] is not None: raise ev[1]
+                return
+            yield ev
+
+class ChunkCutter:
+    """raster 順序的角點 -> row 範圍完整的 chunk。"""
+    def __init__(self, H):
+        self.H = H
+        self.y0 = 0
+        self.carry = None
+
+    def cut(self, pts, y_done=None):
+        # pts：新 parse 出來的角點 (可以是 extractor buffer 的 view)；y_done：這一列以上
+        # 都已完成，None 時用最後一個角點的 y (那一列可能還沒出完)。-> (y0, y1, chunk) 或 None
+        if self.carry is not None and len(self.carry):
+            pts = np.concatenate((self.carry, pts))
+        if y_done is None:
+            if not len(pts):
+                self.carry = None
+                return None
+            y_done = int(pts[-1, 1])
+        k = int(np.searchsorted(pts[:, 1], y_done))
+        self.carry = pts[k:].copy()
+        if y_done <= self.y0 or k == 0:
+            return None
+        y0, self.y0 = self.y0, y_done
+        return y0, y_done, pts[:k]
+
+    def rest(self):
+        # 最後一個 chunk：還沒送的角點，範圍到 H
+        pts = self.carry if self.carry is not None else np.empty((0, 4), dtype="<u2")
+        self.carry = None
+        return self.y0, self.H, pts
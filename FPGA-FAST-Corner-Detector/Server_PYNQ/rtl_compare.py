@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# rtl_compare.py  -  fast_emu (AS_BUILT=1) 與 RTL 逐 word 比對
+#
+# 用 Verilator 編譯 Hardware_Source/tb_top_stream.sv + top_fast_nms_to_dma，
+# 把同一組 frame 連續送進去 (MM2S 每拍 valid、S2MM 一直 ready、幀後 --gap 個
+# idle cycle)，再用同樣的參數跑 FastNmsModel(AS_BUILT=1, IDLE_CYCLES=gap)：
+#   FAST  tb 記下的每個 FAST 事件 (x, y, strong, score) 對模型的 pack；
+#         SOF 之後、(3, 3) 之前的事件屬於上一幀
+#   axis  m_axis 上的每個 beat (data, tlast) 對模型的輸出串流，整段依序比對
+#         (幀與幀的分界用模型每次 run 的範圍，gap 很小時上一幀的尾巴會在
+#         下一幀的 SOF 之後才出來，與板子上下一幀的 S2MM 收到的一樣)
+# tb 只編譯一次，每個 --gap 重跑一次模擬 (GAP 是 plusarg)。
+#   python3 rtl_compare.py --size 96x64,64x48 --frames 6 --gap 0,64
+#   python3 rtl_compare.py --source ~/EuRoc/MH01/mav0/cam0/data --size 160x120 --tie-mode 2
+# 需要 verilator (>= 5，--binary / --timing)；有些打包的 verilator 要額外的
+# make / C++ 參數，用 --make-flags / --cflags 傳進去。
+# ============================================================================
+import os, sys, shutil, argparse, tempfile, subprocess
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HW_DIR = os.path.join(HERE, "..", "Hardware_Source")
+RTL = ["tb_top_stream.sv", "FAST_nms.v", "fast.v", "nms.v"]
+
+def build(args, params, work):
+    cmd = [args.verilator, "--binary", "-j", "0", "-Wno-fatal", "-Wno-lint", "-Wno-style",
+           "--top-module", "tb_top_stream", "--Mdir", os.path.join(work, "obj_dir"), "-o", "tb"]
+    cmd += [f"-G{k}={v}" for k, v in params.items()]
+    if args.make_flags: cmd += ["-MAKEFLAGS", args.make_flags]
+    if args.cflags: cmd += ["-CFLAGS", args.cflags]
+    cmd += [os.path.join(args.hw_dir, f) for f in RTL]
+    print(f"[Compare] building tb_top_stream with {args.verilator}")
+    r = subprocess.run(cmd, capture_output=True, text=True)
+    if r.returncode != 0:
+        sys.stderr.write(r.stdout[-4000:] + r.stderr[-4000:])
+        raise SystemExit("[Compare] verilator build failed")
+    return os.path.join(work, "obj_dir", "tb")
+
+def write_frames(frames, work):
+    # tb 的輸入格式：第一行 "W H"，接著 row-major 的 pixel
+    paths = []
+    for k, f in enumerate(frames):
+        p = os.path.join(work, f"f{k}.txt")
+        H, W = f.shape
+        with open(p, "w") as fp:
+            fp.write(f"{W} {H}\n")
+            np.savetxt(fp, f, fmt="%d")
+        paths.append(p)
+    lst = os.path.join(work, "frames.lst")
+    with open(lst, "w") as fp:
+        fp.write("\n".join(paths) + "\n")
+    return lst
+
+def read_split(path, conv):
+    # "F <idx>" 之前的行屬於上一段；回傳 [段0 (第一個 SOF 之前), 段1, ...]
+    parts = [[]]
+    with open(path) as fp:
+        for line in fp:
+            v = line.split()
+            if v[0] == "F": parts.append([])
+            else: parts[-1].append(conv(v))
+    return parts
+
+def model_run(frames, params, gap):
+    from fast_emu import FastNmsModel
+    m = FastNmsModel(AS_BUILT=1, IDLE_CYCLES=gap, **params)
+    packs, streams = [], []
+    for f in frames:
+        m.run(f)
+        packs.append(m.pack)
+        streams.append(m.stream)
+    return packs, streams
+
+def check_fast(events, packs):
+    # events[k+1] 是第 k 張 SOF 之後的事件。每個 pixel 都有事件，新的一幀從 (3, 3) 開始，
+    # 在那之前的是上一幀最後幾個 (pipeline 裡的與 SOF 那一拍的)
+    n = bad = 0
+    first = None
+    for k, ev in enumerate(events[1:]):
+        kk = k - 1 if k > 0 else k
+        for x, y, strong, score in ev:
+            if (x, y) == (3, 3): kk = k
+            got = (strong << 10) | score
+            n += 1
+            if packs[kk][y, x] != got:
+                bad += 1
+                if first is None: first = (kk, x, y, got, int(packs[kk][y, x]))
+    return n, bad, first
+
+def check_axis(beats, streams):
+    rtl = [b for part in beats for b in part]
+    ref, owner = [], []
+    for k, (words, tlast) in enumerate(streams):
+        ref += zip(words.tolist(), tlast.tolist())
+        owner += [k] * len(words)
+    for i, (a, b) in enumerate(zip(rtl, ref)):
+        if a != b:
+            return len(rtl), len(ref), (i, owner[i], a, b)
+    return len(rtl), len(ref), None
+
+def main():
+    ints = lambda s: [int(v) for v in s.split(",") if v != ""]
+    ap = argparse.ArgumentParser(description="Compare fast_emu (AS_BUILT=1) with the RTL under Verilator, word by word")
+    ap.add_argument("--source", default="synthetic", help="'synthetic', an image directory or a .fslog session log")
+    ap.add_argument("--size", default="96x64,64x48",
+                    help="Comma list of WxH; frames alternate between them (resolution switches)")
+    ap.add_argument("--frames", type=int, default=6, help="Frames in the stream")
+    ap.add_argument("--gap", type=ints, default=[0, 64], help="Idle cycles after each frame, comma list (one run each)")
+    ap.add_argument("--verilator", default="verilator", help="Verilator executable")
+    ap.add_argument("--make-flags", default="", help="Extra make flags passed through verilator -MAKEFLAGS")
+    ap.add_argument("--cflags", default="", help="Extra C++ flags passed through verilator -CFLAGS")
+    ap.add_argument("--hw-dir", default=HW_DIR, help="Directory with the RTL and tb_top_stream.sv")
+    ap.add_argument("--work", default=None, help="Build / output directory (default: a temporary one, removed)")
+    ap.add_argument("--max-w", type=int, default=1024, help="MAX_W")
+    ap.add_argument("--max-h", type=int, default=768, help="MAX_H")
+    ap.add_argument("--tlast-each-row", type=int, default=1, choices=[0, 1], help="TLAST_EACH_ROW")
+    ap.add_argument("--ini-th", type=int, default=20, help="FAST_INI_TH")
+    ap.add_argument("--min-th", type=int, default=7, help="FAST_MIN_TH")
+    ap.add_argument("--tie-mode", type=int, default=1, choices=[0, 1, 2], help="NMS_TIE_MODE")
+    ap.add_argument("--strict-gt", type=int, default=0, choices=[0, 1], help="NMS_STRICT_GT")
+    args = ap.parse_args()
+    sizes = [tuple(map(int, s.lower().split("x"))) for s in args.size.split(",") if s]
+    if not sizes or args.frames < 1:
+        ap.error("--size and --frames must not be empty")
+    for W, H in sizes:
+        if not (7 <= W <= args.max_w and 7 <= H <= args.max_h):
+            ap.error(f"frame {W}x{H} outside 7x7 .. {args.max_w}x{args.max_h}")
+
+    from sweep import load_frames
+    per = -(-args.frames // len(sizes))
+    sets = [load_frames(args.source, per, s) for s in sizes]
+    frames = [sets[k % len(sizes)][k // len(sizes)] for k in range(args.frames)]
+    params = dict(MAX_W=args.max_w, MAX_H=args.max_h, TLAST_EACH_ROW=args.tlast_each_row,
+                  FAST_INI_TH=args.ini_th, FAST_MIN_TH=args.min_th,
+                  NMS_TIE_MODE=args.tie_mode, NMS_STRICT_GT=args.strict_gt)
+    work = args.work or tempfile.mkdtemp(prefix="rtl_compare_")
+    os.makedirs(work, exist_ok=True)
+    ok = True
+    try:
+        tb = build(args, params, work)
+        lst = write_frames(frames, work)
+        for gap in args.gap:
+            out = os.path.join(work, f"gap{gap}")
+            r = subprocess.run([tb, f"+LIST={lst}", f"+OUT={out}", f"+GAP={gap}"], capture_output=True, text=True)
+            if r.returncode != 0:
+                sys.stderr.write(r.stdout[-4000:] + r.stderr[-4000:])
+                raise SystemExit("[Compare] simulation failed")
+            events = read_split(out + ".fast", lambda v: tuple(int(t) for t in v))
+            beats = read_split(out + ".axis", lambda v: (int(v[0], 16), int(v[1])))
+            packs, streams = model_run(frames, params, gap)
+            n, bad, first = check_fast(events, packs)
+            print(f"[Compare] gap={gap}: FAST {n} events, {bad} mismatched"
+                  + (f" (first: frame {first[0]} ({first[1]},{first[2]}) rtl {first[3]:#x} model {first[4]:#x})" if first else ""))
+            n_rtl, n_ref, diff = check_axis(beats, streams)
+            if diff is None and n_rtl == n_ref:
+                print(f"[Compare] gap={gap}: axis {n_rtl} words identical")
+            else:
+                ok = False
+                msg = (f"first difference at word {diff[0]} (frame {diff[1]}): rtl {diff[2][0]:#018x}/{diff[2][1]} "
+                       f"model {diff[3][0]:#018x}/{diff[3][1]}") if diff else "one is a prefix of the other"
+                print(f"[Compare] gap={gap}: axis rtl {n_rtl} / model {n_ref} words, {msg}")
+            ok = ok and bad == 0
+    finally:
+        if args.work is None: shutil.rmtree(work, ignore_errors=True)
+    print("[Compare] " + ("PASS" if ok else "FAIL"))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
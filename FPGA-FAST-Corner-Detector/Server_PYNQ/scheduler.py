@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# scheduler.py  -  多個 client 共用一塊板子
+#
+# 只有一條 worker thread 會呼叫 backend.run (VDMA / MMIO 只有一個 owner)。
+# 每個連線有自己的 slot (in/out buffer)、自己的 pending 佇列與 out_q：
+#   connection thread : recv -> prepare -> submit(cq, job)
+#   worker            : 依 weighted round-robin 從各 client 的 pending 取 job
+#                       -> backend.run -> cq.out_q.put((job, err))
+# slot 為 None 的 job 是控制訊息 (例如 stats 查詢)，worker 直接轉給 out_q，
+# 讓它的回應排在之前送進來的 frame 後面。
+# slot 是 list 時是多相機的 batch：worker 連續跑完整組 (中間不換 client) 才回報。
+# 串流的 frame (slot['stream'])：開始跑之前先放一個 (('stream', job), None) 到
+# out_q，讓 connection 端邊收進度邊送；run 結束後 stream.finish(err)。
+# backend.run 用掉的 CPU time (worker thread 本身 + backend 的 thread pool) 記在
+# slot['cpu_ns']，--energy 的 cpu_run 只算這一張的，不會混到別的連線。
+# pending 的長度不會超過該 client 的 slot 數 (沒有空的 slot 就不會再 recv)，
+# 所以佇列是有界的，塞滿時那個連線停止讀 socket，由 TCP 反壓回 client，
+# 不影響其他 client。
+# ============================================================================
+import threading, queue, time
+from collections import deque
+from bufpool import SlotPool
+
+class ClientQueue:
+    def __init__(self, cid, name, weight=1):
+        self.cid, self.name = cid, name
+        self.weight = max(1, int(weight))
+        self.pending = deque()
+        self.out_q = queue.Queue()
+        self.drained = threading.Event()
+        self.served = 0
+        self.busy_s = 0.0       # 這個 client 佔用 backend 的時間
+
+class HwScheduler:
+    def __init__(self, backend, max_clients=8, weights=None, pool=None):
+        self.backend = backend
+        self.max_clients = max_clients
+        self.weights = weights or {}        # peer host -> weight
+        self.cv = threading.Condition()
+        self.clients = []
+        self.rr, self.burst = 0, 0
+        self.next_cid = 0
+        self.pool = pool or SlotPool(backend)   # slot 用完放回 pool，同尺寸下次直接拿
+        self.pool_cpu_ns = getattr(backend, "pool_cpu_ns", None) or (lambda: 0)    # cpu backend 的 thread pool
+        self.th = threading.Thread(target=self._worker, daemon=True)
+        self.th.start()
+
+    def register(self, addr):
+        with self.cv:
+            if len(self.clients) >= self.max_clients:
+                return None
+            host = addr[0] if isinstance(addr, tuple) else str(addr)
+            cq = ClientQueue(self.next_cid, f"{host}", self.weights.get(host, 1))
+            self.next_cid += 1
+            self.clients.append(cq)
+            return cq
+
+    def submit(self, cq, job, slot):
+        if slot is not None:
+            t = time.perf_counter_ns()
+            for s in slot if isinstance(slot, list) else (slot,): s['t_sub'] = t
+        with self.cv:
+            cq.pending.append((job, slot))
+            self.cv.notify()
+
+    def run(self, cq, slot):
+        # serial 用：送進佇列並等這一張做完
+        self.submit(cq, None, slot)
+        _, err = cq.out_q.get()
+        if err is not None: raise err
+
+    def close(self, cq):
+        # 等這個 client 已送出的 job 全部跑完才移除 (之後才能釋放它的 slot)
+        with self.cv:
+            cq.pending.append((None, None))
+            self.cv.notify()
+        cq.drained.wait()
+        with self.cv:
+            i = self.clients.index(cq)
+            self.clients.pop(i)
+            if i < self.rr: self.rr -= 1
+            if self.clients: self.rr %= len(self.clients)
+            else: self.rr = 0
+            self.burst = 0
+
+    def alloc_slot(self, H, W):
+        return self.pool.acquire(H, W)
+
+    def free_slot(self, slot):
+        self.pool.release(slot)
+
+    def _pick(self):
+        # weighted round-robin：輪到的 client 最多連續做 weight 張
+        n = len(self.clients)
+        for _ in range(n + 1):
+            cq = self.clients[self.rr]
+            if cq.pending and self.burst < cq.weight:
+                self.burst += 1
+                return cq, cq.pending.popleft()
+            self.rr = (self.rr + 1) % n
+            self.burst = 0
+        return None
+
+    def _worker(self):
+        while True:
+            with self.cv:
+                picked = self._pick() if self.clients else None
+                while picked is None:
+                    self.cv.wait()
+                    picked = self._pick() if self.clients else None
+            cq, (job, slot) = picked
+            if slot is None:
+                if job is None:
+                    cq.out_q.put(None)
+                    cq.drained.set()
+                else:
+                    cq.out_q.put((job, None))   # 控制訊息：不用板子，只是保持回應順序
+                continue
+            err = None
+            group = slot if isinstance(slot, list) else (slot,)
+            t0 = time.perf_counter()
+            for s in group:
+                s['t']['queue'] = time.perf_counter_ns() - s['t_sub']
+                stream = s.get('stream')
+                if stream is not None: cq.out_q.put((('stream', job), None))
+                t1 = time.perf_counter()
+                c1 = time.thread_time_ns(); p1 = self.pool_cpu_ns()
+                try:
+                    self.backend.run(s)
+                except Exception as e:
+                    err = e
+                s['cpu_ns'] = time.thread_time_ns() - c1 + self.pool_cpu_ns() - p1
+                if stream is not None: stream.finish(err)
+                s['hw_ms'] = (time.perf_counter() - t1) * 1000.0
+                if err is not None: break
+            dt = time.perf_counter() - t0
+            cq.busy_s += dt; cq.served += len(group)
+            cq.out_q.put((job, err))
@@ -1,69 +1,23 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import argparse, socket, struct, time, threading
+import argparse, os, socket, time, threading, queue, json
+T_START = time.perf_counter()     # time-to-ready 從這裡算 (startup.py)
 import numpy as np
-import cv2
-from pynq import Overlay, MMIO, allocate
-from numba import njit
-
-# ===== VDMA register offsets =====
-MM2S_DMACR, MM2S_DMASR   = 0x00, 0x04
-MM2S_VSIZE, MM2S_HSIZE   = 0x50, 0x54
-MM2S_STRIDE              = 0x58
-MM2S_START_ADDR          = 0x5C
-
-S2MM_DMACR, S2MM_DMASR   = 0x30, 0x34
-S2MM_VSIZE, S2MM_HSIZE   = 0xA0, 0xA4
-S2MM_STRIDE              = 0xA8
-S2MM_START_ADDR          = 0xAC
-
-# ================= VDMA & Reset Functions =================
-def vdma_init(mmio, W):
-    bpl = 8*W
-    mmio.write(MM2S_DMASR, 0xFFFFFFFF)
-    mmio.write(S2MM_DMASR, 0xFFFFFFFF)
-    mmio.write(MM2S_DMACR, 0x00000001)  # RS=1
-    mmio.write(S2MM_DMACR, 0x00000001)  # RS=1
-    mmio.write(MM2S_STRIDE, bpl); mmio.write(MM2S_HSIZE, bpl)
-    mmio.write(S2MM_STRIDE, bpl); mmio.write(S2MM_HSIZE, bpl)
-
-def vdma_soft_reset(mmio, timeout_s=0.01):
-    # 簡單暴力重置：直接寫入 Reset bit
-    for off in (MM2S_DMACR, S2MM_DMACR):
-        mmio.write(off, mmio.read(off) | (1<<2))
-    
-    # 等待重置完成
-    t0 = time.perf_counter()
-    while True:
-        r1 = mmio.read(MM2S_DMACR) & (1<<2)
-        r2 = mmio.read(S2MM_DMACR) & (1<<2)
-        if (r1|r2)==0: break
-        if (time.perf_counter()-t0) > timeout_s: break
-    
-    # 清除狀態
-    mmio.write(MM2S_DMASR, 0xFFFFFFFF)
-    mmio.write(S2MM_DMASR, 0xFFFFFFFF)
-
-def vdma_start(mmio, in_phys, out_phys, H):
-    mmio.write(MM2S_DMASR, 0xFFFFFFFF)
-    mmio.write(S2MM_DMASR, 0xFFFFFFFF)
-    mmio.write(MM2S_START_ADDR + 0*4, in_phys  & 0xFFFFFFFF)
-    mmio.write(S2MM_START_ADDR + 0*4, out_phys & 0xFFFFFFFF)
-    mmio.write(S2MM_VSIZE, H)
-    mmio.write(MM2S_VSIZE, H)
-
-def wait_ioc(mmio, timeout_s=2.0):
-    deadline = time.perf_counter_ns() + int(timeout_s*1e9)
-    while True:
-        s1 = mmio.read(MM2S_DMASR)
-        s2 = mmio.read(S2MM_DMASR)
-        if (s1 & (1<<12)) and (s2 & (1<<12)):
-            # 清除 IOC
-            mmio.write(MM2S_DMASR, 1<<12)
-            mmio.write(S2MM_DMASR, 1<<12)
-            return s1, s2
-        if time.perf_counter_ns() > deadline:
-            raise TimeoutError("VDMA timeout")
+from corners import CornerExtractor, CornerSelector
+from backends import make_backend
+from scheduler import HwScheduler
+from bufpool import SlotPool
+from latency import LatencyStats
+from protocol import (MAGIC, VERSION, HDR_V1, CNT_V1, REQ_V2, RESP_V2, SEL_V2, CHUNK_V2,
+                      BATCH_V2, CAM_V2, SECT_V2, MAX_BATCH,
+                      REQ_INCREMENTAL, REQ_SELECT, REQ_STRONG_ONLY, REQ_STREAM, REQ_BATCH, REQ_STATS,
+                      RESP_TRUNCATED, RESP_CHUNK, RESP_END, RESP_BATCH, RESP_CTRL)
+from incremental import IncrState
+from rowstream import RowStream, ChunkCutter
+from adaptive import ThresholdController, filter_score
+from startup import StartupTimer, warm_kernels, dummy_frames
+from session_log import SessionWriter
+from energy import EnergyMeter, find_rails
 
 def recv_exact_into(conn, mv):
     got = 0; n = len(mv)
@@ -73,109 +27,447 @@ def recv_exact_into(conn, mv):
         got += k
     return got
 
-# ================= 演算法核心 =================
-@njit(fastmath=True)
-def parse_corners_numba(words_u64):
-    MAX_CORNERS = 20000 
-    xs = np.empty(MAX_CORNERS, dtype=np.uint16)
-    ys = np.empty(MAX_CORNERS, dtype=np.uint16)
-    stg = np.empty(MAX_CORNERS, dtype=np.uint16)
-    scr = np.empty(MAX_CORNERS, dtype=np.uint16)
-    count = 0
-    n_pixels = len(words_u64)
-    for i in range(n_pixels):
-        w = words_u64[i]
-        if (w & 0x3FF) != 0:
-            if count >= MAX_CORNERS: break
-            ys[count]  = (w >> 48) & 0xFFFF
-            xs[count]  = (w >> 32) & 0xFFFF
-            stg[count] = (w >> 10) & 0x1
-            scr[count] = w & 0x3FF
-            count += 1
-    return xs[:count], ys[:count], stg[:count], scr[:count]
-
-def run_cpu_fast(img_gray, threshold=20):
-    fast = cv2.FastFeatureDetector_create(threshold=threshold, nonmaxSuppression=True)
-    keypoints = fast.detect(img_gray, None)
-    N = len(keypoints)
-    xs = np.empty(N, dtype=np.uint16)
-    ys = np.empty(N, dtype=np.uint16)
-    stg = np.full(N, 1, dtype=np.uint16)
-    scr = np.empty(N, dtype=np.uint16)
-    for i, kp in enumerate(keypoints):
-        xs[i] = int(kp.pt[0]); ys[i] = int(kp.pt[1])
-        scr[i] = int(kp.response) if kp.response else threshold 
-    return xs, ys, stg, scr
+def recv_request_header(conn, hdr):
+    # hdr: bytearray(REQ_V2.size + SEL_V2.size + BATCH_V2.size)；回傳 (H, W, req)，v1 client 的 req 是 None
+    # req = (frame_id, flags, sel, M)，sel 是 REQ_SELECT 的 (top_k, per_cell, cols, rows) 或 None，
+    # M 是 REQ_BATCH 的 frame 數 (不是 batch 時 0)
+    mv = memoryview(hdr)
+    recv_exact_into(conn, mv[:HDR_V1.size])
+    H, W = HDR_V1.unpack_from(hdr)
+    if H != MAGIC:
+        return H, W, None
+    recv_exact_into(conn, mv[HDR_V1.size:REQ_V2.size])
+    _, ver, flags, fid, H, W = REQ_V2.unpack_from(hdr)
+    if ver != VERSION:
+        raise ValueError(f"unsupported protocol version {ver}")
+    sel = None
+    if flags & REQ_SELECT:
+        recv_exact_into(conn, mv[REQ_V2.size:REQ_V2.size + SEL_V2.size])
+        sel = SEL_V2.unpack_from(hdr, REQ_V2.size)
+    M = 0
+    if flags & REQ_BATCH:
+        off = REQ_V2.size + SEL_V2.size
+        recv_exact_into(conn, mv[off:off + BATCH_V2.size])
+        M, _ = BATCH_V2.unpack_from(hdr, off)
+        if not 1 <= M <= MAX_BATCH:
+            raise ValueError(f"batch of {M} frames (1..{MAX_BATCH})")
+    return H, W, (fid, flags, sel, M)
+
+def selection(ctx, req):
+    # 這張要做的挑選 (top_k, per_cell, cols, rows, strong_only)；不挑時 None。
+    # request 的 REQ_SELECT 取代 server 的 --top-k / --grid，strong-only 兩邊任一個
+    top_k, per_cell, cols, rows, strong = ctx['select']
+    if req is not None:
+        if req[2] is not None: top_k, per_cell, cols, rows = req[2]
+        strong = strong or bool(req[1] & REQ_STRONG_ONLY)
+    if not (top_k or (per_cell and cols and rows) or strong):
+        return None
+    return top_k, per_cell, cols, rows, strong
+
+def select_corners(selector, pts, H, W, sel, t):
+    if sel is None:
+        return pts
+    t0 = time.perf_counter_ns()
+    pts = selector(pts, H, W, sel)
+    t['select'] = time.perf_counter_ns() - t0
+    return pts
+
+def send_all_parts(conn, parts):
+    # 多段 buffer 用一次 sendmsg (scatter-gather) 送出；送不完的部分接著送
+    parts = [memoryview(p).cast('B') for p in parts if len(p)]
+    while parts:
+        n = conn.sendmsg(parts)
+        while parts and n >= len(parts[0]):
+            n -= len(parts[0]); parts.pop(0)
+        if n: parts[0] = parts[0][n:]
+
+def send_result(conn, req, pts, truncated, t, hdr, H=0):
+    # pts: backend.collect 回傳的 (N, 4) '<u2' records，已經是封包 body，不再打包
+    # hdr: 連線自己的 bytearray(RESP_V2.size + CHUNK_V2.size)；t: stage 計時 (ns)，記下 pack / send
+    # REQ_STREAM 但這張不能串流時：整張當成一個 END chunk [0, H)
+    t0 = time.perf_counter_ns()
+    N = len(pts)
+    flags = RESP_TRUNCATED if truncated else 0
+    if req is None:
+        CNT_V1.pack_into(hdr, 0, N); head = memoryview(hdr)[:CNT_V1.size]
+    elif req[1] & REQ_STREAM:
+        RESP_V2.pack_into(hdr, 0, MAGIC, VERSION, flags | RESP_CHUNK | RESP_END, req[0], N)
+        CHUNK_V2.pack_into(hdr, RESP_V2.size, 0, H)
+        head = hdr
+    else:
+        RESP_V2.pack_into(hdr, 0, MAGIC, VERSION, flags, req[0], N)
+        head = memoryview(hdr)[:RESP_V2.size]
+    t1 = time.perf_counter_ns()
+    send_all_parts(conn, (head, pts))
+    t['pack'] = t1 - t0; t['send'] = time.perf_counter_ns() - t1
+
+# ===== 多相機 batch (REQ_BATCH) =====
+def _free_entry(sched, e):
+    # slot 或 batch 的 slot list 還給 pool
+    if e is None: return
+    for s in e if isinstance(e, list) else (e,): sched.free_slot(s)
+
+def _ensure_group(sched, cur, M, H, W):
+    # batch 用的 M 個同尺寸 slot；cur (原本的 slot / list) 不合用就還給 pool
+    if isinstance(cur, list) and len(cur) == M and cur[0]['shape'] == (H, W):
+        return cur
+    _free_entry(sched, cur)
+    return [sched.alloc_slot(H, W) for _ in range(M)]
+
+def recv_batch(ctx, conn, req, group, hdr, incrs):
+    # 每張：CAM_V2 + H*W bytes，直接收進各自的 slot。
+    # incremental 每台相機各自一份 (incrs: cam_id -> IncrState)，收之前先定 (見 backend.receive)
+    for s in group:
+        recv_exact_into(conn, memoryview(hdr))
+        s['cam'], _ = CAM_V2.unpack(hdr)
+        s['incr'] = incrs[s['cam']] = incr_state(ctx, req, incrs.get(s['cam']))
+        ctx['backend'].receive(conn, s, recv_exact_into)
+
+def prepare_batch(ctx, ctl, req, group):
+    # threshold 整組相同；batch 不串流
+    for k, s in enumerate(group):
+        if k: s['t'] = {}
+        frame_threshold(ctx, ctl, s)
+        s['stream'] = None
+        ctx['backend'].prepare(s)
+
+def collect_batch(ctx, ctl, group, sel, extract, selector):
+    # -> [(pts, truncated)]，pts 是 copy (extract / selector 的 buffer 下一張就蓋掉)
+    out = []
+    for s in group:
+        t_parse = time.perf_counter_ns()
+        pts, truncated = ctx['backend'].collect(s, extract)
+        pts = apply_threshold(ctx, ctl, s, pts, extract, truncated)
+        s['t']['parse'] = time.perf_counter_ns() - t_parse
+        pts = select_corners(selector, pts, *s['shape'], sel, s['t'])
+        if truncated:
+            print(f"[WARN] cam {s['cam']}: {extract.last_total} corners, truncated to {len(pts)} (--max-corners)")
+        out.append((pts.copy(), truncated))
+    return out
+
+def batch_times(group):
+    # 整組一筆延遲：各張的 stage 加總到第一張的 t (queue 只算第一張，後面幾張等的就是前面的 hw)
+    t = group[0]['t']
+    for s in group[1:]:
+        for k, ns in s['t'].items():
+            if k != 'queue': t[k] = t.get(k, 0) + ns
+    return t
+
+def send_batch(conn, req, group, results, t):
+    t0 = time.perf_counter_ns()
+    hdr = bytearray(RESP_V2.size + len(group) * SECT_V2.size)
+    flags = RESP_BATCH | (RESP_TRUNCATED if any(tr for _, tr in results) else 0)
+    RESP_V2.pack_into(hdr, 0, MAGIC, VERSION, flags, req[0], len(group))
+    parts = [memoryview(hdr)[:RESP_V2.size]]
+    for k, (s, (pts, tr)) in enumerate(zip(group, results)):
+        off = RESP_V2.size + k * SECT_V2.size
+        SECT_V2.pack_into(hdr, off, s['cam'], RESP_TRUNCATED if tr else 0, len(pts))
+        parts += [memoryview(hdr)[off:off + SECT_V2.size], pts]
+    t1 = time.perf_counter_ns()
+    send_all_parts(conn, parts)
+    t['pack'] = t1 - t0; t['send'] = time.perf_counter_ns() - t1
+
+def send_stats(conn, req, ctx):
+    # REQ_STATS 控制訊息：回傳目前所有 (backend, 解析度) 的 stage 延遲摘要
+    stats = ctx['lat'].snapshot()
+    incr = ctx['backend'].snapshot()
+    if incr: stats['incremental'] = incr
+    ctls = dict(ctx['controllers'])
+    if ctls: stats['adaptive'] = {f"#{cid}": c.snapshot() for cid, c in sorted(ctls.items())}
+    stats['startup'] = ctx['startup']
+    if ctx['energy'] is not None: stats['energy'] = ctx['energy'].report()
+    body = json.dumps(stats).encode()
+    conn.sendall(RESP_V2.pack(MAGIC, VERSION, RESP_CTRL, req[0], len(body)) + body)
+
+def finish_frame(ctx, H, W, t, cams=1):
+    # 回應送完：延遲直方圖 + (--energy) frame 數
+    ctx['lat'].add_frame(ctx['backend'].name, H, W, t, cams)
+    if ctx['energy'] is not None: ctx['energy'].add_frames(cams)
+
+def cpu_mark(ctx, t, stage, c0, slots=()):
+    # --energy：c0 到現在這條 connection thread 的 CPU time 記成 stage，加上 worker 替
+    # slots 跑 backend.run 用掉的 (slot['cpu_ns'])；回傳現在的值給下一段。
+    # 用 thread time：process time 會把同時段其他連線的 CPU 也算進來
+    c1 = time.thread_time_ns()
+    if ctx['energy'] is not None: t[stage] = c1 - c0 + sum(s.get('cpu_ns', 0) for s in slots)
+    return c1
+
+def session_energy(ctx, e0):
+    if e0 is not None:
+        print(f"  >> Energy              : {ctx['energy'].summary(e0)}")
+
+def end_session_stats(ctx):
+    if ctx['stats_json']:
+        try: ctx['lat'].dump_json(ctx['stats_json'])
+        except OSError as e: print(f"[ERR] stats dump: {e}")
+    print(ctx['lat'].format_table())
+    waiter = getattr(ctx['backend'], 'waiter', None)
+    if waiter is not None:
+        print(f"  [IOC wait] {waiter.summary()}")
+    print(f"  [Pool] {ctx['sched'].pool.summary()}")
+    for res, d in ctx['backend'].snapshot().items():
+        print(f"  [Incr] {res}: {d['frames']} frames, {d['tiles_per_frame']} tiles/frame, "
+              f"{d['reuse']*100:.1f}% reused")
 
 # ================= 主處理邏輯 =================
+# 每個連線各自持有 slot，backend.run 一律交給 ctx['sched'] 的 worker thread，
+# 多個 client 同時連線也不會共用到 buffer 或同時碰 VDMA。
+def open_session(conn, addr, ctx):
+    cq = ctx['sched'].register(addr)
+    if cq is None:
+        print(f"[TCP] client {addr} rejected: {ctx['sched'].max_clients} clients already connected")
+        try: conn.close()
+        except: pass
+    return cq
+
+def incr_state(ctx, req, incr):
+    # 這張 frame 要不要走 incremental：server --incremental 或 v2 flags 帶 REQ_INCREMENTAL。
+    # 回傳連線的 IncrState (沒打開時 None，下次打開從整張重算開始)
+    if ctx['incremental'] or (req is not None and req[1] & REQ_INCREMENTAL):
+        return incr or IncrState()
+    return None
+
+def _mode(tag, slot):
+    r = slot.get('reuse') if slot.get('incr') is not None else None
+    if r is not None: tag = f"{tag} {r*100:.0f}%"
+    th = slot.get('adaptive_th')
+    return tag if th is None else f"{tag} th{th}"
+
+def open_controller(ctx, cq):
+    # --target-corners：每個連線自己一個 threshold 控制器 (見 adaptive.py)
+    if ctx['adaptive'] is None: return None
+    ctl = ctx['controllers'][cq.cid] = ThresholdController(**ctx['adaptive'])
+    return ctl
+
+def close_controller(ctx, cq):
+    ctl = ctx['controllers'].pop(cq.cid, None)
+    if ctl is not None:
+        d = ctl.snapshot()
+        print(f"  [Adapt] threshold {d['threshold']} (range {d['range'][0]}..{d['range'][1]}), "
+              f"{d['in_band']*100:.1f}% of {d['frames']} frames in {d['target'][0]}..{d['target'][1]} corners, "
+              f"{d['changes']} changes")
+
+def open_record(ctx, cq, addr):
+    # --record DIR：這個連線的每張 frame 寫進 DIR/<時間>-c<cid>.fslog (見 session_log.py)
+    if not ctx['record']: return None
+    os.makedirs(ctx['record'], exist_ok=True)
+    path = os.path.join(ctx['record'], f"{time.strftime('%Y%m%d-%H%M%S')}-c{cq.cid}.fslog")
+    meta = dict(backend=ctx['backend'].name, peer=f"{addr[0]}:{addr[1]}", started=time.time(),
+                row_skip=ctx['row_skip'], max_corners=ctx['max_corners'])
+    print(f"[Rec] client #{cq.cid} -> {path}")
+    return SessionWriter(path, meta, dedup=ctx['record_dedup'])
+
+def record_frame(rec, req, slot, pts, truncated, sel, t_got):
+    rec.add(None if req is None else req[0], *slot['shape'], slot['plane'], pts, slot['t'], t_got,
+            incr=slot['incr'] is not None, truncated=truncated, threshold=slot['adaptive_th'], sel=sel)
+
+def close_record(rec):
+    if rec is None: return
+    rec.close()
+    print(f"  [Rec] {rec.frames} frames ({rec.dup} duplicate images not stored), "
+          f"{rec.off / 2**20:.1f} MB -> {rec.path}")
+
+def frame_threshold(ctx, ctl, slot):
+    # 這張用的 threshold；只有 backend 能直接換 threshold (cpu) 時才交給 backend.run
+    th = ctl.threshold if ctl is not None else None
+    slot['adaptive_th'] = th
+    slot['threshold'] = th if ctx['native_threshold'] else None
+
+def apply_threshold(ctx, ctl, slot, pts, extract, truncated):
+    # collect 之後：fpga / emu 在這裡丟掉 score < threshold 的角點，再把角點數回授
+    if ctl is None: return pts
+    if slot['threshold'] is None:
+        pts = filter_score(pts, slot['adaptive_th'])
+        ctl.update(len(pts))
+    else:
+        ctl.update(extract.last_total if truncated else len(pts))
+    return pts
+
+def stream_mode(ctx, req, slot):
+    # REQ_STREAM 而且這張可以邊做邊送 -> RowStream；否則 None (top-K / grid 挑選與
+    # incremental 要整張做完，回應仍是 chunk 格式，只有一個 END chunk)
+    if req is None or not req[1] & REQ_STREAM or slot['incr'] is not None:
+        return None
+    sel = selection(ctx, req)
+    if sel is not None and (sel[0] or (sel[1] and sel[2] and sel[3])):
+        return None
+    return RowStream(ctx['stream_bands'])
+
+def send_stream(conn, ctx, slot, req, extract, ctl, hdr, t_got):
+    # backend 跑的同時 (worker thread) 在這裡收進度、parse 新的 line、送出 row 範圍
+    # 已完整的 chunk，最後送 END。extract 不設上限 (--max-corners 是整張累計)。
+    # -> (整張送出的角點, truncated)
+    H, W = slot['shape']
+    t = slot['t']
+    cut = ChunkCutter(H)
+    th = slot['adaptive_th'] if slot['threshold'] is None else None     # fpga / emu：score filter
+    strong = selection(ctx, req) is not None                             # 這裡只剩 strong-only
+    cap = ctx['max_corners']
+    st = dict(sent=[], n=0, total=0, truncated=False, parse=0, send=0)
+
+    def keep(pts):
+        if th is not None: pts = filter_score(pts, th)
+        if strong: pts = pts[pts[:, 2] != 0]
+        st['total'] += len(pts)
+        return pts
+
+    def out(y0, y1, pts, flags):
+        if cap and st['n'] + len(pts) > cap:
+            pts = pts[:max(cap - st['n'], 0)]; st['truncated'] = True
+        if st['truncated']: flags |= RESP_TRUNCATED
+        t0 = time.perf_counter_ns()
+        RESP_V2.pack_into(hdr, 0, MAGIC, VERSION, flags | RESP_CHUNK, req[0], len(pts))
+        CHUNK_V2.pack_into(hdr, RESP_V2.size, y0, y1)
+        send_all_parts(conn, (hdr, pts))
+        t1 = time.perf_counter_ns()
+        st['send'] += t1 - t0
+        if 'first' not in t: t['first'] = t1 - t_got
+        if flags & RESP_END: t['last'] = t1 - t_got
+        st['n'] += len(pts)
+        st['sent'].append(pts.copy())
+
+    parsed = 0
+    events = 0
+    for ev in slot['stream']:
+        events += 1
+        t0 = time.perf_counter_ns()
+        if ev[0] == 'lines':
+            if ev[1] <= parsed: continue
+            pts, _ = extract.records(slot['out_buf'][parsed:ev[1]])
+            parsed = ev[1]
+            pts, y_done = keep(pts), None
+        else:
+            pts, y_done = keep(ev[1]), ev[2]
+        # 截斷之後只算總數 (給 adaptive)，不再切 chunk：END 的範圍從最後送出的 row 起
+        chunk = cut.cut(pts, y_done) if not st['truncated'] else None
+        st['parse'] += time.perf_counter_ns() - t0
+        if chunk is not None:
+            out(*chunk, 0)
+    t0 = time.perf_counter_ns()
+    if not events:
+        # backend 沒有回報進度 (例如超過 MAX 切 tile 的 frame)：整張做完一次送
+        pts, _ = ctx['backend'].collect(slot, extract)
+        cut.cut(keep(pts), 0)           # 全部留在 carry，由 END 送出
+    y0, _, rest = cut.rest()
+    st['parse'] += time.perf_counter_ns() - t0
+    out(y0, H, rest, RESP_END)
+    t['parse'] = st['parse']; t['send'] = st['send']
+    if ctl is not None: ctl.update(st['total'])
+    if st['truncated']:
+        print(f"[WARN] {st['total']} corners, truncated to {st['n']} (--max-corners)")
+    return np.concatenate(st['sent']), st['truncated']
+
 def handle_client(conn, addr, ctx):
     stats_total_ms = 0.0
     stats_count = 0
     frame_id = 0
+    backend = ctx['backend']
+    sched = ctx['sched']
+    cq = open_session(conn, addr, ctx)
+    if cq is None: return
+    slot = None
+    group = None            # REQ_BATCH 用的 slot list
+    incr = None
+    incrs = {}              # batch：cam_id -> IncrState
+    extract = CornerExtractor(max_corners=ctx['max_corners'], row_skip=ctx['row_skip'])
+    sextract = CornerExtractor(row_skip=ctx['row_skip'])     # REQ_STREAM 的逐段 parse
+    selector = CornerSelector()
+    ctl = open_controller(ctx, cq)
+    rec = open_record(ctx, cq, addr)
+    e0 = ctx['energy'].snapshot() if ctx['energy'] is not None else None
     
     try:
         conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        print(f"[TCP] client {addr} connected")
+        print(f"[TCP] client #{cq.cid} {addr} connected")
         print(f"\n{'Frame':<6} | {'Time(ms)':<10} | {'FPS':<8} | {'N-Points':<8} | {'Mode':<6}")
         print("-" * 55)
 
-        header = bytearray(4)
-        hdr_mv = memoryview(header)
+        header = bytearray(REQ_V2.size + SEL_V2.size + BATCH_V2.size)
+        cam_hdr = bytearray(CAM_V2.size)
+        resp_hdr = bytearray(RESP_V2.size + CHUNK_V2.size)
 
         while True:
             # 1. 接收 Header
-            recv_exact_into(conn, hdr_mv)
-            H, W = struct.unpack("<HH", header)
-
-            # 2. Buffer Init (只在尺寸變更時做)
-            if not ctx['use_cpu']:
-                if ctx['cur_shape'] != (H, W):
-                    vdma_init(ctx['mmio'], W)
-                    if ctx['in_buf']:
-                        try: ctx['in_buf'].freebuffer(); ctx['out_buf'].freebuffer()
-                        except: pass
-                    ctx['in_buf']  = allocate((H, W), dtype=np.uint64, cacheable=1)
-                    ctx['out_buf'] = allocate((H, W), dtype=np.uint64, cacheable=1)
-                    ctx['in_bytes']  = ctx['in_buf'].view(np.uint8).reshape(H, W, 8)
-                    ctx['in_plane0'] = ctx['in_bytes'][:, :, 0]
-                    ctx['rx_buf']    = bytearray(H*W)
-                    ctx['rx_mv']     = memoryview(ctx['rx_buf'])
-                    ctx['cur_shape'] = (H, W)
-                    print(f"[FPGA] re-init buffers {W}x{H} (CACHEABLE=1)")
-            else:
-                if ctx['cur_shape'] != (H, W):
-                    ctx['rx_buf'] = bytearray(H*W)
-                    ctx['rx_mv']  = memoryview(ctx['rx_buf'])
-                    ctx['cur_shape'] = (H, W)
-                    print(f"[CPU] re-init buffers {W}x{H}")
+            c0 = time.thread_time_ns()          # --energy：各段的 CPU time (見 cpu_mark)
+            t_hdr = time.perf_counter_ns()
+            H, W, req = recv_request_header(conn, header)
+            if req is not None and req[1] & REQ_STATS:
+                send_stats(conn, req, ctx)
+                continue
+            t = {'hdr_rx': time.perf_counter_ns() - t_hdr}
+
+            if req is not None and req[3]:
+                # 多相機 batch：M 張連續在板子上跑完，一次回應
+                cur, group = group, None
+                group = _ensure_group(sched, cur, req[3], H, W)
+                t_rx = time.perf_counter_ns()
+                recv_batch(ctx, conn, req, group, cam_hdr, incrs)
+                t_got = time.perf_counter_ns()
+                t['payload_rx'] = t_got - t_rx
+                group[0]['t'] = t
+                c1 = cpu_mark(ctx, t, 'cpu_rx', c0)
+                prepare_batch(ctx, ctl, req, group)
+                t_start = time.perf_counter()
+                sched.run(cq, group)
+                c2 = cpu_mark(ctx, t, 'cpu_run', c1, group)
+                sel = selection(ctx, req)
+                results = collect_batch(ctx, ctl, group, sel, extract, selector)
+                proc_ms = (time.perf_counter() - t_start) * 1000.0
+                if stats_count > 0: stats_total_ms += proc_ms
+                stats_count += 1
+                if not ctx['quiet']:
+                    N = sum(len(p) for p, _ in results)
+                    print(f"{frame_id:<6} | {proc_ms:<10.2f} | {1000.0 / proc_ms:<8.1f} | {N:<8} | "
+                          f"{_mode(backend.tag, group[0])} x{len(group)} #{cq.cid}")
+                frame_id += 1
+                batch_times(group)
+                send_batch(conn, req, group, results, t)
+                t['total'] = time.perf_counter_ns() - t_got
+                cpu_mark(ctx, t, 'cpu_post', c2)
+                finish_frame(ctx, H, W, t, len(group))
+                if rec is not None:
+                    for s, (pts, truncated) in zip(group, results):
+                        record_frame(rec, req, s, pts, truncated, sel, t_got)
+                continue
+
+            # 2. Buffer (尺寸變更時換一組；同尺寸的 slot 由 pool 保留，不重配 CMA)
+            if slot is None or slot['shape'] != (H, W):
+                if slot is not None:
+                    sched.free_slot(slot)
+                slot = None      # alloc 失敗時 finally 不會再 free 一次
+                slot = sched.alloc_slot(H, W)
 
             # 3. 接收影像
-            recv_exact_into(conn, ctx['rx_mv'][:H*W])
-            rx_plane = np.frombuffer(ctx['rx_buf'], dtype=np.uint8, count=H*W).reshape(H, W)
+            slot['incr'] = incr = incr_state(ctx, req, incr)
+            t_rx = time.perf_counter_ns()
+            backend.receive(conn, slot, recv_exact_into)
+            t_got = time.perf_counter_ns()
+            t['payload_rx'] = t_got - t_rx
+            slot['t'] = t
+            c1 = cpu_mark(ctx, t, 'cpu_rx', c0)
+            frame_threshold(ctx, ctl, slot)
 
             # ===== Benchmark Start =====
             t_start = time.perf_counter()
-            
-            if ctx['use_cpu']:
-                xs, ys, stg, sc = run_cpu_fast(rx_plane, threshold=ctx['cpu_th'])
-            else:
-                np.copyto(ctx['in_plane0'], rx_plane, casting='no')
-                ib = ctx['in_bytes']
-                ib[0,0,1] = (H & 0xFF); ib[0,0,2] = ((H >> 8) & 0xFF)
-                ib[0,0,3] = (W & 0xFF); ib[0,0,4] = ((W >> 8) & 0xFF)
-                ctx['in_buf'].flush()
-
-                # [這裡就是你要的 Reset Per Frame]
-                # 使用最簡單的 Soft Reset，不加任何複雜檢查，保證不會卡住
-                if ctx['reset_per_frame']:
-                    vdma_soft_reset(ctx['mmio'])
-                    vdma_init(ctx['mmio'], W)
-
-                vdma_start(ctx['mmio'], ctx['in_buf'].physical_address, ctx['out_buf'].physical_address, H)
-                wait_ioc(ctx['mmio'], ctx['timeout'])
 
-                ctx['out_buf'].invalidate()
-                xs, ys, stg, sc = parse_corners_numba(ctx['out_buf'].reshape(-1))
+            backend.prepare(slot)
+            stream = slot['stream'] = stream_mode(ctx, req, slot)
+            sel = selection(ctx, req)
+            if stream is not None:
+                sched.submit(cq, None, slot)
+                cq.out_q.get()                  # ('stream', None)：worker 開始跑這一張
+                pts, truncated = send_stream(conn, ctx, slot, req, sextract, ctl, resp_hdr, t_got)
+                _, err = cq.out_q.get()
+                if err is not None: raise err
+                c2 = cpu_mark(ctx, t, 'cpu_run', c1, (slot,))
+            else:
+                sched.run(cq, slot)
+                c2 = cpu_mark(ctx, t, 'cpu_run', c1, (slot,))
+                t_parse = time.perf_counter_ns()
+                pts, truncated = backend.collect(slot, extract)
+                pts = apply_threshold(ctx, ctl, slot, pts, extract, truncated)
+                t['parse'] = time.perf_counter_ns() - t_parse
+                pts = select_corners(selector, pts, H, W, sel, t)
 
             t_end = time.perf_counter()
             proc_ms = (t_end - t_start) * 1000.0
@@ -184,27 +476,35 @@ def handle_client(conn, addr, ctx):
             if stats_count > 0: stats_total_ms += proc_ms
             stats_count += 1
             
-            N = int(xs.size)
+            N = len(pts)
             curr_fps = 1000.0 / proc_ms if proc_ms > 0 else 0
-            status_tag = "CPU" if ctx['use_cpu'] else ("RST" if ctx['reset_per_frame'] else "FPGA")
+            status_tag = _mode(backend.tag, slot)
 
-            print(f"{frame_id:<6} | {proc_ms:<10.2f} | {curr_fps:<8.1f} | {N:<8} | {status_tag:<6}")
+            if not ctx['quiet']:
+                print(f"{frame_id:<6} | {proc_ms:<10.2f} | {curr_fps:<8.1f} | {N:<8} | {status_tag:<6} #{cq.cid}")
+            if truncated and stream is None:
+                print(f"[WARN] frame {frame_id}: {extract.last_total} corners, truncated to {N} (--max-corners)")
             frame_id += 1
 
-            conn.sendall(struct.pack("<I", N))
-            if N > 0:
-                pkt = np.empty((N, 4), dtype="<u2")
-                pkt[:,0]=xs; pkt[:,1]=ys; pkt[:,2]=stg; pkt[:,3]=sc
-                conn.sendall(pkt.tobytes(order="C"))
+            if stream is None: send_result(conn, req, pts, truncated, t, resp_hdr, H)
+            t['total'] = time.perf_counter_ns() - t_got
+            cpu_mark(ctx, t, 'cpu_post', c2)
+            finish_frame(ctx, H, W, t)
+            if rec is not None: record_frame(rec, req, slot, pts, truncated, sel, t_got)
 
     except Exception as e:
         if "EOF" not in str(e): print(f"[ERR] {e}")
     finally:
         try: conn.close()
         except: pass
+        sched.close(cq)
+        if slot is not None: sched.free_slot(slot)
+        _free_entry(sched, group)
+        close_controller(ctx, cq)
+        close_record(rec)
         valid_frames = stats_count - 1
         print("\n" + "="*40)
-        print(f"  Session Summary ({'CPU' if ctx['use_cpu'] else 'FPGA'})")
+        print(f"  Session Summary ({backend.name}, client #{cq.cid})")
         print("="*40)
         if valid_frames > 0:
             avg_ms = stats_total_ms / valid_frames
@@ -212,49 +512,411 @@ def handle_client(conn, addr, ctx):
             print(f"  Total Time (Valid)     : {stats_total_ms:.2f} ms")
             print(f"  >> Average Time        : {avg_ms:.4f} ms")
             print(f"  >> Hardware FPS        : {(1000.0/avg_ms):.2f} FPS")
+        session_energy(ctx, e0)
+        print("="*40)
+        end_session_stats(ctx)
+        print("="*40 + "\n")
+
+# ================= Pipeline 模式 (recv / VDMA / parse 重疊) =================
+# 連線自己的 ring 內每個 slot 依序經過三個 stage：
+#   recv thread  : 收 frame N+1 -> slot['plane'] -> backend.prepare (FPGA: 進 CMA + flush)
+#   sched worker : frame N 在 backend.run 裡 (FPGA: vdma_start / wait_ioc / invalidate)
+#   send thread  : frame N-1 parse + sendall，送完才把 slot 還回 free_q
+# 同一個連線的 job 在 scheduler 裡是 FIFO，所以回傳順序不變。
+def _ensure_slot(sched, ring, i, H, W):
+    slot = ring[i]
+    if isinstance(slot, dict) and slot['shape'] == (H, W):
+        return slot
+    _free_entry(sched, slot)       # 可能是上一次 batch 的 slot list
+    ring[i] = None
+    slot = sched.alloc_slot(H, W)
+    ring[i] = slot
+    return slot
+
+def _send_stage(conn, ctx, cq, ring, free_q, stats, errs, ctl, rec):
+    depth = ctx['pipeline_depth']
+    backend = ctx['backend']
+    status_tag = backend.name + f"x{depth}"
+    t_prev = None
+    try:
+        extract = CornerExtractor(max_corners=ctx['max_corners'], row_skip=ctx['row_skip'])
+        sextract = CornerExtractor(row_skip=ctx['row_skip'])
+        selector = CornerSelector()
+        resp_hdr = bytearray(RESP_V2.size + CHUNK_V2.size)
+        while True:
+            item = cq.out_q.get()
+            if item is None: break
+            job, err = item
+            if err is not None: raise err
+            if job[0] == 'ctrl':
+                send_stats(conn, job[1], ctx)
+                continue
+            if job[0] == 'stream':
+                # worker 開始跑這一張：邊跑邊送，做完的 (job, err) 接著才會來
+                slot = ring[job[1][0]]
+                slot['streamed'] = send_stream(conn, ctx, slot, slot['req'], sextract, ctl, resp_hdr,
+                                               slot['t_got'])
+                continue
+            i, H, W = job
+            group = ring[i] if isinstance(ring[i], list) else None     # REQ_BATCH
+            slot = ring[i] if group is None else group[0]
+            t = slot['t']
+            sel = selection(ctx, slot['req'])
+            if group is not None:
+                results = collect_batch(ctx, ctl, group, sel, extract, selector)
+                pts = [p for p, _ in results]
+                truncated = False           # 各相機的截斷已在 collect_batch 提示
+            elif slot['stream'] is not None:
+                pts, truncated = slot.pop('streamed')
+            else:
+                t_parse = time.perf_counter_ns()
+                pts, truncated = backend.collect(slot, extract)
+                pts = apply_threshold(ctx, ctl, slot, pts, extract, truncated)
+                t['parse'] = time.perf_counter_ns() - t_parse
+                pts = select_corners(selector, pts, H, W, sel, t)
+            t_done = time.perf_counter()
+            # latency：收完 payload -> parse 完成；FPS：相鄰兩張完成的間隔 (throughput)
+            lat_ms = (t_done - slot['t_rx']) * 1000.0
+            itv_ms = (t_done - t_prev) * 1000.0 if t_prev is not None else lat_ms
+            t_prev = t_done
+
+            if stats['count'] > 0:
+                stats['total_ms'] += lat_ms
+            else:
+                stats['t_first'] = t_done
+            stats['t_last'] = t_done
+            stats['count'] += 1
+
+            N = len(pts) if group is None else sum(map(len, pts))
+            curr_fps = 1000.0 / itv_ms if itv_ms > 0 else 0
+            if not ctx['quiet']:
+                tag = _mode(status_tag, slot) + (f" x{len(group)}" if group is not None else "")
+                print(f"{stats['count']-1:<6} | {lat_ms:<10.2f} | {curr_fps:<8.1f} | {N:<8} | {tag:<6} #{cq.cid}")
+            if truncated and slot['stream'] is None:
+                print(f"[WARN] frame {stats['count']-1}: {extract.last_total} corners, truncated to {N} (--max-corners)")
+
+            if group is not None:
+                batch_times(group)
+                send_batch(conn, slot['req'], group, results, t)
+            elif slot['stream'] is None:
+                send_result(conn, slot['req'], pts, truncated, t, resp_hdr, H)
+            t['total'] = time.perf_counter_ns() - slot['t_got']
+            finish_frame(ctx, H, W, t, 1 if group is None else len(group))
+            if rec is not None:
+                for s, (p, tr) in zip(group, results) if group is not None else ((slot, (pts, truncated)),):
+                    record_frame(rec, slot['req'], s, p, tr, sel, slot['t_got'])
+            free_q.put(i)
+    except Exception as e:
+        errs.append(e)
+    finally:
+        # send 出錯時，讓卡在 recv / free_q 的 recv thread 醒來
+        if errs:
+            try: conn.shutdown(socket.SHUT_RDWR)
+            except: pass
+        free_q.put(None)
+
+def handle_client_pipelined(conn, addr, ctx):
+    depth = ctx['pipeline_depth']
+    sched = ctx['sched']
+    cq = open_session(conn, addr, ctx)
+    if cq is None: return
+    ring = [None] * depth
+    free_q = queue.Queue()
+    for i in range(depth): free_q.put(i)
+    stats = dict(total_ms=0.0, count=0, t_first=None, t_last=None)
+    errs = []
+    incr = None
+    incrs = {}
+    ctl = open_controller(ctx, cq)
+    rec = open_record(ctx, cq, addr)
+    e0 = ctx['energy'].snapshot() if ctx['energy'] is not None else None
+
+    th_tx = threading.Thread(target=_send_stage, args=(conn, ctx, cq, ring, free_q, stats, errs, ctl, rec),
+                             daemon=True)
+    try:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        print(f"[TCP] client #{cq.cid} {addr} connected (pipeline depth={depth})")
+        print(f"\n{'Frame':<6} | {'Time(ms)':<10} | {'FPS':<8} | {'N-Points':<8} | {'Mode':<6}")
+        print("-" * 55)
+        th_tx.start()
+
+        header = bytearray(REQ_V2.size + SEL_V2.size + BATCH_V2.size)
+        cam_hdr = bytearray(CAM_V2.size)
+
+        while not errs:
+            t_hdr = time.perf_counter_ns()
+            H, W, req = recv_request_header(conn, header)
+            if req is not None and req[1] & REQ_STATS:
+                sched.submit(cq, ('ctrl', req), None)
+                continue
+            hdr_ns = time.perf_counter_ns() - t_hdr
+
+            # ring 全滿時在這裡擋住 (不再讀 socket -> TCP backpressure)
+            i = free_q.get()
+            if i is None: break
+            if req is not None and req[3]:
+                # batch 佔 ring 的一格：這一格放 M 個 slot
+                cur, ring[i] = ring[i], None
+                ring[i] = group = _ensure_group(sched, cur, req[3], H, W)
+                t_rx = time.perf_counter_ns()
+                recv_batch(ctx, conn, req, group, cam_hdr, incrs)
+                slot = group[0]
+                slot['t_got'] = time.perf_counter_ns()
+                slot['t'] = {'hdr_rx': hdr_ns, 'payload_rx': slot['t_got'] - t_rx}
+                prepare_batch(ctx, ctl, req, group)
+                slot['t_rx'] = time.perf_counter()
+                slot['req'] = req
+                sched.submit(cq, (i, H, W), group)
+                continue
+            slot = _ensure_slot(sched, ring, i, H, W)
+
+            slot['incr'] = incr = incr_state(ctx, req, incr)
+            t_rx = time.perf_counter_ns()
+            ctx['backend'].receive(conn, slot, recv_exact_into)
+            slot['t_got'] = time.perf_counter_ns()
+            slot['t'] = {'hdr_rx': hdr_ns, 'payload_rx': slot['t_got'] - t_rx}
+            frame_threshold(ctx, ctl, slot)
+            slot['stream'] = stream_mode(ctx, req, slot)
+            ctx['backend'].prepare(slot)
+            slot['t_rx'] = time.perf_counter()
+            slot['req'] = req
+            sched.submit(cq, (i, H, W), slot)
+
+    except Exception as e:
+        if "EOF" not in str(e): print(f"[ERR] {e}")
+    finally:
+        # close 會等這個連線已送進 scheduler 的 frame 做完，之後才能釋放 ring
+        sched.close(cq)
+        if th_tx.is_alive(): th_tx.join()
+        for e in errs:
+            if "EOF" not in str(e): print(f"[ERR] {e}")
+        try: conn.close()
+        except: pass
+        for slot in ring: _free_entry(sched, slot)
+        close_controller(ctx, cq)
+        close_record(rec)
+        valid_frames = stats['count'] - 1
+        print("\n" + "="*40)
+        print(f"  Session Summary ({ctx['backend'].name}, pipeline x{depth}, client #{cq.cid})")
+        print("="*40)
+        if valid_frames > 0:
+            avg_ms = stats['total_ms'] / valid_frames
+            wall_s = stats['t_last'] - stats['t_first']
+            print(f"  Valid Frames (no 1st)  : {valid_frames}")
+            print(f"  >> Average Latency     : {avg_ms:.4f} ms")
+            if wall_s > 0:
+                print(f"  >> Throughput FPS      : {(valid_frames/wall_s):.2f} FPS")
+            print(f"  >> Board Busy (client) : {cq.busy_s*1000.0/max(cq.served, 1):.4f} ms/frame")
+        session_energy(ctx, e0)
+        print("="*40)
+        end_session_stats(ctx)
         print("="*40 + "\n")
 
 def main():
+    boot = StartupTimer(T_START)
+    boot.mark("imports")
     ap=argparse.ArgumentParser()
-    ap.add_argument("--bit", required=True, help="Path to bitstream")
+    ap.add_argument("--bit", help="Path to bitstream (required for --backend fpga)")
     ap.add_argument("--reset-per-frame", action="store_true", help="Reset VDMA per frame")
     ap.add_argument("--port", type=int, default=9092)
     ap.add_argument("--rst-base", type=lambda x:int(x,0), default=0)
-    ap.add_argument("--cpu", action="store_true", help="Run on ARM CPU (OpenCV)")
+    ap.add_argument("--backend", choices=["fpga", "cpu", "emu"], default="fpga",
+                    help="fpga: PL via VDMA, cpu: OpenCV on ARM, emu: bit-level software model of the IP")
+    ap.add_argument("--cpu", action="store_true", help="Run on ARM CPU (OpenCV), same as --backend cpu")
     ap.add_argument("--threshold", type=int, default=20, help="FAST threshold for CPU")
+    ap.add_argument("--cpu-threads", type=int, default=0,
+                    help="[cpu] threads / horizontal strips for FAST (0 = all cores)")
+    ap.add_argument("--pipeline-depth", type=int, default=1,
+                    help="Ring of in/out buffer pairs; >=2 overlaps recv / VDMA / parse of different frames")
+    ap.add_argument("--max-corners", type=int, default=0,
+                    help="Cap on corners returned per frame (0 = no cap); truncation is reported")
+    ap.add_argument("--top-k", type=int, default=0,
+                    help="Return only the K highest-score corners per frame (0 = all); REQ_SELECT overrides")
+    ap.add_argument("--grid", default=None, metavar="CxR",
+                    help="Bucket corners into a C x R grid and keep at most --per-cell per cell (highest score)")
+    ap.add_argument("--per-cell", type=int, default=1, help="[grid] corners kept per cell")
+    ap.add_argument("--strong-only", action="store_true", help="Return only corners with the is_strong bit")
+    ap.add_argument("--target-corners", default=None, metavar="LO:HI",
+                    help="Adjust the FAST threshold per connection, frame to frame, to keep the corner count in LO..HI")
+    ap.add_argument("--th-range", default=None, metavar="MIN:MAX",
+                    help="[target-corners] threshold bounds (default --fast-min-th:--fast-ini-th)")
+    ap.add_argument("--row-skip", action="store_true",
+                    help="Parse only up to the per-row TLAST word (bitstream built with TLAST_EACH_ROW=1)")
+    ap.add_argument("--wait", choices=["spin", "sleep", "uio"], default="spin",
+                    help="How to wait for VDMA IOC: busy spin, sleep from a per-resolution DMA estimate then spin, "
+                         "or block on a UIO interrupt")
+    ap.add_argument("--wait-margin", type=float, default=0.2,
+                    help="[sleep] fraction of the DMA estimate left for spinning")
+    ap.add_argument("--uio-dev", default=None, help="[uio] /dev/uioN bound to the VDMA s2mm_introut")
+    ap.add_argument("--quiet", action="store_true",
+                    help="No per-frame console line (printing costs time at high FPS)")
+    ap.add_argument("--stats-json", default=None, metavar="PATH",
+                    help="Write per-stage latency histograms (p50/p95/p99/max) as JSON at the end of every session")
+    ap.add_argument("--max-clients", type=int, default=8,
+                    help="Concurrent connections sharing the board; each holds its own buffers")
+    ap.add_argument("--weight", action="append", default=[], metavar="HOST=W",
+                    help="Scheduling weight for a client host (frames per round-robin turn), repeatable")
+    ap.add_argument("--cma-budget-mb", type=float, default=128,
+                    help="Buffers kept per resolution are evicted LRU above this many MB of CMA (0 = no limit)")
+    ap.add_argument("--prewarm", action="append", default=[], metavar="WxH[,WxH...]",
+                    help="Allocate pipeline-depth buffer pairs for these resolutions at startup, repeatable")
+    # emu backend：對應 top_fast_nms_to_dma 的 parameter
+    ap.add_argument("--fast-ini-th", type=int, default=20, help="[emu] FAST_INI_TH (strong threshold)")
+    ap.add_argument("--fast-min-th", type=int, default=7, help="[emu] FAST_MIN_TH (weak threshold)")
+    ap.add_argument("--nms-tie-mode", type=int, default=1, choices=[0, 1, 2], help="[emu] NMS_TIE_MODE")
+    ap.add_argument("--emu-as-built", action="store_true",
+                    help="[emu] simulate nms.v / the top cycle by cycle as the RTL is written (what the current "
+                         "bitstream outputs) instead of the designed 3x3 NMS; see rtl_compare.py")
+    ap.add_argument("--max-w", type=int, default=1024,
+                    help="MAX_W the IP was built with (fpga / emu); wider frames are processed in tiles")
+    ap.add_argument("--max-h", type=int, default=768,
+                    help="MAX_H the IP was built with (fpga / emu); taller frames are processed in tiles")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Recompute only tiles that changed since the previous frame, for every connection "
+                         "(v2 clients can also ask per frame with REQ_INCREMENTAL)")
+    ap.add_argument("--incr-tile", type=int, default=128, help="[incremental] tile size in pixels")
+    ap.add_argument("--incr-threshold", type=int, default=0,
+                    help="[incremental] pixel change |a-b| ignored up to this value (0 = same corners as a full recompute; on fpga/emu except frame rows y = 3, 4)")
+    ap.add_argument("--incr-full-ratio", type=float, default=0.5,
+                    help="[incremental] run the whole frame once when more than this fraction of tiles changed")
+    ap.add_argument("--stream-bands", type=int, default=8,
+                    help="[REQ_STREAM] row bands per frame whose corners are sent as soon as they are done")
+    ap.add_argument("--emu-line-us", type=float, default=0.0,
+                    help="[emu] simulated S2MM time per output line, so streamed frames arrive progressively")
+    ap.add_argument("--record", default=None, metavar="DIR",
+                    help="Record every connection (frames, returned corners, stage timings) to DIR/*.fslog "
+                         "for offline replay with session_log.py")
+    ap.add_argument("--record-dedup", action="store_true",
+                    help="[record] store identical frames once (hash per frame)")
+    ap.add_argument("--energy", action="store_true",
+                    help="Measure energy (hwmon / powercap power rails) and process CPU time per frame; "
+                         "frames/J and CPU-s/frame go to the session summary and REQ_STATS")
+    ap.add_argument("--power-root", default="/sys", metavar="DIR",
+                    help="[energy] sysfs root holding class/hwmon and class/powercap (a fake tree for testing)")
+    ap.add_argument("--power-rails", default=None, metavar="REGEX",
+                    help="[energy] only rails whose name (e.g. ina226_u79/VCCINT) matches")
+    ap.add_argument("--power-interval", type=float, default=0.05,
+                    help="[energy] sampling period of power*_input rails in seconds")
+    ap.add_argument("--warmup", choices=["none", "kernels", "frame"], default="kernels",
+                    help="Before listening: compile/load the numba kernels, and with 'frame' also push one dummy "
+                         "frame per --prewarm resolution (default 752x480) through the backend")
 
     args=ap.parse_args()
+    weights = {}
+    for kv in args.weight:
+        host, _, w = kv.rpartition("=")
+        if not host or not w.isdigit() or int(w) < 1: ap.error(f"--weight expects HOST=W, got {kv!r}")
+        weights[host] = int(w)
+    prewarm = []
+    for spec in ",".join(args.prewarm).split(","):
+        if not spec: continue
+        w, _, h = spec.lower().partition("x")
+        if not (w.isdigit() and h.isdigit()): ap.error(f"--prewarm expects WxH, got {spec!r}")
+        prewarm.append((int(h), int(w)))
+    cols = rows = 0
+    if args.grid:
+        c, _, r = args.grid.lower().partition("x")
+        if not (c.isdigit() and r.isdigit() and 0 < int(c) < 256 and 0 < int(r) < 256):
+            ap.error(f"--grid expects CxR (1..255), got {args.grid!r}")
+        cols, rows = int(c), int(r)
+    kind = "cpu" if args.cpu else args.backend
+    adaptive = None
+    if args.target_corners:
+        def pair(spec, name):
+            a, _, b = spec.partition(":")
+            if not (a.isdigit() and b.isdigit() and int(a) <= int(b)):
+                ap.error(f"{name} expects A:B with A <= B, got {spec!r}")
+            return int(a), int(b)
+        lo, hi = pair(args.target_corners, "--target-corners")
+        th_min, th_max = pair(args.th_range or f"{args.fast_min_th}:{args.fast_ini_th}", "--th-range")
+        # cpu 從 --threshold 開始；fpga / emu 從 th_min (全部保留) 開始往上調
+        adaptive = dict(lo=lo, hi=hi, th_min=th_min, th_max=th_max,
+                        th0=args.threshold if kind == "cpu" else th_min)
+    if kind == "fpga" and not args.bit:
+        ap.error("--bit is required for --backend fpga")
 
-    print(f"[Init] Loading bitstream: {args.bit} ...")
-    ol=Overlay(args.bit); ol.download()
-    
     mmio = None
     rst_mmio = None
 
-    if not args.cpu:
+    if args.bit:
+        from pynq import Overlay, MMIO
+        print(f"[Init] Loading bitstream: {args.bit} ...")
+        ol=Overlay(args.bit); ol.download()
+
+    if kind == "fpga":
         print("[Init] Mode: FPGA Hardware Acceleration")
         vdma_name = [k for k in ol.ip_dict.keys() if "vdma" in k.lower()][0]
         mmio = MMIO(ol.ip_dict[vdma_name]["phys_addr"], ol.ip_dict[vdma_name]["addr_range"])
+    elif kind == "cpu":
+        print(f"[Init] Mode: ARM CPU (OpenCV Software, {args.cpu_threads or os.cpu_count()} threads)")
     else:
-        print(f"[Init] Mode: ARM CPU (OpenCV Software)")
+        print(f"[Init] Mode: Software model of top_fast_nms_to_dma (fast_emu)")
 
     ctx=dict(
-        mmio=mmio, cur_shape=None, in_buf=None, out_buf=None,
+        mmio=mmio,
         timeout=2.0, 
         reset_per_frame=args.reset_per_frame,
         rst_mmio=rst_mmio, rst_mask=1, rst_on=1, rst_off=0, rst_hold=0.00002,
-        rx_buf=None, rx_mv=None,
-        use_cpu=args.cpu,
-        cpu_th=args.threshold
+        pipeline_depth=max(1, args.pipeline_depth),
+        max_corners=args.max_corners, row_skip=args.row_skip,
+        quiet=args.quiet, stats_json=args.stats_json, lat=LatencyStats(),
+        incremental=args.incremental,
+        select=(args.top_k, args.per_cell if cols else 0, cols, rows, args.strong_only),
+        adaptive=adaptive, controllers={},
+        record=args.record, record_dedup=args.record_dedup,
+        stream_bands=max(1, args.stream_bands), energy=None
     )
+    waiter = None
+    if kind == "fpga":
+        from ioc_wait import make_waiter
+        waiter = make_waiter(args.wait, uio_dev=args.uio_dev, margin=args.wait_margin)
+        print(f"[Init] IOC wait: {waiter.name}")
+    ctx['backend'] = make_backend(kind, mmio=mmio, timeout=ctx['timeout'], waiter=waiter,
+                                  reset_per_frame=args.reset_per_frame, threshold=args.threshold,
+                                  cpu_threads=args.cpu_threads, max_shape=(args.max_h, args.max_w),
+                                  emu_params=dict(MAX_W=args.max_w, MAX_H=args.max_h,
+                                                  line_ns=int(args.emu_line_us * 1000),
+                                                  FAST_INI_TH=args.fast_ini_th, FAST_MIN_TH=args.fast_min_th,
+                                                  NMS_TIE_MODE=args.nms_tie_mode,
+                                                  AS_BUILT=int(args.emu_as_built)),
+                                  incr_params=dict(tile=args.incr_tile, threshold=args.incr_threshold,
+                                                   full_ratio=args.incr_full_ratio))
+    ctx['native_threshold'] = bool(getattr(ctx['backend'], 'native_threshold', False))
+    if adaptive is not None:
+        print(f"[Init] Adaptive threshold: {adaptive['lo']}..{adaptive['hi']} corners, "
+              f"threshold {adaptive['th_min']}..{adaptive['th_max']} "
+              f"({'FAST threshold' if ctx['native_threshold'] else 'score filter after the IP'})")
+    pool = SlotPool(ctx['backend'], budget_bytes=args.cma_budget_mb * 2**20)
+    if prewarm:
+        print(f"[Init] Prewarm: {pool.prewarm(prewarm, count=ctx['pipeline_depth'])}")
+    boot.mark("backend")
+    # scheduler 還沒起來，這裡的 frame 不經過 scheduler、也不計入延遲統計
+    if args.warmup != "none":
+        warm_kernels(ctx)
+        boot.mark("kernels")
+    if args.warmup == "frame":
+        dummy_frames(ctx, pool, prewarm or [(480, 752)])
+        boot.mark("dummy frame")
+    ctx['startup'] = boot.snapshot()
+    print(f"[Init] Ready in {boot.summary()}")
+    if args.energy:
+        # warm-up 之後才開始算，累計值 (REQ_STATS 的 "energy") 不含開機
+        rails = find_rails(args.power_root, args.power_rails)
+        ctx['energy'] = EnergyMeter(rails, args.power_interval)
+        names = ", ".join(r.name for r in rails if r.in_total)
+        print(f"[Init] Energy: {names or f'no power rails under {args.power_root}, CPU time only'}")
+    # 板子只有一個 owner：所有連線的 frame 都排進這個 scheduler
+    ctx['sched'] = HwScheduler(ctx['backend'], max_clients=max(1, args.max_clients), weights=weights,
+                               pool=pool)
+    handler = handle_client_pipelined if ctx['pipeline_depth'] > 1 else handle_client
 
     with socket.socket(socket.AF_INET,socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
-        s.bind(("0.0.0.0", args.port)); s.listen(1)
+        s.bind(("0.0.0.0", args.port)); s.listen(ctx['sched'].max_clients)
         print(f"[TCP] Listening on {args.port} ...")
         while True:
             conn,addr=s.accept()
-            th=threading.Thread(target=handle_client,args=(conn,addr,ctx),daemon=True)
+            th=threading.Thread(target=handler,args=(conn,addr,ctx),daemon=True)
             th.start()
 
 if __name__=="__main__":
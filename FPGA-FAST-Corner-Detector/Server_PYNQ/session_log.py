@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# session_log.py  -  server 連線的錄製 (--record DIR) 與離線重播
+#
+# 現場的效能問題要有同一批 frame 和板子才重現得出來。server --record 把每個
+# 連線寫成一個只往後追加的 binary log (DIR/<時間>-c<cid>.fslog)，加上一個
+# 可以 seek 的 index (同名 .idx，每筆 record 的 offset，<Q)：
+#   檔頭  FILE_HDR (magic, version, meta 長度) + meta JSON
+#         (backend、peer、row_skip / max_corners、stage 名稱順序 ...)
+#   每張  REC header + 各 stage 時間 (int64 ns，-1 = 這張沒有這個 stage)
+#         + 影像 (H*W bytes，M_PIX) + 回傳的角點 (N x 4 '<u2'，就是封包 body)
+# --record-dedup 時，跟之前某張完全相同的影像不再寫一次，pix_off 指回第一次
+# 寫的位置 (靜止畫面 / 重送的 frame)。
+# 重播用 mmap 讀 (影像直接是檔案上的 view)，依錄到的 mode / threshold / 挑選
+# 條件走任一個 backend，可照錄製時的節奏或全速，最後與原本的 log 比對角點
+# 與各 stage 的延遲分布：
+#   python3 session_log.py info  rec/20250101-120000-c1.fslog
+#   python3 session_log.py replay rec/...fslog --backend emu [--speed recorded] [--save out.fslog]
+#   python3 session_log.py diff  a.fslog b.fslog
+# index 缺少或沒寫完 (server 被砍掉) 時，從頭掃 record 重建。
+# ============================================================================
+import os, json, time, struct, mmap, hashlib, argparse
+import numpy as np
+from latency import STAGES, LatencyStats
+
+MAGIC = b"FSLG"
+LOG_VERSION = 1
+FILE_HDR = struct.Struct("<4sHI")                   # magic, version, meta JSON 長度
+# rec_len, fid, mode, n_stage, H, W, threshold, top_k, per_cell, cols, rows, t_rx, pix_off, N
+REC = struct.Struct("<IIBBHHHIHBBQQI")
+IDX = struct.Struct("<Q")
+
+M_V1     = 0x01     # v1 client (沒有 frame id / flags)
+M_INCR   = 0x02     # 這張走 incremental
+M_TRUNC  = 0x04     # 回應被 --max-corners 截斷
+M_SEL    = 0x08     # 有挑選 (top_k / per_cell / cols / rows 有效)
+M_STRONG = 0x10     # strong-only
+M_PIX    = 0x20     # 影像跟在這筆 record 裡 (否則 pix_off 指向之前的 record)
+
+class SessionWriter:
+    def __init__(self, path, meta, dedup=False):
+        self.path = path
+        self.f = open(path, "wb")
+        self.idx = open(path + ".idx", "wb")
+        self.dedup = {} if dedup else None      # blake2b(影像) -> pix_off
+        self.stages = list(meta.get('stages', STAGES))
+        body = json.dumps(dict(meta, stages=self.stages)).encode()
+        self.f.write(FILE_HDR.pack(MAGIC, LOG_VERSION, len(body)) + body)
+        self.off = FILE_HDR.size + len(body)
+        self.t0 = None
+        self.frames = self.dup = 0
+        self.tv = np.empty(len(self.stages), dtype="<i8")
+
+    def add(self, fid, H, W, plane, pts, t, t_got, incr=False, truncated=False, threshold=None, sel=None):
+        # plane: (H, W) uint8；pts: 送出去的 (N, 4) '<u2'；t: stage 時間 (ns)；t_got: payload 收完的 perf_counter_ns
+        if self.t0 is None: self.t0 = t_got
+        mode = (M_V1 if fid is None else 0) | (M_INCR if incr else 0) | (M_TRUNC if truncated else 0)
+        top_k = per_cell = cols = rows = 0
+        if sel is not None:
+            top_k, per_cell, cols, rows, strong = sel
+            mode |= M_SEL | (M_STRONG if strong else 0)
+        for i, s in enumerate(self.stages):
+            self.tv[i] = t.get(s, -1)
+        head_len = REC.size + self.tv.nbytes
+        pix_off = self.off + head_len
+        key = None
+        if self.dedup is not None:
+            key = hashlib.blake2b(plane, digest_size=16).digest()
+            pix_off = self.dedup.get(key, pix_off)
+        own = pix_off == self.off + head_len
+        if own:
+            mode |= M_PIX
+            if key is not None: self.dedup[key] = pix_off
+        else:
+            self.dup += 1
+        rec_len = head_len + (plane.nbytes if own else 0) + pts.nbytes
+        self.f.write(REC.pack(rec_len, fid or 0, mode, len(self.stages), H, W, threshold or 0,
+                              top_k, per_cell, cols, rows, t_got - self.t0, pix_off, len(pts)))
+        self.f.write(self.tv.data)
+        # 0 個角點 (全黑 / 平坦的 frame) 時 memoryview 不能 cast，空的就不寫
+        if own and plane.size: self.f.write(memoryview(plane).cast('B'))
+        if len(pts): self.f.write(memoryview(np.ascontiguousarray(pts)).cast('B'))
+        self.idx.write(IDX.pack(self.off))
+        self.off += rec_len
+        self.frames += 1
+
+    def close(self):
+        self.f.close(); self.idx.close()
+
+class SessionLog:
+    """用 mmap 開一個 .fslog：len() / [i] -> dict (影像與角點都是檔案上的 view)。"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, ver, n = FILE_HDR.unpack_from(self.mm, 0)
+        if magic != MAGIC or ver != LOG_VERSION:
+            raise ValueError(f"{path}: not a session log (version {LOG_VERSION})")
+        self.meta = json.loads(bytes(self.mm[FILE_HDR.size:FILE_HDR.size + n]))
+        self.stages = self.meta['stages']
+        self.offsets = self._index(FILE_HDR.size + n)
+
+    def _index(self, first):
+        size = len(self.mm)
+        idx = self.path + ".idx"
+        if os.path.exists(idx):
+            offs = np.fromfile(idx, dtype="<u8")
+            if len(offs) and offs[-1] + REC.size <= size and \
+               offs[-1] + REC.unpack_from(self.mm, int(offs[-1]))[0] <= size:
+                return offs
+        # 沒有 index 或最後一筆不完整：從頭掃
+        offs, off = [], first
+        while off + REC.size <= size:
+            rec_len = REC.unpack_from(self.mm, off)[0]
+            if off + rec_len > size: break
+            offs.append(off); off += rec_len
+        return np.array(offs, dtype="<u8")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        off = int(self.offsets[i])
+        (rec_len, fid, mode, ns, H, W, th, top_k, per_cell, cols, rows,
+         t_rx, pix_off, N) = REC.unpack_from(self.mm, off)
+        tv = np.frombuffer(self.mm, dtype="<i8", count=ns, offset=off + REC.size)
+        pts_off = off + rec_len - N * 8
+        return dict(
+            fid=None if mode & M_V1 else fid, H=H, W=W, t_rx=t_rx,
+            incr=bool(mode & M_INCR), truncated=bool(mode & M_TRUNC), threshold=th or None,
+            sel=(top_k, per_cell, cols, rows, bool(mode & M_STRONG)) if mode & M_SEL else None,
+            t={s: int(v) for s, v in zip(self.stages, tv) if v >= 0},
+            plane=np.frombuffer(self.mm, dtype=np.uint8, count=H * W, offset=pix_off).reshape(H, W),
+            pts=np.frombuffer(self.mm, dtype="<u2", count=N * 4, offset=pts_off).reshape(N, 4))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def latency(self):
+        lat = LatencyStats()
+        for r in self:
+            lat.add_frame(self.meta['backend'], r['H'], r['W'], r['t'])
+        return lat
+
+    def close(self):
+        self.mm.close()
+
+# ================= 比對 =================
+def diff_corners(pairs):
+    # (pts_a, pts_b) 逐張比：完全相同的張數、只出現在一邊的 (x, y)、同位置 score 不同的個數
+    n = same = only_a = only_b = score = 0
+    for pa, pb in pairs:
+        n += 1
+        if pa.shape == pb.shape and np.array_equal(pa, pb):
+            same += 1; continue
+        ka = pa[:, 1].astype(np.int64) << 16 | pa[:, 0]
+        kb = pb[:, 1].astype(np.int64) << 16 | pb[:, 0]
+        common, ia, ib = np.intersect1d(ka, kb, return_indices=True)
+        only_a += len(ka) - len(common); only_b += len(kb) - len(common)
+        score += int(np.count_nonzero(pa[ia, 3] != pb[ib, 3]))
+    return dict(frames=n, identical=same, only_a=only_a, only_b=only_b, score_diff=score)
+
+def diff_latency(sa, sb):
+    # 兩份 LatencyStats.snapshot()：兩邊都有的 (解析度, stage) -> (res, stage, a, b)
+    per_a = {res: st for per in sa.values() for res, st in per.items()}
+    per_b = {res: st for per in sb.values() for res, st in per.items()}
+    return [(res, s, da, per_b[res][s]) for res in per_a if res in per_b
+            for s, da in per_a[res].items() if s in per_b[res]]
+
+def print_diff(d, sa, sb, name_a, name_b):
+    print(f"[Diff] corners: {d['identical']}/{d['frames']} frames identical, "
+          f"{d['only_a']} only in {name_a}, {d['only_b']} only in {name_b}, {d['score_diff']} score differences")
+    rows = diff_latency(sa, sb)
+    if not rows: return
+    print(f"[Diff] latency (ms), {name_a} / {name_b}")
+    print(f"  {'res':<9} {'stage':<11} {'p50':>17} {'p95':>17} {'p99':>17} {'p50 ratio':>9}")
+    for res, st, da, db in rows:
+        cells = " ".join(f"{da[q]:>8.3f}/{db[q]:<8.3f}" for q in ('p50', 'p95', 'p99'))
+        ratio = f"x{db['p50'] / da['p50']:.2f}" if da['p50'] > 0 else "-"
+        print(f"  {res:<9} {st:<11} {cells} {ratio:>9}")
+
+# ================= 重播 =================
+def replay(log, backend, speed="max", save=None, max_corners=0, row_skip=None):
+    """log 的每張 frame 走一次 backend (照錄到的 incremental / threshold / 挑選)。
+    speed="recorded" 時依錄製時 payload 收完的時間點送入。save：重播結果另存成 log。"""
+    from corners import CornerExtractor, CornerSelector
+    from incremental import IncrState
+    from adaptive import filter_score
+    from bufpool import SlotPool
+    meta = log.meta
+    row_skip = meta.get('row_skip', False) if row_skip is None else row_skip
+    extract = CornerExtractor(max_corners=max_corners or meta.get('max_corners', 0), row_skip=row_skip)
+    selector = CornerSelector()
+    native = bool(getattr(backend, 'native_threshold', False))
+    pool = SlotPool(backend)
+    out = None
+    if save:
+        out = SessionWriter(save, dict(meta, backend=backend.name, replay_of=os.path.abspath(log.path)))
+    slot = None
+    incr = None
+    t_start = time.perf_counter_ns()
+    try:
+        for r in log:
+            H, W = r['H'], r['W']
+            if speed == "recorded":
+                wait = (t_start + r['t_rx'] - time.perf_counter_ns()) / 1e9
+                if wait > 0: time.sleep(wait)
+            if slot is None or slot['shape'] != (H, W):
+                if slot is not None: pool.release(slot)
+                slot = pool.acquire(H, W)
+            slot['plane'][:] = r['plane']        # 對應 payload_rx，不計時 (沒有網路)
+            t_got = time.perf_counter_ns()
+            t = slot['t'] = {}
+            incr = (incr or IncrState()) if r['incr'] else None
+            slot['incr'] = incr
+            th = r['threshold']
+            slot['threshold'] = th if native else None
+            backend.prepare(slot)
+            backend.run(slot)
+            t0 = time.perf_counter_ns()
+            pts, truncated = backend.collect(slot, extract)
+            if th is not None and not native: pts = filter_score(pts, th)
+            t['parse'] = time.perf_counter_ns() - t0
+            if r['sel'] is not None:
+                t0 = time.perf_counter_ns()
+                pts = selector(pts, H, W, r['sel'])
+                t['select'] = time.perf_counter_ns() - t0
+            t['total'] = time.perf_counter_ns() - t_got
+            if out is not None:
+                out.add(r['fid'], H, W, slot['plane'], pts, t, t_got, incr=r['incr'],
+                        truncated=truncated, threshold=th, sel=r['sel'])
+            yield r, pts, t
+    finally:
+        if slot is not None: pool.release(slot)
+        if out is not None: out.close()
+
+def _make_backend(args):
+    from backends import make_backend
+    mmio = None
+    if args.backend == "fpga":
+        from pynq import Overlay, MMIO
+        ol = Overlay(args.bit); ol.download()
+        vdma_name = [k for k in ol.ip_dict.keys() if "vdma" in k.lower()][0]
+        mmio = MMIO(ol.ip_dict[vdma_name]["phys_addr"], ol.ip_dict[vdma_name]["addr_range"])
+    return make_backend(args.backend, mmio=mmio, threshold=args.threshold, max_shape=(args.max_h, args.max_w),
+                        emu_params=dict(MAX_W=args.max_w, MAX_H=args.max_h))
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect, replay and compare recorded server sessions")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    i = sub.add_parser("info", help="Summarize a session log")
+    i.add_argument("log")
+    r = sub.add_parser("replay", help="Run a session log through a backend and compare with the recording")
+    r.add_argument("log")
+    r.add_argument("--backend", choices=["fpga", "cpu", "emu"], default="emu")
+    r.add_argument("--bit", help="[fpga] bitstream")
+    r.add_argument("--threshold", type=int, default=20, help="[cpu] FAST threshold")
+    r.add_argument("--max-w", type=int, default=1024, help="[fpga/emu] MAX_W of the IP")
+    r.add_argument("--max-h", type=int, default=768, help="[fpga/emu] MAX_H of the IP")
+    r.add_argument("--speed", choices=["max", "recorded"], default="max",
+                   help="Feed frames back to back, or at the pace they arrived in the recording")
+    r.add_argument("--save", default=None, metavar="PATH", help="Also write the replay as a session log")
+    d = sub.add_parser("diff", help="Compare corners and latency of two session logs")
+    d.add_argument("a"); d.add_argument("b")
+    args = ap.parse_args()
+
+    if args.cmd == "info":
+        log = SessionLog(args.log)
+        m = log.meta
+        res = sorted({f"{x['W']}x{x['H']}" for x in log})
+        dur = (log[len(log) - 1]['t_rx'] / 1e9) if len(log) else 0.0
+        print(f"{args.log}: {len(log)} frames over {dur:.2f} s, {', '.join(res)}, backend {m['backend']}, "
+              f"client {m.get('peer')}, {os.path.getsize(args.log) / 2**20:.1f} MB")
+        print(log.latency().format_table())
+    elif args.cmd == "replay":
+        if args.backend == "fpga" and not args.bit:
+            ap.error("--bit is required for --backend fpga")
+        log = SessionLog(args.log)
+        backend = _make_backend(args)
+        from startup import warm_kernels        # 第一張不要算到編譯時間
+        warm_kernels(dict(backend=backend, row_skip=log.meta.get('row_skip', False)))
+        lat = LatencyStats()
+        def pairs():
+            for rec, pts, t in replay(log, backend, speed=args.speed, save=args.save):
+                lat.add_frame(backend.name, rec['H'], rec['W'], t)
+                yield rec['pts'], pts
+        t0 = time.perf_counter()
+        d = diff_corners(pairs())
+        wall = time.perf_counter() - t0
+        print(f"[Replay] {d['frames']} frames through {backend.name} in {wall:.2f} s "
+              f"({d['frames'] / max(wall, 1e-9):.1f} FPS, speed {args.speed})")
+        print_diff(d, log.latency().snapshot(), lat.snapshot(), "recorded", "replay")
+    else:
+        a, b = SessionLog(args.a), SessionLog(args.b)
+        if len(a) != len(b):
+            print(f"[Diff] {len(a)} vs {len(b)} frames, comparing the first {min(len(a), len(b))}")
+        d = diff_corners((x['pts'], y['pts']) for x, y in zip(a, b))
+        print_diff(d, a.latency().snapshot(), b.latency().snapshot(), args.a, args.b)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# startup.py  -  server 開起來到能收第一張 frame 的準備 (--warmup)
+#
+# 以前第一張 frame 要等 numba 編譯 (session 統計與 benchmark 都把它丟掉)，
+# 開 server 也要先 import numba / cv2 / pynq。現在：
+#   - 只 import 選到的 backend 用得到的模組：pynq 只在 --bit、cv2 只在 cpu
+#     (cpu_fast)、fast_emu 只在 emu；numba 到 warm-up 或第一次 parse 才載入
+#     (見 corners.py 的 _jit)
+#   - kernels：這個 backend 會用到的 numba kernel 在開 server 時編譯好；
+#     cache=True 存在 __pycache__，重開時只是從磁碟載入
+#   - frame：再用 pool 配好 buffer，把一張 dummy frame 走完整個 backend
+#     (prepare / run / collect)，VDMA、CMA、cv2 的第一次呼叫都在這裡發生
+# 各階段與總共的 time-to-ready 印在 [Init]，也放在 REQ_STATS 的 JSON
+# ("startup")。
+# ============================================================================
+import time
+import numpy as np
+
+class StartupTimer:
+    def __init__(self, t0):
+        self.t0 = self.last = t0        # t0：server.py 開始 import 的時間
+        self.phases = {}
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self.last
+        self.last = now
+
+    def snapshot(self):
+        return dict(ready_s=round(self.last - self.t0, 4),
+                    phases={k: round(v, 4) for k, v in self.phases.items()})
+
+    def summary(self):
+        parts = ", ".join(f"{k} {v:.2f}" for k, v in self.phases.items())
+        return f"{self.last - self.t0:.2f} s ({parts})"
+
+def _test_words(H, W):
+    # 幾個 strong / weak 角點的 output word，讓 parse 的兩個 kernel 都會跑到
+    words = np.zeros((H, W), dtype=np.uint64)
+    for y, x, strong in ((H // 2, W // 3, 1), (H // 2, 2 * W // 3, 0)):
+        words[y, x] = (y << 48) | (x << 32) | (strong << 10) | 30
+    return words
+
+def warm_kernels(ctx):
+    """編譯 (或從 cache 載入) 這個 backend 會用到的 numba kernel。"""
+    from corners import CornerExtractor, CornerSelector
+    backend = ctx['backend']
+    if not getattr(backend, 'native_threshold', False):
+        # fpga / emu：out_buf -> records (raster 掃描 + row_skip 版本同一個 kernel)
+        CornerExtractor(row_skip=ctx['row_skip']).records(_test_words(16, 32))
+    if backend.name == "FPGA":
+        # fpga：收 payload 時把列展開進 in_buf (FpgaBackend.receive)
+        from vdma import expand_rows
+        expand_rows(np.zeros((2, 32), dtype=np.uint8), np.zeros((2, 32), dtype=np.uint64), 0, 2, 32)
+    model = getattr(backend, 'model', None)
+    if model is not None:
+        # emu：fast_emu 的 FAST / NMS kernel
+        model.run(np.zeros((16, 32), dtype=np.uint8), np.zeros((16, 32), dtype=np.uint64))
+    # 挑選 (REQ_SELECT 隨時可能來，所以不管 --top-k 有沒有設都先編好)
+    pts = CornerExtractor().records(_test_words(16, 32))[0].copy()
+    CornerSelector()(pts, 16, 32, (1, 1, 2, 2, True))
+
+def dummy_frames(ctx, pool, shapes):
+    """每個解析度用 pool 的 slot 跑一張雜訊 frame (不計入延遲統計)。"""
+    from corners import CornerExtractor
+    backend = ctx['backend']
+    extract = CornerExtractor(max_corners=ctx['max_corners'], row_skip=ctx['row_skip'])
+    rng = np.random.default_rng(0)
+    for H, W in shapes:
+        slot = pool.acquire(H, W)
+        try:
+            slot['plane'][:] = rng.integers(0, 256, (H, W), dtype=np.uint8)
+            slot['t'] = {}; slot['incr'] = None; slot['threshold'] = None
+            backend.prepare(slot)
+            backend.run(slot)
+            backend.collect(slot, extract)
+        finally:
+            pool.release(slot)
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# sweep.py  -  參數掃描：各 backend / 設定的速度與角點品質，一張表比完
+#
+# FAST_INI_TH / FAST_MIN_TH / NMS_TIE_MODE 與 cpu 的 --threshold 以前都是
+# 憑感覺調。這裡把一組 frame 依序送進選到的 backend (與 server 同一條
+# make_backend 路徑，在 process 內跑、不經網路)，每個設定量：
+#   corners   每張平均角點數
+#   repeat    repeatability：同一張平移 --shift、加上 +-(--noise) 的雜訊後再跑一次，
+#             兩邊共同區域內位置對得上的比例 (matched / min(n1, n2))
+#   precision / recall
+#             對參考 (OpenCV FAST，--ref-threshold，nonmaxSuppression=True)：
+#             matched / 這個設定的角點數、matched / 參考的角點數
+#   p50 / p95 / p99
+#             每張 prepare -> run -> collect (含 score 過濾) 的延遲 (ms)
+# 「對得上」= 距離 <= --tol pixel 的一對一配對 (match_points：格子邊長 >= tol
+# 的 spatial grid，3x3 格的候選用 searchsorted 一次展開，再依距離貪婪配對)。
+# 離影像邊 --border 以內的角點不算 (emu 的 line buffer 會把上一張帶進前幾列)。
+#
+# 掃描的參數：
+#   emu   --ini-th x --min-th x --tie-mode x --score-th (fast_emu 的 RTL 參數)
+#   fpga  --score-th (INI/MIN/TIE 是合成時就定的，只能在 host 端過濾 score)
+#   cpu   --threshold (cpu_fast 的 FAST threshold)
+# emu 的延遲是軟體模型的時間，只能互相比；真正的硬體延遲要 --backends fpga。
+# --min-recall / --min-precision / --min-repeat 給了品質門檻時，最後印出
+# 達標的設定裡 --rank (預設 p50) 最快的那一個。
+#   python3 sweep.py --source synthetic --backends emu,cpu --frames 20
+#   python3 sweep.py --source ~/EuRoc/MH01/mav0/cam0/data --backends fpga,cpu --bit fast.bit \
+#       --score-th 0,10,20 --threshold 10,20,30 --min-recall 0.8 --json sweep.json
+#   --source 也可以是 session_log.py 錄的 .fslog (用錄到的影像)。
+# ============================================================================
+import os, csv, glob, json, time, argparse, itertools
+import numpy as np
+
+# ================= 角點配對 =================
+def match_points(a, b, tol):
+    """a, b: (N, 2) 的 (x, y)。距離 <= tol 的一對一配對 -> (ia, ib)，
+    依距離由近到遠貪婪決定 (每輪取「a 最近的 b 也是 b 最近的 a」的那些對)。"""
+    a = np.asarray(a, dtype=np.int64); b = np.asarray(b, dtype=np.int64)
+    none = np.empty(0, dtype=np.int64)
+    if len(a) == 0 or len(b) == 0:
+        return none, none
+    cell = max(1, int(np.ceil(tol)))        # 格子邊長 >= tol：候選只會在周圍 3x3 格
+    ca, cb = a // cell, b // cell
+    S = int(max(ca[:, 0].max(), cb[:, 0].max())) + 3
+    kb = (cb[:, 1] + 1) * S + cb[:, 0] + 1
+    order = np.argsort(kb, kind="stable")
+    kb = kb[order]
+    ia, ib = [], []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            k = (ca[:, 1] + 1 + dy) * S + ca[:, 0] + 1 + dx
+            lo = np.searchsorted(kb, k, "left")
+            n = np.searchsorted(kb, k, "right") - lo
+            tot = int(n.sum())
+            if not tot: continue
+            start = np.repeat(lo - (np.cumsum(n) - n), n)       # 每段 [lo, hi) 攤平
+            ia.append(np.repeat(np.arange(len(a)), n))
+            ib.append(order[start + np.arange(tot)])
+    if not ia:
+        return none, none
+    ia, ib = np.concatenate(ia), np.concatenate(ib)
+    d2 = ((a[ia] - b[ib]) ** 2).sum(axis=1)
+    keep = d2 <= tol * tol
+    ia, ib, d2 = ia[keep], ib[keep], d2[keep]
+    o = np.lexsort((ib, ia, d2))
+    ia, ib = ia[o], ib[o]
+    out_a, out_b = [], []
+    while len(ia):
+        _, f = np.unique(ia, return_index=True)     # 各 a 最近的候選 (已依距離排序)
+        f = np.sort(f)
+        _, g = np.unique(ib[f], return_index=True)  # 其中各 b 最近的 a
+        take = f[g]
+        out_a.append(ia[take]); out_b.append(ib[take])
+        used_a = np.zeros(len(a), dtype=bool); used_a[ia[take]] = True
+        used_b = np.zeros(len(b), dtype=bool); used_b[ib[take]] = True
+        rest = ~(used_a[ia] | used_b[ib])
+        ia, ib = ia[rest], ib[rest]
+    if not out_a:
+        return none, none
+    return np.concatenate(out_a), np.concatenate(out_b)
+
+def inside(pts, x0, y0, x1, y1):
+    # (N, 4) records 中 x0 <= x < x1、y0 <= y < y1 的
+    x, y = pts[:, 0], pts[:, 1]
+    return pts[(x >= x0) & (x < x1) & (y >= y0) & (y < y1)]
+
+# ================= frame 來源 =================
+def synthetic_frames(W, H, n, seed=0):
+    # 模糊過的隨機紋理 (角點分布像自然影像，不是只有矩形的四個角)，
+    # 每張往下 1 px、往右 2 px (像相機慢慢移動)，再加每張不同的感測器雜訊
+    import cv2
+    rng = np.random.default_rng(seed)
+    pad = 2 * n + 8
+    scene = cv2.GaussianBlur(rng.integers(0, 256, size=(H + pad, W + pad)).astype(np.float32), (0, 0), 3)
+    scene = np.clip((scene - scene.mean()) * 6 + 128, 0, 253).astype(np.uint8)
+    frames = []
+    for k in range(n):
+        img = scene[k:k + H, 2 * k:2 * k + W].copy()
+        img += rng.integers(0, 3, size=(H, W), dtype=np.uint8)
+        frames.append(img)
+    return frames
+
+def load_frames(source, n, size=None):
+    """'synthetic'、影像資料夾或 .fslog -> (H, W) uint8 list；size=(W, H) 時縮放。"""
+    if source == "synthetic":
+        W, H = size or (640, 480)
+        return synthetic_frames(W, H, n)
+    if source.endswith(".fslog"):
+        from session_log import SessionLog
+        log = SessionLog(source)
+        frames = [np.array(log[i]['plane']) for i in range(min(n, len(log)))]
+    else:
+        import cv2
+        exts = ['*.png', '*.jpg', '*.jpeg', '*.pgm']
+        files = sorted(f for e in exts for f in glob.glob(os.path.join(source, e)))[:n]
+        frames = [f for f in (cv2.imread(p, cv2.IMREAD_GRAYSCALE) for p in files) if f is not None]
+    if not frames:
+        raise SystemExit(f"no frames in {source}")
+    if size is not None:
+        import cv2
+        frames = [f if f.shape == size[::-1] else cv2.resize(f, size, interpolation=cv2.INTER_AREA)
+                  for f in frames]
+    return [np.ascontiguousarray(f) for f in frames]
+
+def shifted(img, dx, dy, noise=0, rng=None):
+    # 內容往右下移 (dx, dy)；空出來的邊用最近的 pixel 補 (不算在共同區域內)。
+    # noise > 0 時每個 pixel 再加 [-noise, noise] 的均勻雜訊
+    H, W = img.shape
+    out = np.empty_like(img)
+    out[dy:, dx:] = img[:H - dy, :W - dx]
+    out[:dy, dx:] = out[dy:dy + 1, dx:]
+    out[:, :dx] = out[:, dx:dx + 1]
+    if noise:
+        n = (rng or np.random.default_rng()).integers(-noise, noise + 1, size=(H, W))
+        out = np.clip(out + n, 0, 255).astype(np.uint8)
+    return out
+
+def reference(frames, threshold):
+    # OpenCV FAST 直接跑，轉成線上的角點格式 (backends.run_cpu_fast)；detector 共用一個
+    import cv2
+    from backends import run_cpu_fast
+    fast = cv2.FastFeatureDetector_create(threshold=threshold, nonmaxSuppression=True)
+    return [run_cpu_fast(f, threshold, fast) for f in frames]
+
+# ================= 設定與執行 =================
+def configs(args):
+    # -> [(backend kind, label, make_backend 參數, host 端 score threshold)]
+    out = []
+    for kind in args.backends:
+        if kind == "cpu":
+            for th in args.threshold:
+                out.append((kind, f"th={th}", dict(threshold=th, cpu_threads=args.cpu_threads), None))
+        elif kind == "emu":
+            for ini, mn, tie, sth in itertools.product(args.ini_th, args.min_th, args.tie_mode, args.score_th):
+                if mn > ini: continue
+                p = dict(MAX_W=args.max_w, MAX_H=args.max_h, FAST_INI_TH=ini, FAST_MIN_TH=mn, NMS_TIE_MODE=tie)
+                out.append((kind, f"ini={ini} min={mn} tie={tie} score>={sth}", dict(emu_params=p), sth or None))
+        else:
+            for sth in args.score_th:
+                out.append((kind, f"score>={sth}", dict(max_shape=(args.max_h, args.max_w)), sth or None))
+    return out
+
+class Runner:
+    """一個設定的 backend：run(img) -> (pts, ns)，slot 依解析度各配一組。"""
+    def __init__(self, backend, score_th=None):
+        from corners import CornerExtractor
+        self.backend = backend
+        self.score_th = score_th
+        self.extract = CornerExtractor()
+        self.slots = {}
+
+    def run(self, img):
+        from adaptive import filter_score
+        be = self.backend
+        slot = self.slots.get(img.shape)
+        if slot is None:
+            slot = self.slots[img.shape] = be.alloc_slot(*img.shape)
+        slot['plane'][:] = img          # 對應 payload_rx，不計時
+        slot['t'] = {}; slot['incr'] = None; slot['threshold'] = None; slot['stream'] = None
+        t0 = time.perf_counter_ns()
+        be.prepare(slot)
+        be.run(slot)
+        pts, _ = be.collect(slot, self.extract)
+        if self.score_th is not None: pts = filter_score(pts, self.score_th)
+        ns = time.perf_counter_ns() - t0
+        return pts.copy(), ns           # extract 的 buffer 下一張就蓋掉
+
+    def close(self):
+        for slot in self.slots.values(): self.backend.free_slot(slot)
+        self.slots = {}
+
+def evaluate(runner, frames, refs, tol, border, shift, noise=0, warmup=1):
+    """一個設定跑完全部 frame -> 統計 dict (各比例是全部 frame 加總後再除)。"""
+    dx, dy = shift
+    rng = np.random.default_rng(0)     # 每個設定看到的雜訊都一樣
+    m = border
+    n_pts = n_ref = hit = rep = rep_n = 0
+    lat = []
+    for img in frames[:warmup]:
+        runner.run(img)                 # 第一次配置 slot / VDMA init 不算
+    for img, ref in zip(frames, refs):
+        H, W = img.shape
+        pts, ns = runner.run(img)
+        lat.append(ns)
+        a = inside(pts, m, m, W - m, H - m)
+        r = inside(ref, m, m, W - m, H - m)
+        ia, _ = match_points(a[:, :2], r[:, :2], tol)
+        n_pts += len(a); n_ref += len(r); hit += len(ia)
+        if dx or dy:
+            p2, _ = runner.run(shifted(img, dx, dy, noise, rng))
+            # 共同區域 (原圖座標)：平移後仍在畫面內、離兩邊的邊界都 >= border
+            a = inside(pts, m, m, W - dx - m, H - dy - m)
+            b = inside(p2, dx + m, dy + m, W - m, H - m).astype(np.int64)
+            b[:, 0] -= dx; b[:, 1] -= dy
+            ia, _ = match_points(a[:, :2], b[:, :2], tol)
+            rep += len(ia); rep_n += min(len(a), len(b))
+    ms = np.array(lat) / 1e6
+    n = len(lat)
+    return dict(frames=n, corners=round(n_pts / max(n, 1), 1), ref_corners=round(n_ref / max(n, 1), 1),
+                repeat=round(rep / rep_n, 4) if rep_n else None,
+                precision=round(hit / n_pts, 4) if n_pts else None,
+                recall=round(hit / n_ref, 4) if n_ref else None,
+                p50=round(float(np.percentile(ms, 50)), 3), p95=round(float(np.percentile(ms, 95)), 3),
+                p99=round(float(np.percentile(ms, 99)), 3))
+
+def open_fpga(bit):
+    from pynq import Overlay, MMIO
+    ol = Overlay(bit); ol.download()
+    vdma_name = [k for k in ol.ip_dict.keys() if "vdma" in k.lower()][0]
+    return MMIO(ol.ip_dict[vdma_name]["phys_addr"], ol.ip_dict[vdma_name]["addr_range"])
+
+def meets(r, args):
+    bars = (("recall", args.min_recall), ("precision", args.min_precision), ("repeat", args.min_repeat))
+    return all(v is None or (r[k] is not None and r[k] >= v) for k, v in bars)
+
+def print_table(rows, best=None):
+    fmt = lambda v: "-" if v is None else f"{v:.3f}"
+    print(f"  {'backend':<7} {'config':<32} {'corners':>8} {'repeat':>7} {'prec':>6} {'recall':>6} "
+          f"{'p50':>8} {'p95':>8} {'p99':>8}")
+    for r in rows:
+        mark = " *" if r is best else ""
+        print(f"  {r['backend']:<7} {r['config']:<32} {r['corners']:>8.1f} {fmt(r['repeat']):>7} "
+              f"{fmt(r['precision']):>6} {fmt(r['recall']):>6} {r['p50']:>8.3f} {r['p95']:>8.3f} {r['p99']:>8.3f}{mark}")
+
+def main():
+    ints = lambda s: [int(v) for v in s.split(",") if v != ""]
+    ap = argparse.ArgumentParser(description="Sweep backends and parameters: corner quality vs latency")
+    ap.add_argument("--source", default="synthetic", help="'synthetic', an image directory or a .fslog session log")
+    ap.add_argument("--size", default=None, help="WxH (frames are resized; synthetic default 640x480)")
+    ap.add_argument("--frames", type=int, default=30)
+    ap.add_argument("--backends", default="emu,cpu", help="Comma list of fpga, emu, cpu")
+    ap.add_argument("--bit", help="[fpga] bitstream")
+    ap.add_argument("--max-w", type=int, default=1024, help="[fpga/emu] MAX_W of the IP")
+    ap.add_argument("--max-h", type=int, default=768, help="[fpga/emu] MAX_H of the IP")
+    ap.add_argument("--ini-th", type=ints, default=[20], help="[emu] FAST_INI_TH values")
+    ap.add_argument("--min-th", type=ints, default=[7], help="[emu] FAST_MIN_TH values")
+    ap.add_argument("--tie-mode", type=ints, default=[1], help="[emu] NMS_TIE_MODE values")
+    ap.add_argument("--score-th", type=ints, default=[0],
+                    help="[fpga/emu] host-side score thresholds (0 = keep all), as the adaptive controller applies")
+    ap.add_argument("--threshold", type=ints, default=[20], help="[cpu] FAST threshold values")
+    ap.add_argument("--cpu-threads", type=int, default=0, help="[cpu] worker threads (0 = all cores)")
+    ap.add_argument("--ref-threshold", type=int, default=20, help="Threshold of the OpenCV FAST reference")
+    ap.add_argument("--tol", type=float, default=1.5, help="Match radius in pixels")
+    ap.add_argument("--border", type=int, default=4, help="Ignore corners this close to the image edge")
+    ap.add_argument("--shift", default="3,2", help="DX,DY shift for repeatability (0,0 = skip)")
+    ap.add_argument("--noise", type=int, default=2, help="+- uniform noise added to the shifted copy")
+    ap.add_argument("--min-recall", type=float, default=None)
+    ap.add_argument("--min-precision", type=float, default=None)
+    ap.add_argument("--min-repeat", type=float, default=None)
+    ap.add_argument("--rank", choices=["p50", "p95", "p99"], default="p50",
+                    help="Latency used to pick the fastest configuration that meets the bars")
+    ap.add_argument("--json", default=None, help="Write the table as JSON")
+    ap.add_argument("--csv", default=None, help="Write the table as CSV")
+    args = ap.parse_args()
+    args.backends = [b for b in args.backends.split(",") if b]
+    for b in args.backends:
+        if b not in ("fpga", "emu", "cpu"): ap.error(f"unknown backend: {b}")
+    if "fpga" in args.backends and not args.bit:
+        ap.error("--bit is required for --backend fpga")
+    shift = tuple(ints(args.shift))
+    if len(shift) != 2 or min(shift) < 0:
+        ap.error("--shift expects DX,DY >= 0")
+    size = tuple(map(int, args.size.lower().split("x"))) if args.size else None
+
+    from backends import make_backend
+    from startup import warm_kernels
+    frames = load_frames(args.source, args.frames, size)
+    refs = reference(frames, args.ref_threshold)
+    res = sorted({f"{f.shape[1]}x{f.shape[0]}" for f in frames})
+    print(f"[Sweep] {len(frames)} frames ({', '.join(res)}) from {args.source}, reference OpenCV FAST "
+          f"th={args.ref_threshold} ({np.mean([len(r) for r in refs]):.1f} corners/frame), tol {args.tol} px")
+    mmio = open_fpga(args.bit) if "fpga" in args.backends else None
+    rows = []
+    warmed = set()
+    for kind, label, params, sth in configs(args):
+        backend = make_backend(kind, mmio=mmio, **params)
+        if kind not in warmed:
+            warm_kernels(dict(backend=backend, row_skip=False))
+            warmed.add(kind)
+        runner = Runner(backend, sth)
+        try:
+            r = evaluate(runner, frames, refs, args.tol, args.border, shift, args.noise)
+        finally:
+            runner.close()
+        r = dict(backend=kind, config=label, **r)
+        rows.append(r)
+        print(f"[Sweep] {kind} {label}: {r['corners']} corners, p50 {r['p50']:.3f} ms")
+
+    bars = any(v is not None for v in (args.min_recall, args.min_precision, args.min_repeat))
+    ok = [r for r in rows if meets(r, args)]
+    best = min(ok, key=lambda r: r[args.rank]) if ok and bars else None
+    print_table(rows, best)
+    if bars:
+        if best is None:
+            print("[Sweep] no configuration meets the quality bar")
+        else:
+            print(f"[Sweep] fastest meeting the bar ({args.rank}): {best['backend']} {best['config']} "
+                  f"({best[args.rank]:.3f} ms)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(source=args.source, frames=len(frames), ref_threshold=args.ref_threshold, tol=args.tol,
+                           border=args.border, shift=shift, noise=args.noise, rows=rows), f, indent=2)
+        print(f"[Sweep] wrote {args.json}")
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ["backend"])
+            w.writeheader(); w.writerows(rows)
+        print(f"[Sweep] wrote {args.csv}")
+
+if __name__ == "__main__":
+    main()
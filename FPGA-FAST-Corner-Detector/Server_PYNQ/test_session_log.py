@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# session_log 的錄製 / 重播：0 個角點的 frame (平坦畫面) 也要寫得進去、讀得回來
+#   python3 -m pytest -q test_session_log.py
+import numpy as np
+from session_log import SessionWriter, SessionLog, replay, diff_corners
+from backends import make_backend
+from latency import STAGES
+from corners import CornerExtractor
+
+def frames():
+    rng = np.random.default_rng(0)
+    tex = rng.integers(0, 256, (120, 160), dtype=np.uint8)
+    flat = np.full((120, 160), 128, dtype=np.uint8)         # FAST 找不到任何角點
+    return [tex, flat, tex, flat]
+
+def record(path, backend, imgs, dedup=False):
+    w = SessionWriter(str(path), dict(backend=backend.name, stages=list(STAGES)), dedup=dedup)
+    slot = backend.alloc_slot(*imgs[0].shape)
+    extract = CornerExtractor()
+    for fid, img in enumerate(imgs):
+        slot['plane'][:] = img
+        slot['t'] = {}
+        slot['incr'] = None
+        backend.prepare(slot)
+        backend.run(slot)
+        pts, truncated = backend.collect(slot, extract)
+        w.add(fid, *img.shape, slot['plane'], pts, dict(slot['t'], total=1), fid * 1000, truncated=truncated)
+    w.close()
+
+def test_empty_frame_roundtrip(tmp_path):
+    backend = make_backend("cpu", cpu_threads=1)
+    imgs = frames()
+    for dedup in (False, True):
+        path = tmp_path / f"s{int(dedup)}.fslog"
+        record(path, backend, imgs, dedup)
+        log = SessionLog(str(path))
+        assert len(log) == len(imgs)
+        assert len(np.fromfile(str(path) + ".idx", dtype="<u8")) == len(imgs)
+        for r, img in zip(log, imgs):
+            assert np.array_equal(r['plane'], img)
+        assert len(log[0]['pts']) > 0 and len(log[1]['pts']) == 0 and len(log[3]['pts']) == 0
+        # 重播 (另存一份) 的角點與錄到的相同，包括空的那幾張
+        out = tmp_path / f"r{int(dedup)}.fslog"
+        d = diff_corners((r['pts'], pts) for r, pts, t in replay(log, backend, save=str(out)))
+        assert d['frames'] == len(imgs) and d['identical'] == len(imgs)
+        again = SessionLog(str(out))
+        assert [len(r['pts']) for r in again] == [len(r['pts']) for r in log]
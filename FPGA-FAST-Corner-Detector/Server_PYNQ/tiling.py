@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# tiling.py  -  超過 IP 的 MAX_W x MAX_H 的 frame：切成 tile 依序送進板子
+#
+# top_fast_nms_to_dma 合成時固定 MAX_W / MAX_H，更大的 frame 直接給 VDMA
+# 只會拿到錯的結果。TiledBackend 包住 fpga / emu backend：
+#   - 放得下的 frame 完全照原本的 slot 流程
+#   - 放不下的 frame 切成同尺寸的 tile，在 scheduler 的 worker 上一張接一張
+#     跑 (prepare -> run -> 抽角點)，最後合併。tile 用的 CMA slot (兩個輪流)
+#     在 run 裡向 SlotPool 借、跑完還回去：算在 --cma-budget-mb 裡，idle 時
+#     跟其他 slot 一樣會被 evict，同尺寸的下一張直接從 pool 拿回來
+# tile 之間要重疊多少是由 IP 的邊界行為決定的 (見 fast_emu.py)：
+#   - FAST 分數只在 tile 內 y = 3..h-4 有效，而且 y == 3 讀到的是上一張
+#     留在 BRAM 的 row，所以可信的分數從 y = 4 開始；x = 3..w-4
+#   - NMS 中心在 x = 3..w-5、y = 3..h-5，3x3 的鄰居分數也要可信
+#   - NMS tie 的 parity 用的是 tile 內座標，tile 原點要是偶數才與整張一致
+# 所以每個 tile 只「擁有」x >= 原點+5、y >= 原點+6 之後到下一個 tile 的同一
+# 位置為止的角點 (APPLY_NEG1=0 時輸出座標多 1 也涵蓋在內)；相鄰 tile 至少
+# 重疊 9 columns / 10 rows。每個角點只由一個 tile 回報，座標加回原點後依
+# raster 順序排好，與同一個 IP 一次做完整張的結果相同 (整張最上面 y = 3, 4
+# 兩列本來就取決於上一張 frame，除外)。
+# ============================================================================
+import time
+import numpy as np
+from corners import CornerExtractor
+from backends import recv_plane
+from bufpool import SlotPool
+
+OWN_X, OWN_Y = 5, 6             # tile 擁有的角點從原點 + OWN 開始
+
+def _axis(size, max_size, own):
+    # -> (tile 大小, [原點...])；一個 tile 放得下就是 (size, [0])
+    if size <= max_size:
+        return size, [0]
+    t = max_size if (size - max_size) % 2 == 0 else max_size - 1   # 最後一個原點 size - t 也要是偶數
+    step = (t - own - 4) & ~1                                       # 見上面：重疊至少 own + 4
+    origins = list(range(0, size - t, step)) + [size - t]
+    return t, origins
+
+def tile_grid(H, W, max_h, max_w):
+    """-> (th, tw, [(oy, ox, y_lo, y_hi, x_lo, x_hi), ...])，擁有範圍是整張座標。"""
+    th, oys = _axis(H, max_h, OWN_Y)
+    tw, oxs = _axis(W, max_w, OWN_X)
+    def own(origins, size, m):
+        lo = [0] + [o + m for o in origins[1:]]
+        return list(zip(origins, lo, lo[1:] + [size]))
+    return th, tw, [(oy, ox, ylo, yhi, xlo, xhi)
+                    for oy, ylo, yhi in own(oys, H, OWN_Y) for ox, xlo, xhi in own(oxs, W, OWN_X)]
+
+class TiledBackend:
+    def __init__(self, inner, max_h, max_w):
+        self.inner = inner
+        self.max_h, self.max_w = max_h, max_w
+        self.name, self.tag = inner.name, inner.tag
+        self.extract = CornerExtractor()        # 只在 worker thread 上用
+        self.pool = SlotPool(self)              # tile 的 slot 從這裡借；server 的 pool 建好後換成那個
+
+    def __getattr__(self, k):
+        if k == "inner": raise AttributeError(k)
+        return getattr(self.inner, k)           # waiter 等其餘屬性照舊
+
+    def fits(self, H, W):
+        return H <= self.max_h and W <= self.max_w
+
+    def alloc_slot(self, H, W):
+        if self.fits(H, W):
+            return self.inner.alloc_slot(H, W)
+        th, tw, tiles = tile_grid(H, W, self.max_h, self.max_w)
+        return dict(plane=np.empty((H, W), dtype=np.uint8), shape=(H, W), t={},
+                    tiles=tiles, tile_shape=(th, tw), rec=np.empty((4096, 4), dtype="<u2"), n=0)
+
+    def free_slot(self, slot):
+        if 'tiles' not in slot:
+            return self.inner.free_slot(slot)
+
+    def use_pool(self, pool):
+        self.pool = pool        # SlotPool 建立時呼叫 (bufpool.py)
+
+    def _tile_slots(self, shape):
+        # 兩個 tile slot 輪流用；pool.acquire 會走回 alloc_slot，tile 一定放得下
+        a = self.pool.acquire(*shape)
+        try: b = self.pool.acquire(*shape)
+        except Exception:
+            self.pool.release(a); raise
+        for sub in (a, b):
+            sub['stream'] = None; sub['threshold'] = None   # 可能是連線還回來的 slot
+        return a, b
+
+    def slot_bytes(self, H, W):
+        if self.fits(H, W):
+            return self.inner.slot_bytes(H, W)
+        return H * W            # tile 的 CMA slot 是 pool 裡的另外兩組，各自計算
+
+    def receive(self, conn, slot, recv):
+        if 'tiles' not in slot:
+            return self.inner.receive(conn, slot, recv)
+        recv_plane(conn, slot, recv)
+
+    def prepare(self, slot):
+        if 'tiles' not in slot:
+            self.inner.prepare(slot)        # 整張 frame 的 copy-in 在 run 裡逐 tile 做
+
+    def run(self, slot):
+        if 'tiles' not in slot:
+            return self.inner.run(slot)
+        t = slot['t']; plane = slot['plane']
+        subs = self._tile_slots(slot['tile_shape'])
+        try:
+            n, parse_ns = self._run_tiles(slot, subs)
+        finally:
+            for sub in subs: self.pool.release(sub)
+        # tile 是一塊一塊回來的，排回整張的 raster 順序
+        t0 = time.perf_counter_ns()
+        rec = slot['rec'][:n]
+        order = np.argsort((rec[:, 1].astype(np.uint32) << 16) | rec[:, 0], kind="stable")
+        rec[:] = rec[order]
+        slot['n'] = n
+        t['tile_parse'] = parse_ns + time.perf_counter_ns() - t0
+
+    def _run_tiles(self, slot, subs):
+        t = slot['t']; plane = slot['plane']
+        n = 0; parse_ns = 0
+        for k, (oy, ox, ylo, yhi, xlo, xhi) in enumerate(slot['tiles']):
+            sub = subs[k & 1]
+            th, tw = sub['shape']
+            sub['t'] = {}
+            np.copyto(sub['plane'], plane[oy:oy + th, ox:ox + tw])
+            self.inner.prepare(sub)
+            self.inner.run(sub)
+            for s, ns in sub['t'].items():
+                t[s] = t.get(s, 0) + ns
+            t0 = time.perf_counter_ns()
+            pts, _ = self.inner.collect(sub, self.extract)
+            gx = pts[:, 0] + ox; gy = pts[:, 1] + oy
+            keep = (gx >= xlo) & (gx < xhi) & (gy >= ylo) & (gy < yhi)
+            m = int(np.count_nonzero(keep))
+            if n + m > len(slot['rec']):
+                rec = np.empty((max(n + m, 2 * len(slot['rec'])), 4), dtype="<u2")
+                rec[:n] = slot['rec'][:n]; slot['rec'] = rec
+            out = slot['rec'][n:n + m]
+            out[:] = pts[keep]
+            out[:, 0] += ox; out[:, 1] += oy
+            n += m
+            parse_ns += time.perf_counter_ns() - t0
+        return n, parse_ns
+
+    def collect(self, slot, extract):
+        if 'tiles' not in slot:
+            return self.inner.collect(slot, extract)
+        n = slot['n']
+        extract.last_total = n
+        cap = len(extract.out) if extract.fixed else n      # --max-corners
+        return slot['rec'][:min(n, cap)], n > cap
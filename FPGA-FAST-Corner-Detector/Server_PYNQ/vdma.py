@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# ============================================================================
+# vdma.py  -  AXI VDMA 控制與 CMA buffer (只有 FPGA backend 會 import)
+#   pynq 只在配置 CMA buffer 時才 import，register 層的函式可以直接對 mock MMIO 測
+# ============================================================================
+import time
+import numpy as np
+from corners import _jit
+
+# ===== VDMA register offsets =====
+MM2S_DMACR, MM2S_DMASR   = 0x00, 0x04
+MM2S_VSIZE, MM2S_HSIZE   = 0x50, 0x54
+MM2S_STRIDE              = 0x58
+MM2S_START_ADDR          = 0x5C
+
+S2MM_DMACR, S2MM_DMASR   = 0x30, 0x34
+S2MM_VSIZE, S2MM_HSIZE   = 0xA0, 0xA4
+S2MM_STRIDE              = 0xA8
+S2MM_START_ADDR          = 0xAC
+
+DMACR_RS, DMACR_IOC_IRQ  = 1 << 0, 1 << 12
+DMASR_IOC                = 1 << 12
+
+# ================= VDMA & Reset Functions =================
+def vdma_init(mmio, W, irq=False):
+    bpl = 8*W
+    mmio.write(MM2S_DMASR, 0xFFFFFFFF)
+    mmio.write(S2MM_DMASR, 0xFFFFFFFF)
+    mmio.write(MM2S_DMACR, DMACR_RS)  # RS=1
+    # irq=True：S2MM 寫完整幀時拉 interrupt (UIO 等待用)；S2MM 一定比 MM2S 晚完成
+    mmio.write(S2MM_DMACR, DMACR_RS | (DMACR_IOC_IRQ if irq else 0))
+    mmio.write(MM2S_STRIDE, bpl); mmio.write(MM2S_HSIZE, bpl)
+    mmio.write(S2MM_STRIDE, bpl); mmio.write(S2MM_HSIZE, bpl)
+
+def vdma_soft_reset(mmio, timeout_s=0.01):
+    # 簡單暴力重置：直接寫入 Reset bit
+    for off in (MM2S_DMACR, S2MM_DMACR):
+        mmio.write(off, mmio.read(off) | (1<<2))
+
+    # 等待重置完成
+    t0 = time.perf_counter()
+    while True:
+        r1 = mmio.read(MM2S_DMACR) & (1<<2)
+        r2 = mmio.read(S2MM_DMACR) & (1<<2)
+        if (r1|r2)==0: break
+        if (time.perf_counter()-t0) > timeout_s: break
+
+    # 清除狀態
+    mmio.write(MM2S_DMASR, 0xFFFFFFFF)
+    mmio.write(S2MM_DMASR, 0xFFFFFFFF)
+
+def vdma_start(mmio, in_phys, out_phys, H):
+    mmio.write(MM2S_DMASR, 0xFFFFFFFF)
+    mmio.write(S2MM_DMASR, 0xFFFFFFFF)
+    mmio.write(MM2S_START_ADDR + 0*4, in_phys  & 0xFFFFFFFF)
+    mmio.write(S2MM_START_ADDR + 0*4, out_phys & 0xFFFFFFFF)
+    mmio.write(S2MM_VSIZE, H)
+    mmio.write(MM2S_VSIZE, H)
+
+def poll_ioc(mmio):
+    # 兩個 channel 都 IOC 時清掉 IOC 並回傳 (s1, s2)，否則回傳 None
+    s1 = mmio.read(MM2S_DMASR)
+    s2 = mmio.read(S2MM_DMASR)
+    if (s1 & DMASR_IOC) and (s2 & DMASR_IOC):
+        # 清除 IOC
+        mmio.write(MM2S_DMASR, DMASR_IOC)
+        mmio.write(S2MM_DMASR, DMASR_IOC)
+        return s1, s2
+    return None
+
+def wait_ioc(mmio, timeout_s=2.0):
+    deadline = time.perf_counter_ns() + int(timeout_s*1e9)
+    while True:
+        st = poll_ioc(mmio)
+        if st is not None:
+            return st
+        if time.perf_counter_ns() > deadline:
+            raise TimeoutError("VDMA timeout")
+
+def alloc_io_slot(H, W):
+    # 一組 in/out CMA buffer；in 只用每個 64-bit word 的 byte 0 (gray)
+    from pynq import allocate
+    in_buf  = allocate((H, W), dtype=np.uint64, cacheable=1)
+    out_buf = allocate((H, W), dtype=np.uint64, cacheable=1)
+    in_bytes = in_buf.view(np.uint8).reshape(H, W, 8)
+    # in_words：同一塊 CMA 的 plain ndarray view，給 numba kernel (expand_rows) 用
+    return dict(in_buf=in_buf, out_buf=out_buf, in_words=in_buf.view(np.ndarray),
+                in_bytes=in_bytes, in_plane0=in_bytes[:, :, 0])
+
+def free_io_slot(slot):
+    try: slot['in_buf'].freebuffer(); slot['out_buf'].freebuffer()
+    except: pass
+
+def write_frame_header(ib, H, W):
+    # SOF word: byte1-2 = H, byte3-4 = W
+    ib[0,0,1] = (H & 0xFF); ib[0,0,2] = ((H >> 8) & 0xFF)
+    ib[0,0,3] = (W & 0xFF); ib[0,0,4] = ((W >> 8) & 0xFF)
+
+@_jit(fastmath=True)
+def expand_rows(src, words, r0, H, W):
+    # 剛收到的幾列 src (n, W) uint8 -> words[r0:r0+n]：gray 放 byte 0，整個 word 一次寫
+    # (其餘 byte 清 0，IP 不看)；r0 == 0 時順便在 SOF word 補上 H / W (同 write_frame_header)
+    n = src.shape[0]
+    for r in range(n):
+        for x in range(W):
+            words[r0 + r, x] = np.uint64(src[r, x])
+    if r0 == 0:
+        words[0, 0] |= (np.uint64(H) << np.uint64(8)) | (np.uint64(W) << np.uint64(24))